@@ -0,0 +1,343 @@
+"""Columnar, memory-mapped activity metadata store.
+
+Replaces the pickled list of activity dicts. Each column lives in its own file
+inside a directory:
+
+- numeric columns: ``<name>.npy`` (int64 or float64)
+- text columns: ``<name>.offsets.npy`` (int64, ``size + 1`` entries) plus
+  ``<name>.utf8`` (all values concatenated as UTF-8)
+
+``schema.json`` lists the columns in order. Files are opened with mmap, so
+several uvicorn workers on one host share the same pages, and a value is only
+decoded when a row view is asked for that field.
+
+Every save writes a new ``<path>.<generation>/`` directory and then points
+``<path>.current`` at it with ``os.replace``; the directory a reader has open
+is never renamed or rewritten. Older generations are removed on later saves.
+``publish_generation`` lets other files that must match the table (the
+vector store's FAISS and derived indexes) go into the same directory, so
+they are switched in the same step.
+"""
+import json
+import logging
+import math
+import operator
+import os
+import shutil
+import time
+from collections.abc import MutableMapping, Sequence
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_FILE = "schema.json"
+SCHEMA_VERSION = 1
+POINTER_SUFFIX = ".current"
+
+
+def _pointer_path(path: str) -> str:
+    return f"{path}{POINTER_SUFFIX}"
+
+
+def current_generation(path: str) -> Optional[str]:
+    """Generation that ``<path>.current`` points at, or None before the first save."""
+    try:
+        with open(_pointer_path(path), "r", encoding="utf-8") as f:
+            return json.load(f)["generation"]
+    except FileNotFoundError:
+        return None
+
+
+def _generation_time(generation: str) -> int:
+    try:
+        return int(generation.split("-", 1)[0])
+    except ValueError:
+        return 0
+
+
+def generation_directory(path: str, generation: str) -> str:
+    return f"{path}.{generation}"
+
+
+def resolve_directory(path: str) -> Optional[str]:
+    """Directory holding the current generation saved at ``path``, if any."""
+    generation = current_generation(path)
+    return generation_directory(path, generation) if generation is not None else None
+
+
+def publish_generation(path: str, write: Callable[[str, str], None]) -> str:
+    """Fill a new generation directory with ``write(directory, generation)`` and make it current.
+
+    Readers keep whatever generation they opened. The one that was current
+    before stays on disk for workers that are opening it right now; older
+    ones are removed (on Windows a directory still mapped by some worker
+    fails to delete and is retried by the next save).
+    """
+    generation = f"{time.time_ns()}-{os.getpid()}"
+    directory = generation_directory(path, generation)
+    os.makedirs(directory)
+    try:
+        write(directory, generation)
+        previous = current_generation(path)
+        tmp_pointer = f"{_pointer_path(path)}.{generation}.tmp"
+        with open(tmp_pointer, "w", encoding="utf-8") as f:
+            json.dump({"generation": generation}, f)
+        os.replace(tmp_pointer, _pointer_path(path))
+    except Exception:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+    if previous is not None:
+        _remove_generations(path, older_than=previous)
+    return generation
+
+
+def _column_kind(values: List[Any]) -> str:
+    """Pick the narrowest storage kind that holds every value of a column."""
+    present = [v for v in values if v is not None and not (isinstance(v, float) and math.isnan(v))]
+    if present and all(isinstance(v, (int, np.integer)) and not isinstance(v, bool) for v in present) \
+            and len(present) == len(values):
+        return "int"
+    if present and all(isinstance(v, (int, float, np.integer, np.floating)) and not isinstance(v, bool) for v in present):
+        return "float"
+    return "str"
+
+
+def _text(value: Any) -> str:
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    return str(value)
+
+
+class _TextColumn:
+    """Variable-length UTF-8 strings addressed through an offsets array."""
+
+    kind = "str"
+
+    def __init__(self, offsets: np.ndarray, data: np.ndarray):
+        self.offsets = offsets
+        self.data = data
+
+    @classmethod
+    def from_values(cls, values: Iterable[Any]) -> "_TextColumn":
+        encoded = [_text(v).encode("utf-8") for v in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        if encoded:
+            offsets[1:] = np.cumsum([len(b) for b in encoded])
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(offsets, data)
+
+    def get(self, row: int) -> str:
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return self.data[start:end].tobytes().decode("utf-8")
+
+    def save(self, directory: str, name: str) -> None:
+        np.save(os.path.join(directory, f"{name}.offsets.npy"), self.offsets)
+        with open(os.path.join(directory, f"{name}.utf8"), "wb") as f:
+            f.write(self.data.tobytes())
+
+    @classmethod
+    def open(cls, directory: str, name: str) -> "_TextColumn":
+        offsets = np.load(os.path.join(directory, f"{name}.offsets.npy"), mmap_mode="r")
+        data_path = os.path.join(directory, f"{name}.utf8")
+        # np.memmap cannot map an empty file
+        if os.path.getsize(data_path) == 0:
+            data = np.zeros(0, dtype=np.uint8)
+        else:
+            data = np.memmap(data_path, dtype=np.uint8, mode="r")
+        return cls(offsets, data)
+
+
+class _NumericColumn:
+    def __init__(self, values: np.ndarray, kind: str):
+        self.values = values
+        self.kind = kind
+
+    @classmethod
+    def from_values(cls, values: List[Any], kind: str) -> "_NumericColumn":
+        dtype = np.int64 if kind == "int" else np.float64
+        return cls(np.asarray([np.nan if v is None else v for v in values], dtype=dtype), kind)
+
+    def get(self, row: int):
+        value = self.values[row]
+        return int(value) if self.kind == "int" else float(value)
+
+    def save(self, directory: str, name: str) -> None:
+        np.save(os.path.join(directory, f"{name}.npy"), np.asarray(self.values))
+
+    @classmethod
+    def open(cls, directory: str, name: str, kind: str) -> "_NumericColumn":
+        return cls(np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r"), kind)
+
+
+class ActivityRow(MutableMapping):
+    """Lightweight dict-like view of one activity row.
+
+    Fields are decoded from the column store on access. Keys assigned by the
+    engine (``similarity_score``, ``_rl_boost``...) are kept in a small overlay,
+    so ``copy()`` never duplicates the stored fields.
+    """
+
+    __slots__ = ("_table", "_row", "_overlay")
+
+    def __init__(self, table: "ActivityTable", row: int, overlay: Optional[Dict[str, Any]] = None):
+        self._table = table
+        self._row = row
+        self._overlay = overlay if overlay is not None else {}
+
+    @property
+    def row(self) -> int:
+        """Position of this activity in the store (and its FAISS id)."""
+        return self._row
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._overlay:
+            return self._overlay[key]
+        column = self._table._columns.get(key)
+        if column is None:
+            raise KeyError(key)
+        return column.get(self._row)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self._overlay[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        if key in self._overlay:
+            del self._overlay[key]
+        elif key in self._table._columns:
+            raise TypeError(f"Cannot delete stored column '{key}' from an activity row")
+        else:
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self._table.column_names
+        for key in self._overlay:
+            if key not in self._table._columns:
+                yield key
+
+    def __len__(self) -> int:
+        return len(self._table.column_names) + sum(1 for k in self._overlay if k not in self._table._columns)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._overlay or key in self._table._columns
+
+    def copy(self) -> "ActivityRow":
+        return ActivityRow(self._table, self._row, dict(self._overlay))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.items())
+
+    def __repr__(self) -> str:
+        return f"ActivityRow({self._row}, {self.to_dict()!r})"
+
+
+class ActivityTable(Sequence):
+    """Read-only columnar activity metadata; indexing returns ``ActivityRow`` views."""
+
+    def __init__(self, columns: Dict[str, Any], size: int):
+        self._columns = columns
+        self.column_names = list(columns)
+        self._size = size
+
+    @classmethod
+    def from_records(cls, records: List[Dict[str, Any]]) -> "ActivityTable":
+        names: List[str] = []
+        for record in records:
+            for key in record:
+                if key not in names:
+                    names.append(key)
+        columns: Dict[str, Any] = {}
+        for name in names:
+            values = [record.get(name) for record in records]
+            kind = _column_kind(values)
+            if kind == "str":
+                columns[name] = _TextColumn.from_values(values)
+            else:
+                columns[name] = _NumericColumn.from_values(values, kind)
+        return cls(columns, len(records))
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        """True once a table has been saved at ``path``."""
+        return os.path.isfile(_pointer_path(path))
+
+    @classmethod
+    def open(cls, path: str) -> "ActivityTable":
+        """Open the current saved table; column files are memory-mapped, not read."""
+        directory = resolve_directory(path)
+        if directory is None:
+            raise FileNotFoundError(f"No activity metadata saved at {path}")
+        return cls.open_directory(directory)
+
+    @classmethod
+    def open_directory(cls, directory: str) -> "ActivityTable":
+        """Open the table written to one generation directory."""
+        with open(os.path.join(directory, SCHEMA_FILE), "r", encoding="utf-8") as f:
+            schema = json.load(f)
+        if schema.get("version") != SCHEMA_VERSION:
+            raise ValueError(f"Unsupported activity metadata version: {schema.get('version')}")
+        columns: Dict[str, Any] = {}
+        for column in schema["columns"]:
+            name, kind = column["name"], column["kind"]
+            if kind == "str":
+                columns[name] = _TextColumn.open(directory, name)
+            else:
+                columns[name] = _NumericColumn.open(directory, name, kind)
+        return cls(columns, int(schema["size"]))
+
+    def write(self, directory: str) -> None:
+        """Write the column files and schema into an existing ``directory``."""
+        for name, column in self._columns.items():
+            column.save(directory, name)
+        schema = {
+            "version": SCHEMA_VERSION,
+            "size": self._size,
+            "columns": [{"name": name, "kind": column.kind} for name, column in self._columns.items()],
+        }
+        with open(os.path.join(directory, SCHEMA_FILE), "w", encoding="utf-8") as f:
+            json.dump(schema, f, indent=2)
+
+    def save(self, path: str) -> str:
+        """Write the table as a new generation and make it current; returns the generation."""
+        return publish_generation(path, lambda directory, generation: self.write(directory))
+
+    def column(self, name: str) -> List[Any]:
+        """Decode every value of one column (for building load-time indexes)."""
+        column = self._columns.get(name)
+        if column is None:
+            return [None] * self._size
+        return [column.get(row) for row in range(self._size)]
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [ActivityRow(self, row) for row in range(*index.indices(self._size))]
+        row = operator.index(index)
+        if row < 0:
+            row += self._size
+        if not 0 <= row < self._size:
+            raise IndexError(f"Activity row {index} out of range")
+        return ActivityRow(self, row)
+
+    def __iter__(self) -> Iterator[ActivityRow]:
+        for row in range(self._size):
+            yield ActivityRow(self, row)
+
+
+def _remove_generations(path: str, older_than: str) -> None:
+    """Delete generation directories saved before ``older_than``.
+
+    Generations after it are kept: the current one, and any a concurrent save
+    is still writing.
+    """
+    parent, base = os.path.split(os.path.abspath(path))
+    cutoff = _generation_time(older_than)
+    for name in os.listdir(parent):
+        generation = name[len(base) + 1:]
+        if not name.startswith(f"{base}.") or not os.path.isdir(os.path.join(parent, name)):
+            continue
+        if _generation_time(generation) and _generation_time(generation) < cutoff:
+            shutil.rmtree(os.path.join(parent, name), ignore_errors=True)
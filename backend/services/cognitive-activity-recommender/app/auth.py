@@ -22,6 +22,8 @@ import jwt as pyjwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
+from app.config import settings
+
 logger = logging.getLogger(__name__)
 
 security = HTTPBearer()
@@ -114,3 +116,10 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
 
 async def get_current_user_id(current_user: dict = Depends(get_current_user)) -> str:
     return current_user["id"]
+
+
+async def get_admin_user(current_user: dict = Depends(get_current_user)) -> dict:
+    """Current user, if their JWT role is ``ADMIN_ROLE``; 403 otherwise."""
+    if current_user.get("role") != settings.admin_role:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin role required")
+    return current_user
@@ -0,0 +1,291 @@
+"""Offline replay benchmark for recommendation latency and ranking quality.
+
+Runs ``RecommendationEngine`` end to end (search, RL, filters, prompt, parse)
+against synthetic child profiles and outcome histories drawn from the activity
+CSV. No MongoDB or LLM is needed: the RL scorer is built from the synthetic
+history, and a replay LLM provider builds the real prompt and answers with the
+top-ranked candidates, so plan quality reflects the engine's ranking.
+
+Reports p50/p95 latency per pipeline stage and ranking metrics:
+
+- goal_match_rate: planned activities that target one of the child's goals
+- domain_diversity: distinct domains / planned activities
+- known_good_rate: planned activities with good outcomes in the child's history
+- poor_outcome_rate: planned activities with poor outcomes in the child's history
+- materials_match_rate: planned activities usable with the requested materials
+- llm_plan_parsed_rate: replayed LLM answers accepted by the parser (not replaced by the fallback plan)
+
+Run from the service directory after ``python app/load_activities.py``:
+
+    python app/benchmark_replay.py --profiles 200 --seed 7 --json results.json
+    python app/benchmark_replay.py --prompt-mode compact --prompt-budget 800
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+# Add parent directory to path so we can import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+
+from app.candidate_pipeline import CandidateFeatures
+from app.config import settings
+from app.llm_providers import LLMProvider, OllamaProvider
+from app.metrics import estimate_tokens
+from app.prompt_compaction import activity_alias
+from app.recommendation_engine import RecommendationEngine
+from app.reinforcement_learning import ActivityScorer
+from app.timing import STAGES, collect_timings, stage
+
+GOALS = ["attention", "memory", "social", "motor", "emotion"]
+AUTISM_LEVELS = ["Level 1", "Level 2", "Level 3"]
+COMMUNICATION_LEVELS = ["nonverbal", "limited", "verbal"]
+SENSITIVITY_LEVELS = ["low", "med", "high"]
+
+
+class ReplayLLMProvider(LLMProvider):
+    """Builds the real prompt, then returns the first candidates as a Warm-up/Core/Calming plan.
+
+    In compact prompt mode it answers with the activity aliases, as a model reading that prompt would.
+    """
+
+    def __init__(self, plan_size: int = 6):
+        self.plan_size = plan_size
+        self.prompt_tokens: List[int] = []
+        # Reuse the production prompt formatting (no connection is opened)
+        self._formatter = OllamaProvider()
+
+    async def generate_activity_plan(
+        self,
+        child_profile: Dict[str, Any],
+        activities: List[Dict[str, Any]],
+        plan_request: Dict[str, Any],
+        recent_outcomes: List[Dict[str, Any]],
+    ) -> str:
+        system_prompt, user_prompt = self._formatter._plan_prompts(
+            child_profile, activities, plan_request, recent_outcomes
+        )
+        self.prompt_tokens.append(estimate_tokens(system_prompt, user_prompt))
+        compact = settings.llm_prompt_mode == "compact"
+        with stage("llm"):
+            picks = [
+                {
+                    "activity_id": activity_alias(position) if compact else a["id"],
+                    "activity_name": a["activity_name"],
+                    "domain": a["domain"],
+                }
+                for position, a in enumerate(activities[:self.plan_size], 1)
+            ]
+            schedule = [
+                {"phase": "Warm-up", "order": 1, "activities": picks[:1]},
+                {"phase": "Core", "order": 2, "activities": picks[1:-1]},
+                {"phase": "Calming", "order": 3, "activities": picks[-1:]},
+            ]
+            return json.dumps({"plan_type": "Daily", "plan_name": "Replay plan", "schedule": schedule})
+
+
+def _split(value: Any) -> List[str]:
+    return [part.strip().lower() for part in str(value).split(",") if part.strip()]
+
+
+def _matches_goal(activity: Dict[str, Any], goals: List[str]) -> bool:
+    """Same goal test as RecommendationEngine._ensure_activity_variety."""
+    return CandidateFeatures(activity).matches_any_goal([goal.lower() for goal in goals])
+
+
+def build_scenarios(
+    activities: pd.DataFrame, count: int, history_size: int, rng: random.Random
+) -> List[Dict[str, Any]]:
+    """Synthetic profiles, plan requests and outcome histories sampled from the CSV."""
+    records = activities.to_dict("records")
+    now = datetime.utcnow()
+    scenarios = []
+    for n in range(count):
+        goals = rng.sample(GOALS, rng.randint(1, 3))
+        profile = {
+            "_id": f"benchmark-{n}",
+            "name": f"Child {n}",
+            "age": rng.randint(3, 14),
+            "autism_level": rng.choice(AUTISM_LEVELS),
+            "communication_level": rng.choice(COMMUNICATION_LEVELS),
+            "sensory_sensitivity": {key: rng.choice(SENSITIVITY_LEVELS) for key in ("sound", "light", "touch")},
+            "goals": goals,
+        }
+        plan_request = {
+            "budget": rng.choice(["low", "medium", "high"]),
+            # Materials a household actually has: the union of a few activities' materials
+            "available_materials": sorted({
+                m for record in rng.sample(records, 4) for m in _split(record.get("materials", ""))
+            }) if rng.random() < 0.5 else [],
+            "attention_level": rng.choice(["low", "medium", "high"]),
+            "environment": rng.choice(["home", "therapy", "school", "outdoor"]),
+            "plan_type": "daily",
+        }
+        # Goal-matching activities tend to go well, others less so, so the RL signal is learnable
+        outcomes = []
+        for record in rng.sample(records, history_size):
+            good = _matches_goal(record, goals) if rng.random() < 0.8 else rng.random() < 0.5
+            outcomes.append({
+                "profile_id": profile["_id"],
+                "activity_id": str(record["id"]),
+                "activity_name": record["activity_name"],
+                "engagement": rng.randint(4, 5) if good else rng.randint(1, 2),
+                "success": rng.randint(4, 5) if good else rng.randint(1, 2),
+                "stress": rng.randint(1, 2) if good else rng.randint(4, 5),
+                "completed_at": now - timedelta(days=rng.randint(0, 90)),
+            })
+        outcomes.sort(key=lambda o: o["completed_at"], reverse=True)
+        scenarios.append({"profile": profile, "plan_request": plan_request, "outcomes": outcomes})
+    return scenarios
+
+
+def plan_metrics(plan, activity_by_id: Dict[str, Dict[str, Any]], scenario: Dict[str, Any]) -> Dict[str, float]:
+    planned = [a for phase in plan.schedule for a in phase.activities]
+    rows = [activity_by_id.get(str(a.activity_id), {}) for a in planned]
+    if not rows:
+        return {}
+    goals = scenario["profile"]["goals"]
+    good = {o["activity_id"] for o in scenario["outcomes"] if o["success"] >= 4}
+    poor = {o["activity_id"] for o in scenario["outcomes"] if o["success"] <= 2}
+    ids = [str(a.activity_id) for a in planned]
+    metrics = {
+        "goal_match_rate": sum(_matches_goal(row, goals) for row in rows) / len(rows),
+        "domain_diversity": len({row.get("domain") for row in rows}) / len(rows),
+        "known_good_rate": sum(i in good for i in ids) / len(ids),
+        "poor_outcome_rate": sum(i in poor for i in ids) / len(ids),
+    }
+    available = [m.lower() for m in scenario["plan_request"]["available_materials"]]
+    if available:
+        metrics["materials_match_rate"] = sum(
+            any(a in m or m in a for m in _split(row.get("materials", "")) for a in available) for row in rows
+        ) / len(rows)
+    return metrics
+
+
+async def run_benchmark(
+    profiles: int, history_size: int, seed: int, rl_strategy: str, retrieval_mode: str
+) -> Dict[str, Any]:
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(backend_dir)  # Index files are resolved relative to the service directory
+    activities = pd.read_csv("autism_activity_dataset_1200_advanced.csv")
+    activity_by_id = {str(record["id"]): record for record in activities.to_dict("records")}
+    scenarios = build_scenarios(activities, profiles, history_size, random.Random(seed))
+
+    engine = RecommendationEngine()
+    llm_provider = ReplayLLMProvider()
+    engine._llm_provider = llm_provider
+    await engine.warm_up()
+    if engine.warmup_state.get("status") != "ready":
+        raise RuntimeError(f"Vector store warm-up failed: {engine.warmup_state}")
+
+    stage_samples: Dict[str, List[float]] = {name: [] for name in STAGES}
+    totals: List[float] = []
+    metric_samples: Dict[str, List[float]] = {}
+    failures = 0
+    for scenario in scenarios:
+        scorer = ActivityScorer(rl_strategy)
+        scorer.update_from_outcomes(scenario["outcomes"])
+        start = time.perf_counter()
+        try:
+            with collect_timings() as timings:
+                response = await engine.generate_for_profile(
+                    scenario["profile"],
+                    scenario["plan_request"],
+                    scenario["outcomes"][:10],
+                    retrieval={"mode": retrieval_mode} if retrieval_mode else None,
+                    activity_scorer=scorer,
+                )
+        except Exception as e:
+            failures += 1
+            print(f"Scenario {scenario['profile']['_id']} failed: {type(e).__name__}: {e}")
+            continue
+        totals.append((time.perf_counter() - start) * 1000)
+        for name, duration_ms in timings.durations_ms.items():
+            stage_samples.setdefault(name, []).append(duration_ms)
+        for name, value in plan_metrics(response.plan, activity_by_id, scenario).items():
+            metric_samples.setdefault(name, []).append(value)
+        metric_samples.setdefault("llm_plan_parsed_rate", []).append(float(response.plan.plan_name == "Replay plan"))
+    engine.close()
+
+    def percentiles(samples: List[float]) -> Dict[str, float]:
+        return {
+            "count": len(samples),
+            "p50_ms": round(float(np.percentile(samples, 50)), 3),
+            "p95_ms": round(float(np.percentile(samples, 95)), 3),
+        }
+
+    return {
+        "profiles": profiles,
+        "seed": seed,
+        "rl_strategy": rl_strategy,
+        "retrieval_mode": retrieval_mode or "default",
+        "mmr_lambda": settings.mmr_lambda,
+        "llm_candidate_count": settings.llm_candidate_count,
+        "prompt_mode": settings.llm_prompt_mode,
+        "prompt_token_budget": settings.llm_prompt_token_budget,
+        "failures": failures,
+        "latency": {
+            **{name: percentiles(samples) for name, samples in stage_samples.items() if samples},
+            "total": percentiles(totals) if totals else {},
+        },
+        "ranking": {name: round(float(np.mean(values)), 4) for name, values in metric_samples.items()},
+        "prompt_tokens_mean": round(float(np.mean(llm_provider.prompt_tokens)), 1) if llm_provider.prompt_tokens else 0.0,
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(
+        f"\nReplayed {report['profiles']} profiles (seed {report['seed']}, RL {report['rl_strategy']}, "
+        f"retrieval {report['retrieval_mode']}, MMR lambda {report['mmr_lambda']}, "
+        f"{report['llm_candidate_count']} LLM candidates, {report['prompt_mode']} prompt"
+        f"{' (budget ' + str(report['prompt_token_budget']) + ')' if report['prompt_token_budget'] else ''}, "
+        f"{report['failures']} failures)\n"
+    )
+    print(f"{'stage':<18}{'count':>7}{'p50 ms':>11}{'p95 ms':>11}")
+    for name, stats in report["latency"].items():
+        if stats:
+            print(f"{name:<18}{stats['count']:>7}{stats['p50_ms']:>11.3f}{stats['p95_ms']:>11.3f}")
+    print()
+    for name, value in report["ranking"].items():
+        print(f"{name:<22}{value:.4f}")
+    print(f"{'prompt_tokens_mean':<22}{report['prompt_tokens_mean']:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profiles", type=int, default=100, help="Number of synthetic profiles to replay")
+    parser.add_argument("--history", type=int, default=12, help="Logged outcomes per synthetic profile")
+    parser.add_argument("--seed", type=int, default=7, help="Seed for profile and outcome sampling")
+    parser.add_argument("--rl", choices=["heuristic", "thompson", "ucb"], default="heuristic", help="RL scorer strategy")
+    parser.add_argument("--retrieval", choices=["dense", "lexical", "hybrid"], default=None, help="Retrieval mode override")
+    parser.add_argument("--mmr-lambda", type=float, default=None, help="Override MMR_LAMBDA")
+    parser.add_argument("--llm-candidates", type=int, default=None, help="Override LLM_CANDIDATE_COUNT")
+    parser.add_argument("--prompt-mode", choices=["verbose", "compact"], default=None, help="Override LLM_PROMPT_MODE")
+    parser.add_argument("--prompt-budget", type=int, default=None, help="Override LLM_PROMPT_TOKEN_BUDGET (compact mode)")
+    parser.add_argument("--json", dest="json_path", help="Also write the report to this JSON file")
+    args = parser.parse_args()
+    if args.mmr_lambda is not None:
+        settings.mmr_lambda = args.mmr_lambda
+    if args.llm_candidates is not None:
+        settings.llm_candidate_count = args.llm_candidates
+    if args.prompt_mode is not None:
+        settings.llm_prompt_mode = args.prompt_mode
+    if args.prompt_budget is not None:
+        settings.llm_prompt_token_budget = args.prompt_budget
+
+    # Per-candidate logging would dominate the timings
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(run_benchmark(args.profiles, args.history, args.seed, args.rl, args.retrieval))
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
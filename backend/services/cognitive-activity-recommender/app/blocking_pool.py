@@ -0,0 +1,85 @@
+"""Dedicated thread pool for blocking work (embedding model, FAISS) called from async code."""
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class BlockingWorkPool:
+    """Runs blocking callables off the event loop with a fixed concurrency limit.
+
+    At most ``max_workers`` callables run at once; the rest wait in the executor
+    queue. Queue depth, active workers and wait times are tracked so they can be
+    reported alongside the other runtime stats.
+    """
+
+    def __init__(self, max_workers: int, name: str):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_queue_depth = 0
+        self._total_wait_seconds = 0.0
+        self._max_wait_seconds = 0.0
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run ``fn(*args, **kwargs)`` on the pool and await its result.
+
+        ``fn`` runs in a copy of the caller's context, so context variables such as
+        the request's stage timings are visible on the worker thread.
+        """
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        submitted_at = time.perf_counter()
+        with self._lock:
+            self.queued += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queued)
+
+        def task():
+            waited = time.perf_counter() - submitted_at
+            with self._lock:
+                self.queued -= 1
+                self.active += 1
+                self._total_wait_seconds += waited
+                self._max_wait_seconds = max(self._max_wait_seconds, waited)
+            ok = False
+            try:
+                result = context.run(fn, *args, **kwargs)
+                ok = True
+                return result
+            finally:
+                with self._lock:
+                    self.active -= 1
+                    if ok:
+                        self.completed += 1
+                    else:
+                        self.failed += 1
+
+        return await loop.run_in_executor(self._executor, task)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                "max_workers": self.max_workers,
+                "queue_depth": self.queued,
+                "active": self.active,
+                "max_queue_depth": self.max_queue_depth,
+                "completed": self.completed,
+                "failed": self.failed,
+                "avg_wait_ms": round(1000 * self._total_wait_seconds / finished, 2) if finished else 0.0,
+                "max_wait_ms": round(1000 * self._max_wait_seconds, 2),
+            }
+
+    def shutdown(self, wait: bool = False) -> None:
+        logger.info(f"Shutting down {self.name} pool")
+        self._executor.shutdown(wait=wait, cancel_futures=True)
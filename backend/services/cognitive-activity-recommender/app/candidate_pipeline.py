@@ -0,0 +1,168 @@
+"""Single-pass candidate filtering over pre-tokenized activity records.
+
+``CandidateFeatures`` holds the fields the recommendation filters look at,
+already lowercased and split (materials as a frozenset, age range as a tuple).
+The vector store builds them once per index load (``ActivityFeatureIndex``).
+
+``CandidatePipeline`` chains filter predicates and streaming stages as
+generators, so each candidate flows through every stage in one pass and no
+intermediate lists are built. Every dropped candidate is recorded with the
+stage and reason that removed it. While stage timings are collected, the
+time each stage spends on its own work (excluding the stages feeding it) is
+recorded under the stage name.
+"""
+import logging
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from app.timing import current_timings
+
+logger = logging.getLogger(__name__)
+
+
+def parse_age_range(age_range: Any) -> Optional[Tuple[int, int]]:
+    """Parse an age range like '4-6' into (min_age, max_age); None if it cannot be parsed."""
+    if not age_range or not isinstance(age_range, str) or "-" not in age_range:
+        return None
+    parts = age_range.split("-")
+    if len(parts) != 2:
+        return None
+    try:
+        return int(parts[0].strip()), int(parts[1].strip())
+    except ValueError:
+        return None
+
+
+def split_list(value: Any) -> List[str]:
+    """Lowercased, stripped items of a comma-separated string or a list."""
+    if isinstance(value, str):
+        return [item.strip().lower() for item in value.split(",") if item.strip()]
+    if isinstance(value, (list, tuple)):
+        return [str(item).strip().lower() for item in value if item]
+    return []
+
+
+class CandidateFeatures:
+    """Normalized filter fields of one activity."""
+
+    __slots__ = (
+        "row", "activity_id", "name", "domain", "goal", "skills", "materials",
+        "age_range", "autism_levels", "sensory_seeking",
+    )
+
+    def __init__(self, activity: Dict[str, Any], row: Optional[int] = None):
+        # Vector store row, when built by ActivityFeatureIndex (indexes the material postings)
+        self.row = row
+        self.activity_id = str(activity.get("id", ""))
+        self.name = str(activity.get("activity_name", "")).lower()
+        self.domain = str(activity.get("domain", "")).lower()
+        self.goal = str(activity.get("goal", "")).lower()
+        self.skills = tuple(split_list(activity.get("skills_targeted", "")))
+        self.materials = frozenset(split_list(activity.get("materials", "")))
+        self.age_range = parse_age_range(activity.get("age_range", ""))
+        # Kept as-is: profile "Level 1" is matched by containment in "Level 1 (mild support)"
+        autism_levels = activity.get("autism_level_suitability", "")
+        self.autism_levels = autism_levels if isinstance(autism_levels, str) else ""
+        sensory = activity.get("sensory_suitability", "")
+        self.sensory_seeking = isinstance(sensory, str) and "sensory-seeking" in sensory.lower()
+
+    def matches_any_goal(self, goals: Iterable[str]) -> bool:
+        """True if a (lowercased) profile goal appears in the goal, name or a targeted skill."""
+        return any(
+            goal in self.goal or goal in self.name or any(goal in skill for skill in self.skills)
+            for goal in goals
+        )
+
+
+class ActivityFeatureIndex:
+    """``CandidateFeatures`` for every row of the vector store metadata, built at load time."""
+
+    def __init__(self, activities: Sequence[Dict[str, Any]]):
+        self._features = [CandidateFeatures(activity, row) for row, activity in enumerate(activities)]
+
+    def get(self, activity: Dict[str, Any]) -> CandidateFeatures:
+        """Features for a search result; rows from another index generation are re-parsed."""
+        row = getattr(activity, "row", None)
+        if row is not None and 0 <= row < len(self._features):
+            features = self._features[row]
+            if features.activity_id == str(activity.get("id", "")):
+                return features
+        return CandidateFeatures(activity)
+
+
+Candidate = Tuple[Dict[str, Any], CandidateFeatures]
+# Returns None to keep the candidate, or the reason it is dropped
+Predicate = Callable[[CandidateFeatures], Optional[str]]
+Stage = Callable[[Iterator[Candidate], "CandidatePipeline"], Iterator[Candidate]]
+
+
+class _TimedStream:
+    """Iterator that accumulates the seconds spent producing each item, upstream included."""
+
+    def __init__(self, stream: Iterator[Candidate]):
+        self._stream = stream
+        self.seconds = 0.0
+
+    def __iter__(self) -> "_TimedStream":
+        return self
+
+    def __next__(self) -> Candidate:
+        start = time.perf_counter()
+        try:
+            return next(self._stream)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+
+class CandidatePipeline:
+    """Lazily chained candidate stages that record why each candidate was dropped."""
+
+    def __init__(self):
+        self._stages: List[Tuple[str, Stage]] = []
+        self.rejections: List[Tuple[str, str, str]] = []  # (activity_id, stage, reason)
+
+    def filter(self, stage_name: str, predicates: Sequence[Predicate]) -> "CandidatePipeline":
+        """Drop candidates failing any predicate (checked in order; the first failure is recorded)."""
+        def run(candidates: Iterator[Candidate], pipeline: "CandidatePipeline") -> Iterator[Candidate]:
+            for activity, features in candidates:
+                for predicate in predicates:
+                    reason = predicate(features)
+                    if reason is not None:
+                        pipeline.reject(features, stage_name, reason)
+                        break
+                else:
+                    yield activity, features
+
+        if predicates:
+            self._stages.append((stage_name, run))
+        return self
+
+    def then(self, stage_name: str, stage: Stage) -> "CandidatePipeline":
+        """Add a streaming stage; it may reorder candidates and calls ``reject`` for drops."""
+        self._stages.append((stage_name, stage))
+        return self
+
+    def reject(self, features: CandidateFeatures, stage_name: str, reason: str) -> None:
+        self.rejections.append((features.activity_id, stage_name, reason))
+
+    def run(self, candidates: Iterable[Candidate]) -> List[Dict[str, Any]]:
+        timings = current_timings()
+        stream: Iterator[Candidate] = iter(candidates)
+        if timings is None:
+            for _, stage in self._stages:
+                stream = stage(stream, self)
+            return [activity for activity, _ in stream]
+
+        # Each timer includes the stages before it; subtract the previous one for the stage's own time
+        timers = [_TimedStream(stream)]
+        for _, stage in self._stages:
+            timers.append(_TimedStream(stage(timers[-1], self)))
+        kept = [activity for activity, _ in timers[-1]]
+        for (stage_name, _), upstream, timer in zip(self._stages, timers, timers[1:]):
+            timings.add(stage_name, (timer.seconds - upstream.seconds) * 1000)
+        return kept
+
+    def rejection_counts(self) -> Dict[str, int]:
+        """Number of drops per ``stage:reason``, in the order they were first seen."""
+        return dict(Counter(f"{stage_name}:{reason}" for _, stage_name, reason in self.rejections))
@@ -1,3 +1,4 @@
+from pydantic import Field
 from pydantic_settings import BaseSettings
 from typing import Literal, Optional
 
@@ -10,6 +11,66 @@ class Settings(BaseSettings):
     ollama_endpoint: str = "http://localhost:11434/api/chat"
     ollama_model: str = "llama3.2:3b"  # Use 3B model by default (smallest, works on most systems)
     ollama_use_cpu: bool = False  # Set to True to force CPU mode (slower but uses RAM instead of VRAM)
+    # Shared keep-alive connection pool to Ollama
+    ollama_timeout_seconds: float = 120.0
+    ollama_max_connections: int = 10
+    ollama_max_keepalive_connections: int = 5
+    ollama_keepalive_expiry_seconds: float = 30.0
+    # LLM response cache keyed by model + prompt hash (repeat plan requests skip generation)
+    llm_cache_enabled: bool = True
+    llm_cache_size: int = 256
+    llm_cache_ttl_seconds: float = 3600.0
+    llm_cache_dir: Optional[str] = None  # Also keep responses on disk here (shared by workers, survives restarts)
+    llm_cache_disk_max_entries: int = 5000
+    # LLM admission control per worker: concurrent generations (0 = unlimited), fair wait queue, deadline
+    llm_max_concurrency: int = 2
+    llm_queue_size: int = 32
+    llm_max_requests_per_user: int = 2  # Queued or running
+    llm_queue_timeout_seconds: float = 30.0
+    # When no slot is available in time: serve the fallback plan, or fail with 503
+    llm_overload_action: Literal["fallback", "reject"] = "fallback"
+    # Query embedding cache in ActivityVectorStore (repeat plan requests skip the encoder)
+    query_embedding_cache_size: int = 512
+    query_embedding_cache_ttl_seconds: float = 3600.0
+    # Threads running encoder/FAISS work off the event loop (extra searches wait in the queue)
+    vector_store_max_workers: int = 2
+    # Load the model and FAISS index in the background at startup (see GET /ready)
+    warmup_on_startup: bool = True
+    # Seconds between checks for a newer activity index on disk (0 disables hot reload polling)
+    index_watch_interval_seconds: float = 30.0
+    # POST /recommend/admin/reload-index: JWT role allowed to call it, and minimum seconds between calls
+    admin_role: str = "admin"
+    index_reload_min_interval_seconds: float = 60.0
+    # Candidate retrieval: FAISS only, BM25 only, or both fused with reciprocal-rank fusion
+    retrieval_mode: Literal["dense", "lexical", "hybrid"] = "dense"
+    hybrid_dense_weight: float = 1.0
+    hybrid_lexical_weight: float = 1.0
+    hybrid_rrf_k: int = 60  # RRF damping constant: score = weight / (rrf_k + rank)
+    hybrid_candidate_depth: int = 100  # Hits taken from each ranking before fusing
+    # MMR ordering of the filtered candidates: relevance vs. redundancy (1.0 = relevance only)
+    mmr_lambda: float = 0.7
+    # Candidates listed in the LLM prompt (the MMR top-N); fewer means a shorter, cheaper prompt
+    llm_candidate_count: int = 20
+    # Candidate list encoding: verbose (multi-line per activity) or compact (one line each,
+    # short ID aliases and domain/difficulty lookup tables)
+    llm_prompt_mode: Literal["verbose", "compact"] = "verbose"
+    # Compact mode: approximate token budget for the candidate table; the lowest-ranked
+    # candidates are dropped until it fits (0 = no limit)
+    llm_prompt_token_budget: int = 0
+    # Activities whose name + steps shingles overlap at least this much (Jaccard) count as near-duplicates
+    near_duplicate_threshold: float = 0.95
+    # RL activity scoring: fixed-weight heuristic, or a bandit over time-decayed outcome rewards
+    rl_scorer: Literal["heuristic", "thompson", "ucb"] = "heuristic"
+    rl_half_life_days: float = Field(30.0, gt=0)  # An outcome counts half as much after this many days (bandits only)
+    rl_prior_strength: float = 2.0  # Pseudo-outcomes in the Beta(0.5 * s, 0.5 * s) prior
+    rl_ucb_exploration: float = 0.2  # Weight of the UCB exploration bonus
+    # Logging: records are written by a background thread; see app/logging_config.py
+    log_level: str = "INFO"
+    log_format: Literal["text", "json"] = "text"
+    log_sample_rate: float = 1.0  # Fraction of routine per-request [RL] summary lines kept
+    # Observability: Prometheus histograms at GET /metrics and per-stage Server-Timing on /recommend
+    metrics_enabled: bool = True
+    server_timing_header: bool = True
     # Optional fallback for JWT_SECRET_KEY env; omit default so it cannot drift from Flask's SECRET_KEY
     jwt_secret_key: Optional[str] = None
     # Common auth: same as autism-profile-builder SECRET_KEY so JWT from profile-builder is valid here
@@ -17,6 +17,10 @@ async def connect_to_mongo():
     await client.admin.command("ping")
     db.client = client
     logger.info("Connected to MongoDB")
+    # Per-profile RL scores are looked up and upserted by (profile_id, activity_id)
+    await client[settings.mongodb_db_name].activity_scores.create_index(
+        [("profile_id", 1), ("activity_id", 1)], unique=True
+    )
 
 
 async def close_mongo_connection():
@@ -0,0 +1,111 @@
+"""Precomputed structured-filter bitsets for the activity vector store."""
+import logging
+import threading
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Values produced by the profile schema; masks for these are built eagerly at load time
+AUTISM_LEVELS = ("Level 1", "Level 2", "Level 3")
+PROFILE_AGES = range(2, 19)
+
+
+class ActivityFilterIndex:
+    """Per-age, per-autism-level and per-sensory-class masks over activity rows.
+
+    Row ``i`` of every mask corresponds to row ``i`` of the vector store metadata
+    (and therefore to FAISS id ``i``), so a combined mask can be handed straight
+    to FAISS as an ID selector.
+    """
+
+    def __init__(self, activities: Sequence[Dict[str, Any]]):
+        self.size = len(activities)
+        self._lock = threading.Lock()
+
+        # Parse age ranges once; unparseable ranges are left open (lenient, as before)
+        self._age_min = np.full(self.size, -np.inf)
+        self._age_max = np.full(self.size, np.inf)
+        levels = []
+        sensory_seeking = np.zeros(self.size, dtype=bool)
+
+        for row, activity in enumerate(activities):
+            age_range = activity.get("age_range", "")
+            if isinstance(age_range, str) and "-" in age_range:
+                try:
+                    min_age, max_age = map(int, age_range.split("-"))
+                    self._age_min[row] = min_age
+                    self._age_max[row] = max_age
+                except ValueError:
+                    pass
+
+            sensory = activity.get("sensory_suitability", "")
+            if isinstance(sensory, str) and "sensory-seeking" in sensory.lower():
+                sensory_seeking[row] = True
+
+            level = activity.get("autism_level_suitability", "")
+            levels.append(level if isinstance(level, str) else "")
+
+        self._levels = levels
+        self._not_sensory_seeking = ~sensory_seeking
+        self._age_masks: Dict[Any, np.ndarray] = {}
+        self._level_masks: Dict[str, np.ndarray] = {}
+
+        for age in PROFILE_AGES:
+            self._age_mask(age)
+        for level in AUTISM_LEVELS:
+            self._level_mask(level)
+
+        logger.info(
+            f"Built filter index over {self.size} activities "
+            f"({len(self._age_masks)} age masks, {len(self._level_masks)} autism level masks, "
+            f"{int(sensory_seeking.sum())} sensory-seeking)"
+        )
+
+    def _age_mask(self, age) -> np.ndarray:
+        mask = self._age_masks.get(age)
+        if mask is None:
+            mask = (self._age_min <= age) & (age <= self._age_max)
+            with self._lock:
+                self._age_masks[age] = mask
+        return mask
+
+    def _level_mask(self, level: str) -> np.ndarray:
+        mask = self._level_masks.get(level)
+        if mask is None:
+            # Profile has "Level 1"; CSV has "Level 1 (mild support)", so match by containment
+            mask = np.fromiter((level in value for value in self._levels), dtype=bool, count=self.size)
+            with self._lock:
+                self._level_masks[level] = mask
+        return mask
+
+    def mask(self, filters: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """Combine the precomputed bitsets for ``filters``.
+
+        Returns ``None`` when no filter restricts the result set.
+        """
+        if not filters:
+            return None
+
+        masks = []
+
+        age = filters.get("age")
+        if isinstance(age, (int, float)) and not isinstance(age, bool):
+            masks.append(self._age_mask(age))
+
+        # If child has high sensitivity, avoid sensory-seeking activities
+        child_sensory = filters.get("sensory_sensitivity") or {}
+        if any(level == "high" for level in child_sensory.values()):
+            masks.append(self._not_sensory_seeking)
+
+        autism_level = filters.get("autism_level")
+        if autism_level:
+            masks.append(self._level_mask(str(autism_level)))
+
+        if not masks:
+            return None
+        combined = masks[0].copy()
+        for mask in masks[1:]:
+            combined &= mask
+        return combined
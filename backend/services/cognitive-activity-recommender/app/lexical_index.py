@@ -0,0 +1,133 @@
+"""BM25 inverted index used by the lexical search path of the vector store."""
+import logging
+import math
+import os
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"[a-z0-9_]+")
+FORMAT_VERSION = 1
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens longer than one character (same rules as the old lexical search)."""
+    return [token for token in _TOKEN_RE.findall(str(text).lower()) if len(token) > 1]
+
+
+class BM25Index:
+    """Okapi BM25 over the activity text representations.
+
+    Postings are stored in CSR form: the documents containing term ``t`` are
+    ``doc_ids[indptr[t]:indptr[t + 1]]``. Each posting already carries its full
+    BM25 weight (idf x saturated, length-normalised tf), so scoring a query is a
+    handful of NumPy scatter-adds over the postings of the query terms.
+    """
+
+    def __init__(
+        self,
+        vocabulary: Sequence[str],
+        indptr: np.ndarray,
+        doc_ids: np.ndarray,
+        weights: np.ndarray,
+        num_docs: int,
+        signature: str = "",
+    ):
+        self.term_ids: Dict[str, int] = {term: i for i, term in enumerate(vocabulary)}
+        self.vocabulary = list(vocabulary)
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.num_docs = num_docs
+        # Identifies the index generation this was built from (see ActivityVectorStore.disk_signature)
+        self.signature = signature
+
+    @classmethod
+    def build(cls, texts: Sequence[str], k1: float = 1.5, b: float = 0.75, signature: str = "") -> "BM25Index":
+        num_docs = len(texts)
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        doc_lengths = np.zeros(num_docs, dtype=np.float64)
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths[doc_id] = len(tokens)
+            counts: Dict[str, int] = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                postings.setdefault(token, []).append((doc_id, tf))
+
+        avg_length = float(doc_lengths.mean()) if num_docs else 0.0
+        vocabulary = sorted(postings)
+        indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        doc_ids: List[int] = []
+        weights: List[float] = []
+        for term_id, term in enumerate(vocabulary):
+            entries = postings[term]
+            df = len(entries)
+            idf = math.log(1.0 + (num_docs - df + 0.5) / (df + 0.5))
+            for doc_id, tf in entries:
+                norm = k1 * (1.0 - b + b * doc_lengths[doc_id] / avg_length) if avg_length else k1
+                doc_ids.append(doc_id)
+                weights.append(idf * tf * (k1 + 1.0) / (tf + norm))
+            indptr[term_id + 1] = len(doc_ids)
+
+        return cls(
+            vocabulary,
+            indptr,
+            np.asarray(doc_ids, dtype=np.int32),
+            np.asarray(weights, dtype=np.float32),
+            num_docs,
+            signature=signature,
+        )
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every document for ``query``."""
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for token in set(tokenize(query)):
+            term_id = self.term_ids.get(token)
+            if term_id is None:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            scores[self.doc_ids[start:end]] += self.weights[start:end]
+        return scores
+
+    def search(self, query: str, k: int, mask: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """Top ``k`` (row, score) pairs among rows allowed by ``mask``, best first."""
+        scores = self.scores(query)
+        rows = np.flatnonzero(mask) if mask is not None else np.arange(self.num_docs)
+        if len(rows) == 0 or k <= 0:
+            return []
+        # Stable sort keeps dataset order among equal scores
+        order = np.argsort(-scores[rows], kind="stable")[:k]
+        return [(int(rows[i]), float(scores[rows[i]])) for i in order]
+
+    def save(self, path: str) -> None:
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            version=np.array(FORMAT_VERSION),
+            vocabulary=np.array(self.vocabulary, dtype=str),
+            indptr=self.indptr,
+            doc_ids=self.doc_ids,
+            weights=self.weights,
+            num_docs=np.array(self.num_docs),
+            signature=np.array(self.signature),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["version"]) != FORMAT_VERSION:
+                raise ValueError(f"Unsupported BM25 index version: {int(data['version'])}")
+            return cls(
+                data["vocabulary"].tolist(),
+                data["indptr"],
+                data["doc_ids"],
+                data["weights"],
+                int(data["num_docs"]),
+                signature=str(data["signature"]),
+            )
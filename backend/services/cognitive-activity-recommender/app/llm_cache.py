@@ -0,0 +1,240 @@
+"""Content-addressed cache of LLM responses.
+
+Keys are a SHA-256 of the model name and the final system and user prompt,
+so a repeated plan request (page refresh, double submit) with the same
+profile, candidates, plan request and outcomes is answered without another
+generation. Entries expire after a TTL; memory holds a bounded LRU and an
+optional directory keeps responses across restarts and workers (one JSON file
+per key, pruned to a bounded count).
+
+Callers that want a fresh response wrap the call in ``bypass_llm_cache()``;
+the new response still replaces the cached one. Callers that must check a
+response before it is reused wrap the call in ``hold_llm_responses()`` and
+store what they accepted with ``LLMResponseCache.put_all``.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from app.config import settings
+from app.metrics import LLM_CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+_bypass: ContextVar[bool] = ContextVar("llm_cache_bypass", default=False)
+_held: ContextVar[Optional[Dict[str, str]]] = ContextVar("llm_cache_held", default=None)
+
+
+@contextmanager
+def bypass_llm_cache(enabled: bool = True) -> Iterator[None]:
+    """Skip cached LLM responses for the code run inside the block."""
+    token = _bypass.set(enabled)
+    try:
+        yield
+    finally:
+        _bypass.reset(token)
+
+
+def cache_bypassed() -> bool:
+    return _bypass.get()
+
+
+@contextmanager
+def hold_llm_responses() -> Iterator[Dict[str, str]]:
+    """Collect new responses generated inside the block, by key, instead of caching them."""
+    held: Dict[str, str] = {}
+    token = _held.set(held)
+    try:
+        yield held
+    finally:
+        _held.reset(token)
+
+
+def held_responses() -> Optional[Dict[str, str]]:
+    return _held.get()
+
+
+def cache_key(model: str, system_prompt: str, user_prompt: str) -> str:
+    payload = json.dumps([model, system_prompt, user_prompt], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """TTL + LRU cache of response texts, optionally backed by a directory."""
+
+    def __init__(
+        self,
+        max_size: int = 256,
+        ttl_seconds: float = 3600.0,
+        directory: Optional[str] = None,
+        max_disk_entries: int = 5000,
+    ):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.directory = directory
+        self.max_disk_entries = max_disk_entries
+        # Wall-clock timestamps so entries read back from disk expire the same way
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    async def get(self, key: str) -> Optional[str]:
+        if cache_bypassed():
+            with self._lock:
+                self.bypassed += 1
+            LLM_CACHE_REQUESTS.inc("bypass")
+            return None
+        entry = self._get_memory(key)
+        if entry is None and self.directory:
+            entry = await asyncio.to_thread(self._read_disk, key)
+            if entry is not None:
+                self._put_memory(key, entry)
+                with self._lock:
+                    self.disk_hits += 1
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        LLM_CACHE_REQUESTS.inc("miss" if entry is None else "hit")
+        return None if entry is None else entry[1]
+
+    async def put(self, key: str, response: str) -> None:
+        if not response:
+            return
+        entry = (time.time(), response)
+        self._put_memory(key, entry)
+        if self.directory:
+            try:
+                await asyncio.to_thread(self._write_disk, key, entry)
+            except OSError as e:
+                logger.warning(f"Could not write LLM cache entry to {self.directory}: {str(e)}")
+
+    async def put_all(self, responses: Dict[str, str]) -> None:
+        for key, response in responses.items():
+            await self.put(key, response)
+
+    def _fresh(self, entry: Tuple[float, str]) -> bool:
+        return time.time() - entry[0] <= self.ttl_seconds
+
+    def _get_memory(self, key: str) -> Optional[Tuple[float, str]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._fresh(entry):
+                self._entries.move_to_end(key)
+                return entry
+            if entry is not None:
+                del self._entries[key]
+            return None
+
+    def _put_memory(self, key: str, entry: Tuple[float, str]) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _read_disk(self, key: str) -> Optional[Tuple[float, str]]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            entry = (float(data["created_at"]), str(data["response"]))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable LLM cache entry {path}: {str(e)}")
+            return None
+        if not self._fresh(entry):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry
+
+    def _write_disk(self, key: str, entry: Tuple[float, str]) -> None:
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"created_at": entry[0], "response": entry[1]}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._prune_disk()
+
+    def _prune_disk(self) -> None:
+        """Drop the oldest files once the directory holds more than ``max_disk_entries``."""
+        files = [name for name in os.listdir(self.directory) if name.endswith(".json")]
+        if len(files) <= self.max_disk_entries:
+            return
+        paths = [os.path.join(self.directory, name) for name in files]
+        mtimes = {}
+        for path in paths:
+            try:
+                mtimes[path] = os.path.getmtime(path)
+            except OSError:
+                pass
+        for path in sorted(mtimes, key=mtimes.get)[:len(mtimes) - self.max_disk_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._lock:
+            self.evictions += max(len(mtimes) - self.max_disk_entries, 0)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "directory": self.directory,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_cache: Optional[LLMResponseCache] = None
+
+
+def get_llm_cache() -> Optional[LLMResponseCache]:
+    """The process-wide response cache, or None when ``LLM_CACHE_ENABLED`` is off."""
+    global _cache
+    if not settings.llm_cache_enabled:
+        return None
+    if _cache is None:
+        _cache = LLMResponseCache(
+            max_size=settings.llm_cache_size,
+            ttl_seconds=settings.llm_cache_ttl_seconds,
+            directory=settings.llm_cache_dir or None,
+            max_disk_entries=settings.llm_cache_disk_max_entries,
+        )
+    return _cache
@@ -1,16 +1,236 @@
-from abc import ABC, abstractmethod
-from typing import List, Dict, Any
+from abc import ABC
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Deque, Iterator, List, Dict, Any, Optional, Tuple
+import asyncio
+import json
 import logging
+import math
+import time
 import httpx
 from openai import AsyncOpenAI
 from app.config import settings
+from app.llm_cache import cache_key, get_llm_cache, held_responses
+from app.metrics import LLM_ADMISSIONS, estimate_tokens, record_prompt_tokens
 from app.plan_prompt_builder import build_therapist_plan_prompt
+from app.prompt_compaction import format_activities_compact
+from app.timing import stage
 
 logger = logging.getLogger(__name__)
 
 
+class LLMOverloadedError(Exception):
+    """No LLM slot for this request: the queue is full or the wait would pass the deadline."""
+
+    def __init__(self, message: str, retry_after_seconds: float):
+        super().__init__(message)
+        self.retry_after_seconds = retry_after_seconds
+
+
+_llm_user: ContextVar[str] = ContextVar("llm_user", default="anonymous")
+
+
+@contextmanager
+def llm_user(user_id: str) -> Iterator[None]:
+    """Attribute the LLM calls made inside the block to ``user_id`` (for per-user queue limits)."""
+    token = _llm_user.set(user_id or "anonymous")
+    try:
+        yield
+    finally:
+        _llm_user.reset(token)
+
+
+class LLMAdmissionController:
+    """Concurrency limit and fair wait queue in front of the LLM.
+
+    At most ``max_concurrent`` generations run at once (a local Ollama serves one
+    or two). Further calls wait in per-user queues that are served round-robin,
+    so one user's burst cannot starve the others. A call is refused at once when
+    the user already has ``max_per_user`` calls queued or running, when the queue
+    holds ``max_queue`` calls, or when its estimated wait (queue position times
+    the running average generation time) exceeds ``deadline_seconds``; a call
+    still waiting at the deadline is refused too. Limits are per worker process.
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int, max_per_user: int, deadline_seconds: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.deadline_seconds = deadline_seconds
+        self._active = 0
+        self._waiters: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self._per_user: Dict[str, int] = {}  # queued + running
+        self._avg_generation_seconds: Optional[float] = None
+
+    @property
+    def queued(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def estimated_wait_seconds(self, position: int) -> float:
+        """Expected wait for the ``position``-th call in line (0 until a generation has been timed)."""
+        if self._avg_generation_seconds is None:
+            return 0.0
+        return math.ceil(position / self.max_concurrent) * self._avg_generation_seconds
+
+    def _queue_order(self) -> List[Tuple[str, asyncio.Future]]:
+        """Waiters in the order they will be served (one per user per round)."""
+        order = []
+        queues = list(self._waiters.items())
+        for round_index in range(max((len(waiters) for _, waiters in queues), default=0)):
+            order.extend((user, waiters[round_index]) for user, waiters in queues if round_index < len(waiters))
+        return order
+
+    def _reject(self, result: str, message: str, position: int) -> LLMOverloadedError:
+        LLM_ADMISSIONS.inc(result)
+        retry_after = max(self.estimated_wait_seconds(position), 1.0)
+        logger.warning(f"LLM admission refused ({result}): {message}")
+        return LLMOverloadedError(message, retry_after)
+
+    @asynccontextmanager
+    async def slot(self, user: str) -> AsyncIterator[None]:
+        """Hold one generation slot for the block, waiting in the fair queue if needed."""
+        await self._acquire(user)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            # Exponential moving average of generation time, for wait estimates
+            if self._avg_generation_seconds is None:
+                self._avg_generation_seconds = elapsed
+            else:
+                self._avg_generation_seconds = 0.8 * self._avg_generation_seconds + 0.2 * elapsed
+            self._leave(user)
+            self._release_slot()
+
+    async def _acquire(self, user: str) -> None:
+        if self._per_user.get(user, 0) >= self.max_per_user:
+            raise self._reject("rejected_per_user", f"{self.max_per_user} plan requests already in progress", 1)
+        if self._active < self.max_concurrent and not self._waiters:
+            self._active += 1
+            self._per_user[user] = self._per_user.get(user, 0) + 1
+            LLM_ADMISSIONS.inc("immediate")
+            return
+
+        position = self.queued + 1
+        if position > self.max_queue:
+            raise self._reject("rejected_queue_full", f"LLM queue is full ({self.max_queue} waiting)", position)
+        estimated_wait = self.estimated_wait_seconds(position)
+        if estimated_wait > self.deadline_seconds:
+            raise self._reject(
+                "rejected_deadline",
+                f"estimated LLM queue wait {estimated_wait:.1f}s exceeds {self.deadline_seconds:.1f}s",
+                position,
+            )
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(user, deque()).append(future)
+        self._per_user[user] = self._per_user.get(user, 0) + 1
+        LLM_ADMISSIONS.inc("queued")
+        try:
+            with stage("llm_queue"):
+                await asyncio.wait_for(future, timeout=self.deadline_seconds)
+        except BaseException as e:
+            self._leave(user)
+            if future.done() and not future.cancelled():
+                self._release_slot()  # Granted just as the wait ended; pass the slot on
+            else:
+                future.cancel()
+                self._remove_waiter(user, future)
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._reject(
+                    "timed_out", f"waited {self.deadline_seconds:.1f}s for an LLM slot", self.queued + 1
+                ) from None
+            raise
+
+    def _leave(self, user: str) -> None:
+        self._per_user[user] -= 1
+        if not self._per_user[user]:
+            del self._per_user[user]
+
+    def _remove_waiter(self, user: str, future: asyncio.Future) -> None:
+        waiters = self._waiters.get(user)
+        if waiters is None:
+            return
+        try:
+            waiters.remove(future)
+        except ValueError:
+            pass
+        if not waiters:
+            del self._waiters[user]
+
+    def _release_slot(self) -> None:
+        self._active -= 1
+        while self._waiters and self._active < self.max_concurrent:
+            user, waiters = next(iter(self._waiters.items()))
+            future = waiters.popleft()
+            if waiters:
+                self._waiters.move_to_end(user)
+            else:
+                del self._waiters[user]
+            if not future.done():
+                self._active += 1
+                future.set_result(None)
+
+    def queue_status(self, user: str) -> Dict[str, Any]:
+        """Queue state, with the position and estimated wait of ``user``'s waiting calls."""
+        positions = [
+            {"position": position, "estimated_wait_seconds": round(self.estimated_wait_seconds(position), 1)}
+            for position, (waiting_user, _) in enumerate(self._queue_order(), 1)
+            if waiting_user == user
+        ]
+        return {**self.stats(), "your_queued_requests": positions}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "active": self._active,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "deadline_seconds": self.deadline_seconds,
+            "avg_generation_seconds": (
+                round(self._avg_generation_seconds, 2) if self._avg_generation_seconds is not None else None
+            ),
+        }
+
+
+_admission: Optional[LLMAdmissionController] = None
+
+
+def get_admission_controller() -> Optional[LLMAdmissionController]:
+    """The process-wide LLM admission controller, or None when ``LLM_MAX_CONCURRENCY`` is 0."""
+    global _admission
+    if settings.llm_max_concurrency <= 0:
+        return None
+    if _admission is None:
+        _admission = LLMAdmissionController(
+            max_concurrent=settings.llm_max_concurrency,
+            max_queue=settings.llm_queue_size,
+            max_per_user=settings.llm_max_requests_per_user,
+            deadline_seconds=settings.llm_queue_timeout_seconds,
+        )
+    return _admission
+
+
+@asynccontextmanager
+async def _llm_slot() -> AsyncIterator[None]:
+    admission = get_admission_controller()
+    if admission is None:
+        yield
+        return
+    async with admission.slot(_llm_user.get()):
+        yield
+
+
 class LLMProvider(ABC):
-    @abstractmethod
+    """Builds prompts, answers repeats from the response cache and waits for an LLM slot.
+
+    Subclasses implement ``_complete`` (and ``_stream_complete`` when the API
+    can stream); ``model`` is part of the cache key.
+    """
+    model: str = ""
+
     async def generate_activity_plan(
         self,
         child_profile: Dict[str, Any],
@@ -18,16 +238,99 @@ class LLMProvider(ABC):
         plan_request: Dict[str, Any],
         recent_outcomes: List[Dict[str, Any]],
     ) -> str:
-        pass
+        system_prompt, user_prompt = self._plan_prompts(child_profile, activities, plan_request, recent_outcomes)
+        return await self._cached_complete(system_prompt, user_prompt)
+
+    async def stream_activity_plan(
+        self,
+        child_profile: Dict[str, Any],
+        activities: List[Dict[str, Any]],
+        plan_request: Dict[str, Any],
+        recent_outcomes: List[Dict[str, Any]],
+    ) -> AsyncIterator[str]:
+        """Yield the plan response text as the model generates it (a cached response in one piece)."""
+        system_prompt, user_prompt = self._plan_prompts(child_profile, activities, plan_request, recent_outcomes)
+        cache = get_llm_cache()
+        key = cache_key(self.model, system_prompt, user_prompt)
+        cached = await cache.get(key) if cache is not None else None
+        if cached is not None:
+            yield cached
+            return
+
+        chunks = []
+        async with _llm_slot():
+            with stage("llm"):
+                async for chunk in self._stream_complete(system_prompt, user_prompt):
+                    chunks.append(chunk)
+                    yield chunk
+        await self._store_response(key, "".join(chunks))
+
+    def _plan_prompts(
+        self,
+        child_profile: Dict[str, Any],
+        activities: List[Dict[str, Any]],
+        plan_request: Dict[str, Any],
+        recent_outcomes: List[Dict[str, Any]],
+    ) -> Tuple[str, str]:
+        """System and user prompt for a plan (centralized prompt builder, provider or compact formatting)."""
+        compact = settings.llm_prompt_mode == "compact"
+        with stage("prompt_build"):
+            system_prompt, user_prompt = build_therapist_plan_prompt(
+                child_profile=child_profile,
+                activities=activities,
+                plan_request=plan_request,
+                recent_outcomes=recent_outcomes,
+                format_activities_fn=format_activities_compact if compact else self._format_activities,
+                format_outcomes_fn=self._format_outcomes,
+            )
+        logger.info(
+            f"Plan prompt: {len(activities)} candidates, {settings.llm_prompt_mode} encoding, "
+            f"~{estimate_tokens(system_prompt, user_prompt)} tokens"
+        )
+        return system_prompt, user_prompt
     
     async def generate_text(self, system_prompt: str, user_prompt: str) -> str:
         """Generate text from system and user prompts (for two-stage planning)."""
-        # Default implementation uses OpenAI/Ollama chat API
-        raise NotImplementedError("Subclass must implement generate_text")
+        return await self._cached_complete(system_prompt, user_prompt)
+
+    async def _cached_complete(self, system_prompt: str, user_prompt: str) -> str:
+        cache = get_llm_cache()
+        key = cache_key(self.model, system_prompt, user_prompt)
+        if cache is not None:
+            cached = await cache.get(key)
+            if cached is not None:
+                return cached
+        async with _llm_slot():
+            with stage("llm"):
+                content = await self._complete(system_prompt, user_prompt)
+        await self._store_response(key, content)
+        return content
+
+    async def _store_response(self, key: str, response: str) -> None:
+        """Cache a new response, or leave it to the caller inside ``hold_llm_responses()``."""
+        held = held_responses()
+        if held is not None:
+            held[key] = response
+            return
+        cache = get_llm_cache()
+        if cache is not None:
+            await cache.put(key, response)
+
+    async def _complete(self, system_prompt: str, user_prompt: str) -> str:
+        """One chat completion for the prompts (no caching)."""
+        raise NotImplementedError("Subclass must implement _complete")
+
+    async def _stream_complete(self, system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+        """Text fragments of one chat completion; defaults to the whole ``_complete`` response."""
+        yield await self._complete(system_prompt, user_prompt)
+
+    async def aclose(self) -> None:
+        """Release pooled connections (called from the application lifespan on shutdown)."""
 
 
 class OpenAIProvider(LLMProvider):
     def __init__(self):
+        self.model = "gpt-4-turbo-preview"
         self._client = None
     
     @property
@@ -38,26 +341,15 @@ class OpenAIProvider(LLMProvider):
             self._client = AsyncOpenAI(api_key=settings.openai_api_key)
         return self._client
 
-    async def generate_activity_plan(
-        self,
-        child_profile: Dict[str, Any],
-        activities: List[Dict[str, Any]],
-        plan_request: Dict[str, Any],
-        recent_outcomes: List[Dict[str, Any]],
-    ) -> str:
-        # Use centralized prompt builder
-        system_prompt, user_prompt = build_therapist_plan_prompt(
-            child_profile=child_profile,
-            activities=activities,
-            plan_request=plan_request,
-            recent_outcomes=recent_outcomes,
-            format_activities_fn=self._format_activities,
-            format_outcomes_fn=self._format_outcomes,
-        )
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
 
+    async def _complete(self, system_prompt: str, user_prompt: str) -> str:
         try:
             response = await self.client.chat.completions.create(
-                model="gpt-4-turbo-preview",
+                model=self.model,
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_prompt}
@@ -65,29 +357,40 @@ class OpenAIProvider(LLMProvider):
                 temperature=0.7,
                 max_tokens=4000,  # Increased for longer structured plans
             )
+            usage = getattr(response, "usage", None)
+            record_prompt_tokens(
+                usage.prompt_tokens if usage and usage.prompt_tokens else estimate_tokens(system_prompt, user_prompt)
+            )
             return response.choices[0].message.content
         except Exception as e:
             logger.error(f"OpenAI API error: {type(e).__name__}: {str(e)}")
             import traceback
             logger.error(traceback.format_exc())
             raise Exception(f"OpenAI API error: {str(e)}")
-    
-    async def generate_text(self, system_prompt: str, user_prompt: str) -> str:
-        """Generate text from system and user prompts."""
+
+    async def _stream_complete(self, system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+        prompt_tokens = None
         try:
-            response = await self.client.chat.completions.create(
-                model="gpt-4-turbo-preview",
+            stream = await self.client.chat.completions.create(
+                model=self.model,
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_prompt}
                 ],
                 temperature=0.7,
                 max_tokens=4000,
+                stream=True,
+                stream_options={"include_usage": True},
             )
-            return response.choices[0].message.content
+            async for chunk in stream:
+                if chunk.usage and chunk.usage.prompt_tokens:
+                    prompt_tokens = chunk.usage.prompt_tokens
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
         except Exception as e:
             logger.error(f"OpenAI API error: {type(e).__name__}: {str(e)}")
             raise Exception(f"OpenAI API error: {str(e)}")
+        record_prompt_tokens(prompt_tokens or estimate_tokens(system_prompt, user_prompt))
 
     def _format_activities(self, activities: List[Dict[str, Any]]) -> str:
         """Format activities list for LLM prompt with IDs for strict selection."""
@@ -147,144 +450,165 @@ class OllamaProvider(LLMProvider):
         # Check if CPU mode is requested via environment variable or config
         import os
         self.use_cpu = os.getenv("OLLAMA_NUM_GPU", "1") == "0" or getattr(settings, "ollama_use_cpu", False)
+        self._client: Optional[httpx.AsyncClient] = None
 
-    async def generate_activity_plan(
-        self,
-        child_profile: Dict[str, Any],
-        activities: List[Dict[str, Any]],
-        plan_request: Dict[str, Any],
-        recent_outcomes: List[Dict[str, Any]],
-    ) -> str:
-        # Use centralized prompt builder
-        system_prompt, user_prompt = build_therapist_plan_prompt(
-            child_profile=child_profile,
-            activities=activities,
-            plan_request=plan_request,
-            recent_outcomes=recent_outcomes,
-            format_activities_fn=self._format_activities,
-            format_outcomes_fn=self._format_outcomes,
-        )
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Shared client: connections to Ollama are kept alive and reused across plans."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=settings.ollama_timeout_seconds,
+                limits=httpx.Limits(
+                    max_connections=settings.ollama_max_connections,
+                    max_keepalive_connections=settings.ollama_max_keepalive_connections,
+                    keepalive_expiry=settings.ollama_keepalive_expiry_seconds,
+                ),
+            )
+        return self._client
 
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            try:
-                response = await client.post(
-                    self.endpoint,
-                    json={
-                        "model": self.model,
-                        "messages": [
-                            {"role": "system", "content": system_prompt},
-                            {"role": "user", "content": user_prompt}
-                        ],
-                        "stream": False,
-                        "options": {
-                            "temperature": 0.7,
-                            "num_predict": 4000,  # Increased for longer structured plans
-                        }
-                    },
-                )
-                response.raise_for_status()
-                result = response.json()
-                
-                # Ollama chat API returns message content
-                message = result.get("message", {})
-                content = message.get("content", "")
-                
-                if not content:
-                    logger.warning("Empty response from Ollama")
-                    raise Exception("Empty response from Ollama")
-                
-                return content
-            except httpx.ConnectError as e:
-                logger.error(f"Ollama connection error: {str(e)}")
-                error_msg = (
-                    f"Ollama is not running or not accessible at {self.endpoint}. "
-                    "Please ensure:\n"
-                    "1. Ollama is installed from https://ollama.ai\n"
-                    "2. Ollama service is running (check with 'ollama list')\n"
-                    "3. The model is pulled: 'ollama pull llama3.1'\n"
-                    "4. Ollama is accessible at http://localhost:11434"
-                )
-                raise Exception(error_msg) from e
-            except httpx.HTTPStatusError as e:
-                error_text = e.response.text
-                logger.error(f"Ollama HTTP error: {e.response.status_code} - {error_text}")
-                
-                # Parse error message if it's JSON
-                try:
-                    error_json = e.response.json()
-                    error_msg = error_json.get("error", error_text)
-                except:
-                    error_msg = error_text
-                
-                # Check for CUDA/GPU errors (including memory errors)
-                is_memory_error = "out of memory" in error_msg.lower() or "cudamalloc" in error_msg.lower()
-                is_cuda_error = "cuda" in error_msg.lower() and ("error" in error_msg.lower() or "terminated" in error_msg.lower())
-                
-                if is_memory_error or is_cuda_error:
-                    cpu_instructions = ""
-                    if not self.use_cpu:
-                        cpu_instructions = (
-                            "\n\n🔧 QUICK FIX - Restart Ollama in CPU mode:\n"
-                            "1. Stop Ollama completely (close window or Ctrl+C)\n"
-                            "2. Open a NEW terminal\n"
-                            "3. Run: set OLLAMA_NUM_GPU=0 && ollama serve (CMD)\n"
-                            "   Or: $env:OLLAMA_NUM_GPU='0'; ollama serve (PowerShell)\n"
-                            "   Or: Double-click backend\\start_ollama_cpu.bat\n"
-                            "4. Keep that window open, then restart FastAPI\n"
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _complete(self, system_prompt: str, user_prompt: str) -> str:
+        client = self.client
+        try:
+            response = await client.post(
+                self.endpoint,
+                json={
+                    "model": self.model,
+                    "messages": [
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    "stream": False,
+                    "options": {
+                        "temperature": 0.7,
+                        "num_predict": 4000,  # Increased for longer structured plans
+                    }
+                },
+            )
+            response.raise_for_status()
+            result = response.json()
+            record_prompt_tokens(result.get("prompt_eval_count") or estimate_tokens(system_prompt, user_prompt))
+            
+            # Ollama chat API returns message content
+            message = result.get("message", {})
+            content = message.get("content", "")
+            
+            if not content:
+                logger.warning("Empty response from Ollama")
+                raise Exception("Empty response from Ollama")
+            
+            return content
+        except httpx.ConnectError as e:
+            raise self._connect_error(e) from e
+        except httpx.HTTPStatusError as e:
+            raise self._http_status_error(e)
+        except Exception as e:
+            logger.error(f"Ollama API error: {type(e).__name__}: {str(e)}")
+            import traceback
+            logger.error(traceback.format_exc())
+            raise Exception(f"Ollama API error: {str(e)}")
+
+    async def _stream_complete(self, system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+        try:
+            # Streamed chat responses are NDJSON: one message fragment per line, then a "done" line
+            async with self.client.stream(
+                "POST",
+                self.endpoint,
+                json={
+                    "model": self.model,
+                    "messages": [
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    "stream": True,
+                    "options": {
+                        "temperature": 0.7,
+                        "num_predict": 4000,
+                    }
+                },
+            ) as response:
+                if response.is_error:
+                    await response.aread()
+                    response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+                    result = json.loads(line)
+                    if result.get("error"):
+                        raise Exception(result["error"])
+                    content = result.get("message", {}).get("content", "")
+                    if content:
+                        yield content
+                    if result.get("done"):
+                        record_prompt_tokens(
+                            result.get("prompt_eval_count") or estimate_tokens(system_prompt, user_prompt)
                         )
-                    
-                    error_type = "GPU memory" if is_memory_error else "CUDA/GPU"
-                    raise Exception(
-                        f"Ollama {error_type} error: {error_msg}\n\n"
-                        "Solutions:\n"
-                        "1. Use CPU mode (recommended): Restart Ollama with OLLAMA_NUM_GPU=0\n"
-                        "2. Use a smaller model: 'ollama pull llama3.1:8b'\n"
-                        "3. Close other GPU-intensive applications\n"
-                        "4. Check your GPU drivers are up to date"
-                        + cpu_instructions
-                    )
-                else:
-                    raise Exception(f"Ollama API HTTP error {e.response.status_code}: {error_msg}")
-            except Exception as e:
-                logger.error(f"Ollama API error: {type(e).__name__}: {str(e)}")
-                import traceback
-                logger.error(traceback.format_exc())
-                raise Exception(f"Ollama API error: {str(e)}")
-    
-    async def generate_text(self, system_prompt: str, user_prompt: str) -> str:
-        """Generate text from system and user prompts."""
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            try:
-                response = await client.post(
-                    self.endpoint,
-                    json={
-                        "model": self.model,
-                        "messages": [
-                            {"role": "system", "content": system_prompt},
-                            {"role": "user", "content": user_prompt}
-                        ],
-                        "stream": False,
-                        "options": {
-                            "temperature": 0.7,
-                            "num_predict": 4000,
-                        }
-                    },
+        except httpx.ConnectError as e:
+            raise self._connect_error(e) from e
+        except httpx.HTTPStatusError as e:
+            raise self._http_status_error(e)
+        except Exception as e:
+            logger.error(f"Ollama API error: {type(e).__name__}: {str(e)}")
+            raise Exception(f"Ollama API error: {str(e)}")
+
+    def _connect_error(self, e: httpx.ConnectError) -> Exception:
+        logger.error(f"Ollama connection error: {str(e)}")
+        error_msg = (
+            f"Ollama is not running or not accessible at {self.endpoint}. "
+            "Please ensure:\n"
+            "1. Ollama is installed from https://ollama.ai\n"
+            "2. Ollama service is running (check with 'ollama list')\n"
+            "3. The model is pulled: 'ollama pull llama3.1'\n"
+            "4. Ollama is accessible at http://localhost:11434"
+        )
+        return Exception(error_msg)
+
+    def _http_status_error(self, e: httpx.HTTPStatusError) -> Exception:
+        """Readable error for a failed Ollama response, with fixes for GPU/CUDA failures."""
+        error_text = e.response.text
+        logger.error(f"Ollama HTTP error: {e.response.status_code} - {error_text}")
+
+        # Parse error message if it's JSON
+        try:
+            error_json = e.response.json()
+            error_msg = error_json.get("error", error_text)
+        except:
+            error_msg = error_text
+
+        # Check for CUDA/GPU errors (including memory errors)
+        is_memory_error = "out of memory" in error_msg.lower() or "cudamalloc" in error_msg.lower()
+        is_cuda_error = "cuda" in error_msg.lower() and ("error" in error_msg.lower() or "terminated" in error_msg.lower())
+
+        if is_memory_error or is_cuda_error:
+            cpu_instructions = ""
+            if not self.use_cpu:
+                cpu_instructions = (
+                    "\n\n🔧 QUICK FIX - Restart Ollama in CPU mode:\n"
+                    "1. Stop Ollama completely (close window or Ctrl+C)\n"
+                    "2. Open a NEW terminal\n"
+                    "3. Run: set OLLAMA_NUM_GPU=0 && ollama serve (CMD)\n"
+                    "   Or: $env:OLLAMA_NUM_GPU='0'; ollama serve (PowerShell)\n"
+                    "   Or: Double-click backend\\start_ollama_cpu.bat\n"
+                    "4. Keep that window open, then restart FastAPI\n"
                 )
-                response.raise_for_status()
-                result = response.json()
-                
-                message = result.get("message", {})
-                content = message.get("content", "")
-                
-                if not content:
-                    logger.warning("Empty response from Ollama")
-                    raise Exception("Empty response from Ollama")
-                
-                return content
-            except Exception as e:
-                logger.error(f"Ollama API error: {type(e).__name__}: {str(e)}")
-                raise Exception(f"Ollama API error: {str(e)}")
-    
+
+            error_type = "GPU memory" if is_memory_error else "CUDA/GPU"
+            return Exception(
+                f"Ollama {error_type} error: {error_msg}\n\n"
+                "Solutions:\n"
+                "1. Use CPU mode (recommended): Restart Ollama with OLLAMA_NUM_GPU=0\n"
+                "2. Use a smaller model: 'ollama pull llama3.1:8b'\n"
+                "3. Close other GPU-intensive applications\n"
+                "4. Check your GPU drivers are up to date"
+                + cpu_instructions
+            )
+        else:
+            return Exception(f"Ollama API HTTP error {e.response.status_code}: {error_msg}")
+
     def _format_activities(self, activities: List[Dict[str, Any]]) -> str:
         """Format activities list for LLM prompt with IDs for strict selection."""
         formatted = []
@@ -360,11 +684,26 @@ def format_outcomes_for_llm(outcomes: List[Dict[str, Any]]) -> str:
     return "\n".join(formatted)
 
 
+_provider: Optional[LLMProvider] = None
+
+
 def get_llm_provider() -> LLMProvider:
-    if settings.llm_provider == "openai":
-        return OpenAIProvider()
-    elif settings.llm_provider == "ollama":
-        return OllamaProvider()
-    else:
-        raise ValueError(f"Unknown LLM provider: {settings.llm_provider}. Use 'openai' or 'ollama'")
+    """The configured provider, created once so its HTTP connection pool is shared."""
+    global _provider
+    if _provider is None:
+        if settings.llm_provider == "openai":
+            _provider = OpenAIProvider()
+        elif settings.llm_provider == "ollama":
+            _provider = OllamaProvider()
+        else:
+            raise ValueError(f"Unknown LLM provider: {settings.llm_provider}. Use 'openai' or 'ollama'")
+    return _provider
+
+
+async def close_llm_provider() -> None:
+    """Close the shared provider's connections (FastAPI lifespan shutdown)."""
+    global _provider
+    if _provider is not None:
+        await _provider.aclose()
+        _provider = None
 
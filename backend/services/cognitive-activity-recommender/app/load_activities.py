@@ -1,4 +1,9 @@
-"""Script to load activities from CSV into FAISS vector store."""
+"""Script to load activities from CSV into FAISS vector store.
+
+By default only activities that were added or changed since the last run are
+re-embedded. Pass ``--full`` to rebuild the whole index from scratch.
+"""
+import argparse
 import sys
 import os
 
@@ -8,8 +13,8 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from app.vector_store import ActivityVectorStore
 
 
-def load_activities():
-    """Load activities from CSV and create vector store."""
+def load_activities(full_rebuild: bool = False):
+    """Load activities from CSV and create (or incrementally update) the vector store."""
     # Get the backend directory (parent of app directory)
     backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     csv_path = os.path.join(backend_dir, "autism_activity_dataset_1200_advanced.csv")
@@ -22,8 +27,11 @@ def load_activities():
     # Create vector store
     vector_store = ActivityVectorStore()
     
-    # Load from CSV
-    vector_store.load_from_csv(csv_path)
+    # Update the existing index in place when there is one, otherwise build from scratch
+    if not full_rebuild and vector_store.load():
+        vector_store.ingest_csv(csv_path)
+    else:
+        vector_store.load_from_csv(csv_path)
     
     # Save to disk (saves in backend directory)
     os.chdir(backend_dir)  # Change to backend directory for saving
@@ -31,10 +39,12 @@ def load_activities():
     
     print("Activities loaded successfully!")
     print(f"Total activities: {len(vector_store.metadata)}")
-    print(f"Index saved to: {os.path.join(backend_dir, vector_store.index_path)}")
-    print(f"Metadata saved to: {os.path.join(backend_dir, vector_store.metadata_path)}")
+    print(f"Current generation: {vector_store.metadata_path}.current")
 
 
 if __name__ == "__main__":
-    load_activities()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--full", action="store_true", help="Re-embed every activity instead of only changed rows")
+    args = parser.parse_args()
+    load_activities(full_rebuild=args.full)
 
@@ -0,0 +1,138 @@
+"""Non-blocking, sampled logging for the recommender service.
+
+Log records are put on an in-memory queue by the request path and written to
+stderr by a background listener thread, so formatting I/O never blocks a
+request. Routine per-request summary lines are marked with ``extra=SAMPLED``
+and only a ``LOG_SAMPLE_RATE`` fraction of them is kept. Per-candidate and
+per-outcome detail lines are only produced when the request enabled the debug
+trace (see ``debug_trace`` / ``trace_enabled``).
+"""
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Iterator, Optional
+
+from app.config import settings
+
+# Pass as ``extra=SAMPLED`` to make a log line subject to LOG_SAMPLE_RATE
+SAMPLED = {"sampled": True}
+
+_debug_trace: ContextVar[bool] = ContextVar("debug_trace", default=False)
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def trace_enabled() -> bool:
+    """True while handling a request that asked for the detailed debug trace."""
+    return _debug_trace.get()
+
+
+@contextmanager
+def debug_trace(enabled: bool = True) -> Iterator[None]:
+    """Enable the per-candidate debug trace for the code run inside the block."""
+    token = _debug_trace.set(enabled)
+    try:
+        yield
+    finally:
+        _debug_trace.reset(token)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a ``rate`` fraction of records marked as sampled; everything else passes."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "sampled", False) or record.levelno > logging.INFO:
+            return True
+        # Lines from a traced request are never dropped
+        if trace_enabled():
+            return True
+        return self.rate >= 1.0 or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "trace", False):
+            entry["trace"] = True
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _TraceMarker(logging.Filter):
+    """Tags records emitted while a debug trace is active (checked in the caller's context)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if trace_enabled():
+            record.trace = True
+        return True
+
+
+class _DeferredFormatQueueHandler(logging.handlers.QueueHandler):
+    """Queues records with only ``msg % args`` resolved.
+
+    The stock ``prepare`` runs the full formatter on the request thread and
+    folds the traceback into the message; here the listener's handler does all
+    formatting, so ``JsonFormatter`` still gets ``exc_info`` as a field.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        # Resolve now: args may be mutable objects that change before the listener runs
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def setup_logging() -> None:
+    """Route all logging through a queue to a background writer thread (idempotent)."""
+    global _listener
+    if _listener is not None:
+        return
+
+    if settings.log_format == "json":
+        formatter: logging.Formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    # Formatting happens on the listener thread only
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+
+    log_queue: queue.Queue = queue.Queue(-1)
+    queue_handler = _DeferredFormatQueueHandler(log_queue)
+    # Filters run on the request thread, before the record is queued
+    queue_handler.addFilter(SamplingFilter(settings.log_sample_rate))
+    queue_handler.addFilter(_TraceMarker())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(settings.log_level.upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
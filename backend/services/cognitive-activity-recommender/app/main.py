@@ -1,5 +1,7 @@
+import asyncio
 import logging
 import sys
+import time
 from contextlib import asynccontextmanager
 from pathlib import Path
 
@@ -9,16 +11,19 @@ if __name__ == "__main__" or Path(__file__).resolve().parent == Path.cwd():
     if str(_root) not in sys.path:
         sys.path.insert(0, str(_root))
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
+from app.config import settings
 from app.database import connect_to_mongo, close_mongo_connection
+from app.llm_providers import close_llm_provider
+from app.logging_config import setup_logging, shutdown_logging
+from app.metrics import CONTENT_TYPE, observe_stage_timings, render_metrics, server_timing_header
+from app.timing import collect_timings
 from app.routers import profiles, recommendations, outcomes, auth
 
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configure logging (queued; written by a background thread)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 
@@ -31,9 +36,27 @@ async def lifespan(app: FastAPI):
         logger.info("Connected to MongoDB successfully")
     except Exception as e:
         logger.error("Failed to connect to MongoDB during startup (%s); API will retry on demand.", e)
+    # Warm up the embedding model and FAISS index without delaying startup
+    warmup_task = None
+    if settings.warmup_on_startup:
+        warmup_task = asyncio.create_task(recommendations.engine.warm_up())
+    else:
+        recommendations.engine.warmup_state = {"status": "disabled"}
+    # Pick up activity index files rewritten by load_activities.py without a restart
+    watch_task = None
+    if settings.index_watch_interval_seconds > 0:
+        watch_task = asyncio.create_task(
+            recommendations.engine.watch_index_files(settings.index_watch_interval_seconds)
+        )
     yield
     # Shutdown
+    for task in (warmup_task, watch_task):
+        if task is not None and not task.done():
+            task.cancel()
+    recommendations.engine.close()
+    await close_llm_provider()
     await close_mongo_connection()
+    shutdown_logging()
 
 
 app = FastAPI(
@@ -43,14 +66,41 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+CORS_ORIGINS = ["http://localhost:3000", "http://localhost:5173"]  # React dev servers
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["http://localhost:3000", "http://localhost:5173"],  # React dev servers
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
+# Timing-Allow-Origin is a comma-separated origin list, or "*"
+TIMING_ALLOW_ORIGIN = "*" if "*" in CORS_ORIGINS else ", ".join(CORS_ORIGINS)
+
+
+@app.middleware("http")
+async def stage_timing(request: Request, call_next):
+    """Time recommendation requests per pipeline stage for /metrics and the Server-Timing header."""
+    path = request.url.path
+    prefix = recommendations.router.prefix
+    # Streamed plans record their own timings once the body is complete
+    if not path.startswith(prefix) or path == prefix + recommendations.STREAM_PATH:
+        return await call_next(request)
+    started = time.perf_counter()
+    # The endpoint runs in a copy of this context, so its stages land on ``timings``
+    with collect_timings() as timings:
+        response = await call_next(request)
+    elapsed = time.perf_counter() - started
+    if settings.metrics_enabled:
+        observe_stage_timings(timings, request.url.path, elapsed)
+    if settings.server_timing_header:
+        response.headers["Server-Timing"] = server_timing_header(timings, elapsed * 1000)
+        # Lets the frontend read the entries from the Resource Timing API as well
+        response.headers["Timing-Allow-Origin"] = TIMING_ALLOW_ORIGIN
+    return response
 
 # Include routers
 app.include_router(auth.router)
@@ -72,6 +122,23 @@ async def health():
     return {"status": "healthy"}
 
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint (stage durations, prompt tokens, parse fallbacks)."""
+    if not settings.metrics_enabled:
+        return JSONResponse(status_code=404, content={"detail": "Metrics are disabled"})
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE)
+
+
+@app.get("/ready")
+async def ready():
+    """Readiness: 200 once the vector store is warm, 503 while warming or after a failure."""
+    warmup = recommendations.engine.warmup_state
+    if warmup.get("status") in ("ready", "disabled"):
+        return {"status": "ready", "warmup": warmup}
+    return JSONResponse(status_code=503, content={"status": "not_ready", "warmup": warmup})
+
+
 if __name__ == "__main__":
     import os
     import uvicorn
@@ -0,0 +1,59 @@
+"""Material vocabulary and material -> activity postings for the vector store."""
+import functools
+import hashlib
+import json
+import logging
+from typing import Any, Dict, FrozenSet, Iterable, List, Sequence
+
+import numpy as np
+
+from app.candidate_pipeline import split_list
+
+logger = logging.getLogger(__name__)
+
+
+class MaterialIndex:
+    """Normalized material names and, for each, the activity rows that use it.
+
+    Built once per index load. Rows match the vector store metadata (and FAISS
+    ids), like ``ActivityFilterIndex``. ``GET /recommend/materials`` serves
+    ``display_json`` as-is, with ``etag`` for conditional requests.
+    """
+
+    def __init__(self, activities: Sequence[Dict[str, Any]]):
+        self.size = len(activities)
+        postings: Dict[str, List[int]] = {}
+        for row, activity in enumerate(activities):
+            for material in set(split_list(activity.get("materials", ""))):
+                postings.setdefault(material, []).append(row)
+
+        self.vocabulary: List[str] = sorted(postings)
+        self.postings: Dict[str, np.ndarray] = {
+            material: np.asarray(rows, dtype=np.int64) for material, rows in postings.items()
+        }
+        # Capitalize first letter for better display (what the frontend lists)
+        self.display_names: List[str] = sorted(material.capitalize() for material in self.vocabulary)
+        self.display_json: bytes = json.dumps(self.display_names).encode("utf-8")
+        self.etag = f'"{hashlib.sha1(self.display_json).hexdigest()}"'
+        self._resolve_cached = functools.lru_cache(maxsize=256)(self._resolve)
+
+        logger.info(f"Built material index: {len(self.vocabulary)} materials over {self.size} activities")
+
+    def _resolve(self, available: FrozenSet[str]) -> FrozenSet[str]:
+        # Exact or partial match (e.g., "colored paper" contains "paper"), checked once per term
+        return frozenset(
+            material for material in self.vocabulary
+            if any(avail in material or material in avail for avail in available)
+        )
+
+    def matching_materials(self, available_materials: Iterable[str]) -> FrozenSet[str]:
+        """Vocabulary terms that count as available for the given (free-text) materials."""
+        available = frozenset(mat.strip().lower() for mat in available_materials if mat and str(mat).strip())
+        return self._resolve_cached(available)
+
+    def mask(self, available_materials: Iterable[str]) -> np.ndarray:
+        """Boolean mask of activity rows that use at least one available material."""
+        mask = np.zeros(self.size, dtype=bool)
+        for material in self.matching_materials(available_materials):
+            mask[self.postings[material]] = True
+        return mask
@@ -0,0 +1,161 @@
+"""Prometheus metrics for the recommendation pipeline (served at GET /metrics).
+
+Only histograms and counters are needed, so they are rendered in the
+Prometheus text exposition format here rather than pulling in a client
+library. Stage durations come from ``app.timing``: the HTTP middleware in
+``app.main`` collects them per request and hands them to
+``observe_stage_timings``.
+"""
+import bisect
+import threading
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from app.timing import StageTimings, current_timings
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in labels]
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    """Cumulative-bucket histogram with an optional single label."""
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float], label: str = ""):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = sorted(buckets)
+        self.label = label
+        self._lock = threading.Lock()
+        # label value -> (per-bucket counts incl. +Inf, sum)
+        self._series: Dict[str, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, label_value: str = "") -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._series.setdefault(label_value, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: (list(counts), total[0]) for key, (counts, total) in self._series.items()}
+        for label_value, (counts, total) in sorted(series.items()):
+            base = [(self.label, label_value)] if self.label else []
+            cumulative = 0
+            for bound, count in zip(self.buckets + [float("inf")], counts):
+                cumulative += count
+                labels = _format_labels(base + [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(base)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(base)} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter with an optional single label."""
+
+    def __init__(self, name: str, documentation: str, label: str = ""):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self._lock = threading.Lock()
+        self._values: Dict[str, float] = {}
+
+    def inc(self, label_value: str = "", amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for label_value, value in sorted(values.items()):
+            labels = _format_labels([(self.label, label_value)] if self.label else [])
+            lines.append(f"{self.name}{labels} {_format_value(value)}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "recommender_stage_duration_seconds",
+    "Time spent per request in each recommendation pipeline stage (encode, faiss, llm, ...).",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+    label="stage",
+)
+REQUEST_SECONDS = Histogram(
+    "recommender_request_duration_seconds",
+    "Wall time of recommendation requests.",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+    label="path",
+)
+PROMPT_TOKENS = Histogram(
+    "recommender_prompt_tokens",
+    "Prompt tokens sent to the LLM per plan (provider-reported, else estimated).",
+    buckets=(250, 500, 1000, 2000, 3000, 4000, 6000, 8000, 12000, 16000, 32000),
+)
+PARSE_FALLBACKS = Counter(
+    "recommender_parse_fallbacks_total",
+    "LLM responses replaced by the fallback plan, by reason.",
+    label="reason",
+)
+LLM_CACHE_REQUESTS = Counter(
+    "recommender_llm_cache_requests_total",
+    "LLM response cache lookups, by result (hit, miss, bypass).",
+    label="result",
+)
+LLM_ADMISSIONS = Counter(
+    "recommender_llm_admissions_total",
+    "LLM slot requests by outcome (immediate, queued, timed_out, rejected_*).",
+    label="result",
+)
+
+REGISTRY = (STAGE_SECONDS, REQUEST_SECONDS, PROMPT_TOKENS, PARSE_FALLBACKS, LLM_CACHE_REQUESTS, LLM_ADMISSIONS)
+
+
+def estimate_tokens(*texts: str) -> int:
+    """Rough token count (~4 characters per token) for providers that do not report usage."""
+    return sum(len(text) for text in texts) // 4
+
+
+def record_prompt_tokens(count: int) -> None:
+    """Observe one LLM call's prompt size and attach it to the current request's timings."""
+    PROMPT_TOKENS.observe(count)
+    timings = current_timings()
+    if timings is not None:
+        timings.prompt_tokens = count
+
+
+def observe_stage_timings(timings: StageTimings, path: str, total_seconds: float) -> None:
+    for name, duration_ms in timings.durations_ms.items():
+        STAGE_SECONDS.observe(duration_ms / 1000.0, name)
+    REQUEST_SECONDS.observe(total_seconds, path)
+
+
+def server_timing_header(timings: StageTimings, total_ms: float) -> str:
+    """``Server-Timing`` value listing each stage and the total, in milliseconds (plus prompt tokens)."""
+    entries = [f"{name};dur={duration_ms:.1f}" for name, duration_ms in timings.durations_ms.items()]
+    if timings.prompt_tokens is not None:
+        entries.append(f'prompt_tokens;desc="{timings.prompt_tokens}"')
+    entries.append(f"total;dur={total_ms:.1f}")
+    return ", ".join(entries)
+
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,127 @@
+"""Near-duplicate activity clusters (MinHash LSH over names and steps).
+
+The dataset has many variants of one activity that differ only in their
+``#N`` suffix, materials or difficulty, e.g. "Picture Labeling (Writing) -
+Improve spacing and #4" and "... #5". Each activity is reduced to a set of
+word-bigram shingles over its name (without the suffix) and step
+instructions. MinHash signatures are bucketed by LSH band; pairs sharing a
+bucket are confirmed with the exact Jaccard similarity and merged with
+union-find. ``cluster_of[row]`` is the lowest row of that activity's cluster.
+
+Clusters are built when the index is built and persisted next to it, like the
+BM25 postings.
+"""
+import logging
+import os
+import re
+import zlib
+from typing import Any, Dict, Optional, Sequence, Set
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+NUM_PERM = 128
+BANDS = 8  # 8 bands x 16 rows: pairs above ~0.88 Jaccard almost always share a bucket
+DEFAULT_THRESHOLD = 0.95
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_SUFFIX_RE = re.compile(r"\s*#\d+\s*$")
+_PRIME = (1 << 31) - 1
+
+
+def activity_shingles(activity: Dict[str, Any]) -> Set[int]:
+    """Hashed word bigrams of the activity name (minus its ``#N`` suffix) and steps."""
+    name = _SUFFIX_RE.sub("", str(activity.get("activity_name", "")))
+    steps = activity.get("step_instructions", "")
+    if isinstance(steps, list):
+        steps = " ".join(str(step) for step in steps)
+    words = _WORD_RE.findall(name.lower()) + ["|"] + _WORD_RE.findall(str(steps).lower())
+    return {zlib.crc32(f"{a} {b}".encode("utf-8")) for a, b in zip(words, words[1:])}
+
+
+def minhash_signatures(shingle_sets: Sequence[Set[int]], num_perm: int = NUM_PERM, seed: int = 1) -> np.ndarray:
+    """(n, num_perm) MinHash signatures using universal hashes (a * x + b) mod p."""
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, _PRIME, size=num_perm, dtype=np.int64)
+    b = rng.randint(0, _PRIME, size=num_perm, dtype=np.int64)
+    signatures = np.full((len(shingle_sets), num_perm), _PRIME, dtype=np.int64)
+    for row, shingles in enumerate(shingle_sets):
+        if shingles:
+            x = np.fromiter(shingles, dtype=np.int64, count=len(shingles)) % _PRIME
+            signatures[row] = ((np.outer(x, a) + b) % _PRIME).min(axis=0)
+    return signatures
+
+
+class NearDuplicateIndex:
+    """Cluster id per activity row; rows in one cluster are near-duplicates."""
+
+    def __init__(self, cluster_of: np.ndarray, threshold: float = DEFAULT_THRESHOLD, signature: str = ""):
+        self.cluster_of = cluster_of
+        self.num_docs = len(cluster_of)
+        self.threshold = threshold
+        # Identifies the index generation this was built from (see ActivityVectorStore.disk_signature)
+        self.signature = signature
+
+    @classmethod
+    def build(
+        cls,
+        activities: Sequence[Dict[str, Any]],
+        threshold: float = DEFAULT_THRESHOLD,
+        signature: str = "",
+    ) -> "NearDuplicateIndex":
+        shingle_sets = [activity_shingles(activity) for activity in activities]
+        signatures = minhash_signatures(shingle_sets)
+        parent = list(range(len(activities)))
+
+        def find(row: int) -> int:
+            while parent[row] != row:
+                parent[row] = parent[parent[row]]
+                row = parent[row]
+            return row
+
+        rows_per_band = NUM_PERM // BANDS
+        for band in range(BANDS):
+            buckets: Dict[bytes, int] = {}
+            chunk = np.ascontiguousarray(signatures[:, band * rows_per_band:(band + 1) * rows_per_band])
+            for row in range(len(activities)):
+                # Compare with the first row seen in the bucket; other bands catch the rest
+                first = buckets.setdefault(chunk[row].tobytes(), row)
+                if first == row or find(first) == find(row):
+                    continue
+                a, b = shingle_sets[first], shingle_sets[row]
+                if a and b and len(a & b) / len(a | b) >= threshold:
+                    parent[max(find(first), find(row))] = min(find(first), find(row))
+
+        cluster_of = np.fromiter((find(row) for row in range(len(activities))), dtype=np.int32, count=len(activities))
+        index = cls(cluster_of, threshold=threshold, signature=signature)
+        logger.info(
+            f"Built near-duplicate clusters: {len(np.unique(cluster_of))} clusters over {len(activities)} activities"
+        )
+        return index
+
+    def cluster(self, row: Optional[int]) -> int:
+        """Cluster id of ``row`` (-1 when unknown)."""
+        if row is None or not 0 <= row < self.num_docs:
+            return -1
+        return int(self.cluster_of[row])
+
+    def save(self, path: str) -> None:
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            version=np.array(FORMAT_VERSION),
+            cluster_of=self.cluster_of,
+            threshold=np.array(self.threshold),
+            signature=np.array(self.signature),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "NearDuplicateIndex":
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["version"]) != FORMAT_VERSION:
+                raise ValueError(f"Unsupported near-duplicate index version: {int(data['version'])}")
+            return cls(data["cluster_of"], threshold=float(data["threshold"]), signature=str(data["signature"]))
+
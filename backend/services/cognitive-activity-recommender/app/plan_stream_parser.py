@@ -0,0 +1,152 @@
+"""Incremental parser for a plan JSON response that arrives token by token.
+
+``PlanStreamParser.feed`` scans each chunk once, tracking string/escape state
+and the open objects and arrays, and returns the plan items the chunk
+completed: an activity (``schedule[i].activities[j]``) as soon as its closing
+brace arrives, and a phase (``schedule[i]``) once the whole phase is done.
+Text before the first ``{`` (e.g. a markdown code fence) and after the plan
+object is ignored, and only the text of the phase being read stays buffered.
+Items that are not valid JSON are skipped; the complete response is still
+parsed normally once the stream ends.
+"""
+import json
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+_ITEM = "[]"
+PHASE_PATH = ("schedule", _ITEM)
+ACTIVITY_PATH = PHASE_PATH + ("activities", _ITEM)
+
+
+class PlanItem(NamedTuple):
+    kind: str  # "activity" or "phase"
+    phase_index: int
+    phase_name: str
+    value: Dict[str, Any]
+
+
+class _Container:
+    __slots__ = ("is_object", "start", "path", "index", "key", "expect_key", "items", "fields")
+
+    def __init__(self, is_object: bool, start: int, path: Tuple[str, ...], index: int):
+        self.is_object = is_object
+        self.start = start
+        self.path = path
+        self.index = index  # position in the parent array (0 for object members)
+        self.key: Optional[str] = None  # key of the member currently being read
+        self.expect_key = is_object
+        self.items = 0  # children opened so far (arrays)
+        self.fields: Dict[str, str] = {}  # string members seen so far (phases only)
+
+
+class PlanStreamParser:
+    """Emits completed phases and activities of a streamed plan response."""
+
+    def __init__(self):
+        self._buffer = ""  # unconsumed text, starting at absolute offset ``_buffer_start``
+        self._buffer_start = 0
+        self._length = 0
+        self._stack: List[_Container] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._pending_key: Optional[str] = None
+        self.done = False
+
+    def _text(self, start: int, end: int) -> str:
+        return self._buffer[start - self._buffer_start:end - self._buffer_start]
+
+    def _discard_consumed(self) -> None:
+        """Drop buffered text no open phase, activity or string can still need."""
+        keep_from = self._string_start if self._in_string else self._length
+        for container in self._stack:
+            if container.path in (PHASE_PATH, ACTIVITY_PATH):
+                # The outermost one starts first; its children lie inside it
+                keep_from = min(keep_from, container.start)
+                break
+        if keep_from > self._buffer_start:
+            self._buffer = self._buffer[keep_from - self._buffer_start:]
+            self._buffer_start = keep_from
+
+    def _decode(self, start: int, end: int) -> Any:
+        try:
+            return json.loads(self._text(start, end))
+        except ValueError:
+            return None
+
+    def feed(self, chunk: str) -> List[PlanItem]:
+        items: List[PlanItem] = []
+        if self.done or not chunk:
+            return items
+        base = self._length
+        self._buffer += chunk
+        self._length += len(chunk)
+
+        for offset, char in enumerate(chunk):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    self._end_string(base + offset + 1)
+                continue
+            if not self._stack:
+                if char == "{":
+                    self._stack.append(_Container(True, base + offset, (), 0))
+                continue
+            top = self._stack[-1]
+            if char == '"':
+                self._in_string = True
+                self._string_start = base + offset
+            elif char == "{" or char == "[":
+                if top.is_object:
+                    path = top.path + (top.key or "",)
+                    index = 0
+                else:
+                    path = top.path + (_ITEM,)
+                    index = top.items
+                    top.items += 1
+                self._stack.append(_Container(char == "{", base + offset, path, index))
+            elif char == "}" or char == "]":
+                item = self._close(base + offset + 1)
+                if item is not None:
+                    items.append(item)
+                if self.done:
+                    break
+            elif top.is_object:
+                if char == ":":
+                    top.key = self._pending_key
+                    top.expect_key = False
+                elif char == ",":
+                    top.expect_key = True
+        self._discard_consumed()
+        return items
+
+    def _end_string(self, end: int) -> None:
+        top = self._stack[-1]
+        if not top.is_object:
+            return
+        if top.expect_key:
+            key = self._decode(self._string_start, end)
+            self._pending_key = key if isinstance(key, str) else None
+        elif top.path == PHASE_PATH and top.key is not None:
+            value = self._decode(self._string_start, end)
+            if isinstance(value, str):
+                top.fields[top.key] = value
+
+    def _close(self, end: int) -> Optional[PlanItem]:
+        container = self._stack.pop()
+        if not self._stack:
+            self.done = True
+            return None
+        if container.path == ACTIVITY_PATH:
+            phase = self._stack[-2]
+            value = self._decode(container.start, end)
+            if isinstance(value, dict):
+                return PlanItem("activity", phase.index, phase.fields.get("phase", ""), value)
+        elif container.path == PHASE_PATH:
+            value = self._decode(container.start, end)
+            if isinstance(value, dict):
+                return PlanItem("phase", container.index, str(value.get("phase", "")), value)
+        return None
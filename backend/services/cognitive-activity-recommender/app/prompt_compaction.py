@@ -0,0 +1,99 @@
+"""Compact encoding of the candidate activity list for the plan prompt.
+
+The verbose formatters spend ten labelled lines per activity (plus step text
+in the OpenAI one), which makes the activity list most of the prompt. Compact
+mode writes one ``|``-separated row per activity under a column header,
+replaces activity IDs with positional aliases (``A1``, ``A2``, ... in list
+order) and repeated domain and difficulty values with codes from small lookup
+tables. Steps are left out: the parsed plan takes them from the dataset
+(``RecommendationEngine._scheduled_activity``).
+
+The model answers with aliases; ``RecommendationEngine._activity_lookup``
+maps them back to the candidates, so the list sent must be the list parsed.
+"""
+from typing import Any, Dict, List
+
+from app.metrics import estimate_tokens
+
+COLUMNS = ("ID", "Name", "Domain", "Difficulty", "Goal", "Skills", "Age", "Sensory", "Minutes", "Materials")
+
+
+def activity_alias(position: int) -> str:
+    """Alias of the activity at 1-based ``position`` in the prompt list."""
+    return f"A{position}"
+
+
+def _text(value: Any) -> str:
+    if isinstance(value, list):
+        value = ", ".join(str(v) for v in value)
+    # Keep the column separator unambiguous
+    return str(value if value is not None else "").replace("|", "/").replace("\n", " ").strip()
+
+
+def _domain(activity: Dict[str, Any]) -> str:
+    return _text(activity.get('domain', activity.get('category', '')))
+
+
+def _codes(values: List[str], prefix: str) -> Dict[str, str]:
+    """Short code per distinct non-empty value, in order of first appearance."""
+    codes: Dict[str, str] = {}
+    for value in values:
+        if value and value not in codes:
+            codes[value] = f"{prefix}{len(codes) + 1}"
+    return codes
+
+
+def _row(position: int, activity: Dict[str, Any], domains: Dict[str, str], difficulties: Dict[str, str]) -> str:
+    domain = _domain(activity)
+    difficulty = _text(activity.get('difficulty', ''))
+    materials = _text(activity.get('materials', []))
+    return " | ".join((
+        activity_alias(position),
+        _text(activity.get('activity_name', activity.get('name', 'Unknown'))),
+        domains.get(domain, domain),
+        difficulties.get(difficulty, difficulty),
+        _text(activity.get('goal', '')),
+        _text(activity.get('skills_targeted', activity.get('skill_targets', []))),
+        _text(activity.get('age_range', '')),
+        _text(activity.get('sensory_suitability', '')),
+        _text(activity.get('time_required_minutes', activity.get('duration_minutes', 15))),
+        materials or "None specified",
+    ))
+
+
+def _header(domains: Dict[str, str], difficulties: Dict[str, str]) -> List[str]:
+    lines = [
+        "One activity per line: " + " | ".join(COLUMNS),
+        "Use the ID column (e.g. A1) as activity_id; write domain names out in full.",
+    ]
+    if domains:
+        lines.append("Domains: " + "; ".join(f"{code}={value}" for value, code in domains.items()))
+    if difficulties:
+        lines.append("Difficulty: " + "; ".join(f"{code}={value}" for value, code in difficulties.items()))
+    return lines
+
+
+def format_activities_compact(activities: List[Dict[str, Any]]) -> str:
+    """Candidate list as a header, lookup tables and one row per activity."""
+    domains = _codes([_domain(a) for a in activities], "D")
+    difficulties = _codes([_text(a.get('difficulty', '')) for a in activities], "L")
+    rows = [_row(idx, act, domains, difficulties) for idx, act in enumerate(activities, 1)]
+    return "\n".join(_header(domains, difficulties) + rows)
+
+
+def trim_to_token_budget(activities: List[Dict[str, Any]], token_budget: int, min_keep: int) -> List[int]:
+    """Indices of the leading activities that fit the compact table into ``token_budget``.
+
+    ``activities`` are in the engine's ranked (MMR) order, so rows are dropped
+    from the tail; at least ``min_keep`` stay even if they do not fit.
+    """
+    kept = list(range(len(activities)))
+    if token_budget <= 0 or len(activities) <= min_keep:
+        return kept
+    domains = _codes([_domain(a) for a in activities], "D")
+    difficulties = _codes([_text(a.get('difficulty', '')) for a in activities], "L")
+    row_tokens = [estimate_tokens(_row(idx, act, domains, difficulties)) + 1 for idx, act in enumerate(activities, 1)]
+    total = estimate_tokens("\n".join(_header(domains, difficulties))) + sum(row_tokens)
+    while total > token_budget and len(kept) > min_keep:
+        total -= row_tokens[kept.pop()]
+    return kept
@@ -1,12 +1,27 @@
 """Recommendation engine using RAG with FAISS vector search."""
+import asyncio
 import json
 import logging
-from typing import List, Dict, Any, Optional, Tuple
-from app.llm_providers import get_llm_provider
+import threading
+import time
+from datetime import datetime
+from typing import List, Dict, Any, AsyncIterator, Iterator, Optional, Tuple
+import numpy as np
+from app.config import settings
+from app.blocking_pool import BlockingWorkPool
+from app.llm_cache import cache_bypassed, get_llm_cache, hold_llm_responses
+from app.llm_providers import LLMOverloadedError, get_admission_controller, get_llm_provider
 from app.schemas import StructuredActivityPlan, RecommendationResponse, ScheduledActivity, PlanPhase
 from app.database import get_database
-from app.reinforcement_learning import ActivityScorer, build_learning_enhanced_query
+from app.logging_config import SAMPLED, trace_enabled
+from app.metrics import PARSE_FALLBACKS
+from app.timing import stage
+from app.candidate_pipeline import Candidate, CandidateFeatures, CandidatePipeline, Predicate
+from app.reinforcement_learning import ActivityScorer, build_learning_enhanced_query, load_profile_scorer
+from app.single_flight import SingleFlight, request_key
 from app.plan_prompt_builder import build_therapist_plan_prompt
+from app.plan_stream_parser import PlanStreamParser
+from app.prompt_compaction import activity_alias, trim_to_token_budget
 from bson import ObjectId
 
 logger = logging.getLogger(__name__)
@@ -17,7 +32,13 @@ class RecommendationEngine:
         self._llm_provider = None
         self._vector_store = None
         self._current_plan_request = {}
-        self._activity_scorer = ActivityScorer()
+        self._vector_store_lock = threading.Lock()
+        # Encoder and FAISS calls are blocking; keep them off the event loop
+        self._search_pool = BlockingWorkPool(settings.vector_store_max_workers, "vector-store")
+        self.warmup_state: Dict[str, Any] = {"status": "pending"}
+        self._reload_lock = asyncio.Lock()
+        # Concurrent identical /recommend calls (double click, client retry) share one run
+        self._single_flight = SingleFlight()
     
     @property
     def llm_provider(self):
@@ -28,124 +49,498 @@ class RecommendationEngine:
     @property
     def vector_store(self):
         if self._vector_store is None:
+            with self._vector_store_lock:
+                if self._vector_store is None:
+                    self._vector_store = self._load_vector_store()
+        return self._vector_store
+
+    def _load_vector_store(self, previous=None):
+        """Build and load the vector store (blocking: loads the model and FAISS index)."""
+        try:
+            from app.vector_store import ActivityVectorStore
+            vector_store = ActivityVectorStore(reuse_model_from=previous)
+            if not vector_store.load():
+                logger.error("Vector store files not found")
+                raise RuntimeError("Vector store not found. Please run: python app/load_activities.py first.")
+            return vector_store
+        except ImportError as e:
+            logger.error(f"Import error: {str(e)}")
+            raise RuntimeError(
+                "FAISS dependencies not installed. Please run: pip install faiss-cpu sentence-transformers pandas"
+            ) from e
+        except Exception as e:
+            logger.error(f"Error loading vector store: {type(e).__name__}: {str(e)}")
+            raise
+
+    async def get_vector_store(self):
+        """Async access to the vector store; a first-time load runs on the search pool."""
+        if self._vector_store is not None:
+            return self._vector_store
+        return await self._search_pool.run(lambda: self.vector_store)
+
+    async def reload_vector_store(self, force: bool = False) -> Dict[str, Any]:
+        """Load the index files into a new store and swap it in.
+
+        The new store is built next to the current one (sharing its embedding model)
+        and replaces it with a single reference assignment. Searches already running
+        hold a reference to the old store and finish on it.
+        """
+        async with self._reload_lock:
+            current = self._vector_store
+            if current is not None and not force:
+                signature = await self._search_pool.run(current.disk_signature)
+                if signature == current.loaded_signature:
+                    return {"reloaded": False, "reason": "index unchanged"}
+
+            started = time.perf_counter()
+            new_store = await self._search_pool.run(self._load_vector_store, current)
+            if current is not None:
+                # Query embeddings do not depend on the activity catalogue
+                new_store.query_cache = current.query_cache
+            self._vector_store = new_store
+            duration_ms = round(1000 * (time.perf_counter() - started), 1)
+            logger.info(f"Reloaded vector store: {len(new_store.metadata)} activities in {duration_ms} ms")
+            return {"reloaded": True, "activities": len(new_store.metadata), "duration_ms": duration_ms}
+
+    async def watch_index_files(self, interval_seconds: float) -> None:
+        """Poll the index files and hot-reload when another process saves a new index.
+
+        Each worker runs its own watcher, so every worker sharing the files picks up the change.
+        """
+        while True:
+            await asyncio.sleep(interval_seconds)
+            if self._vector_store is None:
+                continue  # Nothing loaded yet; the first load will read the current files
             try:
-                from app.vector_store import ActivityVectorStore
-                self._vector_store = ActivityVectorStore()
-                if not self._vector_store.load():
-                    logger.error("Vector store files not found")
-                    raise RuntimeError("Vector store not found. Please run: python app/load_activities.py first.")
-            except ImportError as e:
-                logger.error(f"Import error: {str(e)}")
-                raise RuntimeError(
-                    "FAISS dependencies not installed. Please run: pip install faiss-cpu sentence-transformers pandas"
-                ) from e
-            except Exception as e:
-                logger.error(f"Error loading vector store: {type(e).__name__}: {str(e)}")
+                await self.reload_vector_store()
+            except asyncio.CancelledError:
                 raise
-        return self._vector_store
+            except Exception as e:
+                logger.error(f"Vector store hot reload failed, keeping current index: {type(e).__name__}: {str(e)}")
+
+    async def warm_up(self) -> None:
+        """Load the model and index and run a dummy encode so the first request is fast."""
+        started = time.perf_counter()
+        self.warmup_state = {"status": "warming", "started_at": datetime.utcnow().isoformat()}
+        logger.info("Warming up vector store and embedding model...")
+        try:
+            vector_store = await self.get_vector_store()
+            await self._search_pool.run(vector_store.warm_up)
+        except Exception as e:
+            logger.error(f"Vector store warm-up failed: {type(e).__name__}: {str(e)}")
+            self.warmup_state = {
+                **self.warmup_state,
+                "status": "failed",
+                "error": f"{type(e).__name__}: {str(e)}",
+                "duration_ms": round(1000 * (time.perf_counter() - started), 1),
+            }
+            return
+        self.warmup_state = {
+            **self.warmup_state,
+            "status": "ready",
+            "finished_at": datetime.utcnow().isoformat(),
+            "duration_ms": round(1000 * (time.perf_counter() - started), 1),
+            "lexical_only": vector_store.lexical_only,
+        }
+        logger.info(f"Vector store warm-up finished in {self.warmup_state['duration_ms']} ms")
+
+    def close(self) -> None:
+        """Release the search pool (called from the application lifespan on shutdown)."""
+        self._search_pool.shutdown(wait=False)
+
+    def runtime_stats(self) -> Dict[str, Any]:
+        """Counters for the search path; does not trigger loading the vector store."""
+        stats: Dict[str, Any] = {"vector_store_loaded": self._vector_store is not None}
+        if self._vector_store is not None:
+            stats["query_embedding_cache"] = self._vector_store.query_cache.stats()
+        stats["vector_store_pool"] = self._search_pool.stats()
+        stats["single_flight"] = self._single_flight.stats()
+        admission = get_admission_controller()
+        if admission is not None:
+            stats["llm_admission"] = admission.stats()
+        llm_cache = get_llm_cache()
+        if llm_cache is not None:
+            stats["llm_response_cache"] = llm_cache.stats()
+        return stats
 
     async def generate_recommendations(
         self,
         profile_id: str,
         plan_request: Dict[str, Any],
         user_id: str,
+        retrieval: Optional[Dict[str, Any]] = None,
     ) -> RecommendationResponse:
-        # Store plan_request for use in fallback methods
-        self._current_plan_request = plan_request
         try:
-            db = get_database()
-            
-            # Fetch child profile and verify ownership
-            profile = await db.profiles.find_one({"_id": ObjectId(profile_id), "user_id": user_id})
-            if not profile:
-                logger.error(f"Profile {profile_id} not found for user {user_id}")
-                raise ValueError(f"Profile {profile_id} not found")
-            
-            # Fetch recent outcomes (last 10 for learning, last 3 for context)
-            all_recent_outcomes = await db.outcomes.find(
-                {"profile_id": profile_id}
-            ).sort("completed_at", -1).limit(10).to_list(10)
-            recent_outcomes = all_recent_outcomes[:3]  # Last 3 for LLM context
-            
-            # Update activity scorer with outcomes for reinforcement learning
-            logger.info(f"[RL] ===== REINFORCEMENT LEARNING UPDATE =====")
-            logger.info(f"[RL] Loading {len(all_recent_outcomes)} outcomes for profile {profile_id}")
-            self._activity_scorer.update_from_outcomes(all_recent_outcomes)
-            logger.info(f"[RL] Activity scorer updated with outcomes")
-            
-            # Build semantic search query from profile and plan request
-            base_query = self._build_search_query(profile, plan_request, recent_outcomes)
-            # Enhance query with learning from outcomes
-            search_query = build_learning_enhanced_query(base_query, all_recent_outcomes, profile)
-            
-            # Apply filters for safety
-            filters = self._build_filters(profile)
-            
-            # Perform semantic search - get more candidates for better variety
-            candidate_activities = self.vector_store.search(
-                query=search_query,
-                k=50,  # Get more candidates to ensure variety
-                filters=filters
-            )
-            
-            # Apply reinforcement learning: boost/penalize activities based on outcomes
-            logger.info(f"[RL] ===== APPLYING REINFORCEMENT LEARNING =====")
-            logger.info(f"[RL] Processing {len(candidate_activities)} candidate activities")
-            scored_activities = self._apply_reinforcement_learning(candidate_activities)
-            logger.info(f"[RL] Applied RL scores to {len(scored_activities)} activities (some may have been filtered out)")
-            
-            # Further filter by triggers and refine
-            filtered_activities = self._apply_safety_filters(profile, scored_activities)
-            
-            # Ensure variety - remove duplicates and similar activities
-            diverse_activities = self._ensure_activity_variety(filtered_activities, profile)
-            
-            # STRICTLY filter by available materials if specified
-            available_materials = plan_request.get('available_materials', [])
-            min_activities_required = 5  # Daily plan minimum
-            if available_materials:
-                # STRICT FILTER: Only keep activities that use available materials
-                materials_filtered = self._strict_filter_by_materials(diverse_activities, available_materials)
-                
-                if len(materials_filtered) < min_activities_required:
-                    logger.warning(f"Only {len(materials_filtered)} activities match materials (need {min_activities_required}). This may limit plan generation.")
-                    # Still use only materials-matching activities (strict mode)
-                    diverse_activities = materials_filtered
-                else:
-                    diverse_activities = materials_filtered
-            
-            # Take top 30-40 diverse activities for LLM to do intelligent filtering and selection
-            # Give LLM more candidates to work with for better selection
-            max_candidates = max(40, min_activities_required * 6)  # At least 6x the minimum for good selection
-            top_activities = diverse_activities[:max_candidates] if len(diverse_activities) >= max_candidates else diverse_activities
-            
-            # Log RL impact on final selection
-            rl_boosted_in_final = [a for a in top_activities if a.get('_rl_boost', 1.0) > 1.0]
-            rl_penalized_in_final = [a for a in top_activities if a.get('_rl_boost', 1.0) < 1.0]
-            logger.info(
-                f"[RL] Final candidate selection: {len(top_activities)} activities | "
-                f"RL-boosted: {len(rl_boosted_in_final)} | "
-                f"RL-penalized: {len(rl_penalized_in_final)} | "
-                f"Neutral: {len(top_activities) - len(rl_boosted_in_final) - len(rl_penalized_in_final)}"
+            profile, all_recent_outcomes = await self._load_profile_context(profile_id, user_id)
+            # Keyed on everything the plan depends on, so an edited profile or a new outcome starts a new run;
+            # the cache-bypass and debug-trace flags too, since they change what the run does and logs
+            key = request_key(
+                profile_id, profile, plan_request, retrieval, all_recent_outcomes,
+                cache_bypassed(), trace_enabled(),
             )
-            # Generate activity plan using LLM with RAG context
-            llm_response = await self.llm_provider.generate_activity_plan(
-                child_profile=self._profile_to_dict(profile),
-                activities=[self._csv_activity_to_dict(a) for a in top_activities],
-                plan_request=plan_request,
-                recent_outcomes=recent_outcomes,
+            return await self._single_flight.run(
+                key,
+                lambda: self.generate_for_profile(profile, plan_request, all_recent_outcomes, retrieval=retrieval),
             )
-            
-            # Parse LLM response
-            plan = self._parse_llm_plan_response(llm_response, top_activities, plan_request)
-            
-            return RecommendationResponse(plan=plan)
+        except LLMOverloadedError:
+            raise  # Already logged by the admission controller; the router answers 503
         except Exception as e:
             logger.error(f"Error in generate_recommendations: {type(e).__name__}: {str(e)}")
             import traceback
             logger.error(traceback.format_exc())
             raise
 
+    async def generate_for_profile(
+        self,
+        profile: Dict[str, Any],
+        plan_request: Dict[str, Any],
+        all_recent_outcomes: List[Dict[str, Any]],
+        retrieval: Optional[Dict[str, Any]] = None,
+        activity_scorer: Optional[ActivityScorer] = None,
+    ) -> RecommendationResponse:
+        """Run the pipeline for an already loaded profile and outcome history.
+
+        ``activity_scorer`` defaults to the profile's stored scores; the offline
+        benchmark passes its own so no database is needed.
+        """
+        # Store plan_request for use in fallback methods
+        self._current_plan_request = plan_request
+        candidate_activities = await self._search_candidates(profile, plan_request, all_recent_outcomes, retrieval)
+        return await self._plan_from_candidates(
+            profile, plan_request, candidate_activities, all_recent_outcomes, activity_scorer=activity_scorer
+        )
+
+    async def _search_candidates(
+        self,
+        profile: Dict[str, Any],
+        plan_request: Dict[str, Any],
+        all_recent_outcomes: List[Dict[str, Any]],
+        retrieval: Optional[Dict[str, Any]],
+    ) -> List[Dict[str, Any]]:
+        """Build the search query and filters for one plan request and run the vector search."""
+        with stage("query_build"):
+            search_query, filters = self._build_search_inputs(profile, plan_request, all_recent_outcomes)
+        
+        # Perform semantic search - get more candidates for better variety
+        vector_store = await self.get_vector_store()
+        return await self._search_pool.run(
+            vector_store.search,
+            query=search_query,
+            k=50,  # Get more candidates to ensure variety
+            filters=filters,
+            retrieval=retrieval,
+        )
+
+    async def generate_recommendations_bulk(
+        self,
+        requests: List[Tuple[str, Dict[str, Any], Optional[Dict[str, Any]]]],
+        user_id: str,
+    ) -> List[Any]:
+        """Generate plans for several (profile_id, plan_request, retrieval) entries.
+
+        Candidate retrieval for the whole batch is one encoder pass and one FAISS
+        search per distinct filter set. Each entry of the returned list is either a
+        RecommendationResponse or the exception raised for that request.
+        """
+        results: List[Any] = [None] * len(requests)
+        prepared = []
+        for position, (profile_id, plan_request, retrieval) in enumerate(requests):
+            try:
+                profile, all_recent_outcomes = await self._load_profile_context(profile_id, user_id)
+                with stage("query_build"):
+                    search_query, filters = self._build_search_inputs(profile, plan_request, all_recent_outcomes)
+                prepared.append((position, profile, plan_request, all_recent_outcomes, search_query, filters, retrieval))
+            except Exception as e:
+                logger.error(f"Error preparing bulk recommendation for profile {profile_id}: {type(e).__name__}: {str(e)}")
+                results[position] = e
+
+        if prepared:
+            vector_store = await self.get_vector_store()
+            candidate_lists = await self._search_pool.run(
+                vector_store.search_many,
+                queries=[item[4] for item in prepared],
+                filters_list=[item[5] for item in prepared],
+                k=50,
+                retrieval_list=[item[6] for item in prepared],
+            )
+            for (position, profile, plan_request, all_recent_outcomes, _, _, _), candidates in zip(prepared, candidate_lists):
+                self._current_plan_request = plan_request
+                try:
+                    results[position] = await self._plan_from_candidates(
+                        profile, plan_request, candidates, all_recent_outcomes
+                    )
+                except Exception as e:
+                    logger.error(f"Error generating bulk recommendation for profile {profile.get('_id')}: {type(e).__name__}: {str(e)}")
+                    results[position] = e
+
+        return results
+
+    async def stream_recommendations(
+        self,
+        profile_id: str,
+        plan_request: Dict[str, Any],
+        user_id: str,
+        retrieval: Optional[Dict[str, Any]] = None,
+        include_tokens: bool = True,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Load the profile (ValueError if it is not the user's), then return its plan event stream.
+
+        Loading happens up front so a missing profile is still a 404 rather than
+        an error event in an already started response.
+        """
+        profile, all_recent_outcomes = await self._load_profile_context(profile_id, user_id)
+        return self.stream_for_profile(
+            profile, plan_request, all_recent_outcomes, retrieval=retrieval, include_tokens=include_tokens
+        )
+
+    async def stream_for_profile(
+        self,
+        profile: Dict[str, Any],
+        plan_request: Dict[str, Any],
+        all_recent_outcomes: List[Dict[str, Any]],
+        retrieval: Optional[Dict[str, Any]] = None,
+        include_tokens: bool = True,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Run the pipeline like ``generate_for_profile``, yielding events while the LLM writes.
+
+        Events, in order: ``candidates`` once the LLM candidates are chosen;
+        ``token`` for every text fragment from the provider (unless
+        ``include_tokens`` is False); ``activity`` (or ``activity_rejected``) as
+        each scheduled activity's JSON object completes, validated against the
+        candidates like the final parse; ``phase`` when a phase completes; and
+        ``plan`` with the final response. The final plan is authoritative: it
+        is the fallback plan when the complete response does not parse.
+        """
+        self._current_plan_request = plan_request
+        candidate_activities = await self._search_candidates(profile, plan_request, all_recent_outcomes, retrieval)
+        top_activities = await self._select_llm_candidates(profile, plan_request, candidate_activities)
+        yield {"event": "candidates", "count": len(top_activities)}
+
+        activity_lookup = self._activity_lookup(top_activities)
+        seen: set = set()  # IDs and lowercased names already scheduled
+        phase_counts: Dict[int, int] = {}
+        parser = PlanStreamParser()
+        chunks: List[str] = []
+        try:
+            with hold_llm_responses() as new_responses:
+                async for chunk in self.llm_provider.stream_activity_plan(
+                    **self._llm_plan_inputs(profile, plan_request, top_activities, all_recent_outcomes)
+                ):
+                    chunks.append(chunk)
+                    if include_tokens:
+                        yield {"event": "token", "text": chunk}
+                    for item in parser.feed(chunk):
+                        if item.kind == "activity":
+                            event = self._streamed_activity_event(item.phase_name, item.value, activity_lookup, seen)
+                            if event["event"] == "activity":
+                                phase_counts[item.phase_index] = phase_counts.get(item.phase_index, 0) + 1
+                            yield event
+                        else:
+                            yield {
+                                "event": "phase",
+                                "phase": item.phase_name,
+                                "order": item.value.get("order", item.phase_index + 1),
+                                "activity_count": phase_counts.get(item.phase_index, 0),
+                            }
+        except LLMOverloadedError as e:
+            # Raised while waiting for an LLM slot, before any text was generated
+            if settings.llm_overload_action != "fallback":
+                raise
+            plan = self._overload_fallback_plan(e, top_activities, plan_request)
+            yield {"event": "overloaded", "detail": str(e)}
+            yield {"event": "plan", **RecommendationResponse(plan=plan).model_dump(mode="json")}
+            return
+
+        plan = await self._accept_llm_plan("".join(chunks), new_responses, top_activities, plan_request)
+        yield {"event": "plan", **RecommendationResponse(plan=plan).model_dump(mode="json")}
+
+    def _overload_fallback_plan(
+        self, error: LLMOverloadedError, activities: List[Dict[str, Any]], plan_request: Dict[str, Any]
+    ) -> StructuredActivityPlan:
+        """Degraded answer when no LLM slot is free in time: the rule-based plan from the candidates."""
+        logger.warning(f"LLM overloaded, serving the fallback plan: {str(error)}")
+        PARSE_FALLBACKS.inc("llm_overloaded")
+        return self._create_fallback_plan(activities, plan_request)
+
+    def _streamed_activity_event(
+        self,
+        phase_name: str,
+        act_data: Dict[str, Any],
+        activity_lookup: Dict[str, Dict[str, Any]],
+        seen: set,
+    ) -> Dict[str, Any]:
+        """Validate one streamed activity the way ``_parse_structured_plan`` does."""
+        act_id = str(act_data.get('activity_id', ''))
+        act_name = str(act_data.get('activity_name', '')).strip()
+        rejected = {"event": "activity_rejected", "phase": phase_name, "activity_id": act_id, "activity_name": act_name}
+        if act_id in seen or act_name.lower() in seen:
+            return {**rejected, "reason": "duplicate"}
+        seen.update((act_id, act_name.lower()))
+        dataset_activity = activity_lookup.get(act_id) or activity_lookup.get(act_name.lower())
+        if not dataset_activity:
+            return {**rejected, "reason": "not_a_candidate"}
+        try:
+            activity = self._scheduled_activity(act_data, dataset_activity)
+        except ValueError:
+            return {**rejected, "reason": "invalid"}
+        return {"event": "activity", "phase": phase_name, "activity": activity.model_dump(mode="json")}
+
+    async def _load_profile_context(
+        self, profile_id: str, user_id: str
+    ) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """Fetch the child profile (verifying ownership) and its last 10 outcomes."""
+        db = get_database()
+        
+        # Fetch child profile and verify ownership
+        profile = await db.profiles.find_one({"_id": ObjectId(profile_id), "user_id": user_id})
+        if not profile:
+            logger.error(f"Profile {profile_id} not found for user {user_id}")
+            raise ValueError(f"Profile {profile_id} not found")
+        
+        # Fetch recent outcomes (last 10 for learning, last 3 for context)
+        all_recent_outcomes = await db.outcomes.find(
+            {"profile_id": profile_id}
+        ).sort("completed_at", -1).limit(10).to_list(10)
+        return profile, all_recent_outcomes
+
+    def _build_search_inputs(
+        self,
+        profile: Dict[str, Any],
+        plan_request: Dict[str, Any],
+        all_recent_outcomes: List[Dict[str, Any]],
+    ) -> Tuple[str, Dict[str, Any]]:
+        """Build the learning-enhanced search query and safety filters for a profile."""
+        recent_outcomes = all_recent_outcomes[:3]
+        
+        # Build semantic search query from profile and plan request
+        base_query = self._build_search_query(profile, plan_request, recent_outcomes)
+        # Enhance query with learning from outcomes
+        search_query = build_learning_enhanced_query(base_query, all_recent_outcomes, profile)
+        
+        # Apply filters for safety
+        filters = self._build_filters(profile)
+        return search_query, filters
+
+    async def _plan_from_candidates(
+        self,
+        profile: Dict[str, Any],
+        plan_request: Dict[str, Any],
+        candidate_activities: List[Dict[str, Any]],
+        all_recent_outcomes: List[Dict[str, Any]],
+        activity_scorer: Optional[ActivityScorer] = None,
+    ) -> RecommendationResponse:
+        """Re-rank and filter search candidates, then ask the LLM for the plan."""
+        top_activities = await self._select_llm_candidates(
+            profile, plan_request, candidate_activities, activity_scorer=activity_scorer
+        )
+        # Generate activity plan using LLM with RAG context
+        try:
+            with hold_llm_responses() as new_responses:
+                llm_response = await self.llm_provider.generate_activity_plan(
+                    **self._llm_plan_inputs(profile, plan_request, top_activities, all_recent_outcomes)
+                )
+        except LLMOverloadedError as e:
+            if settings.llm_overload_action != "fallback":
+                raise
+            return RecommendationResponse(plan=self._overload_fallback_plan(e, top_activities, plan_request))
+        
+        plan = await self._accept_llm_plan(llm_response, new_responses, top_activities, plan_request)
+        return RecommendationResponse(plan=plan)
+
+    async def _accept_llm_plan(
+        self,
+        llm_response: str,
+        new_responses: Dict[str, str],
+        activities: List[Dict[str, Any]],
+        plan_request: Dict[str, Any],
+    ) -> StructuredActivityPlan:
+        """Parse the LLM response; cache it only when it parses, otherwise use the fallback plan."""
+        with stage("parse"):
+            plan = self._parse_llm_plan_response(llm_response, activities, plan_request)
+        if plan is None:
+            return self._create_fallback_plan(activities, plan_request)
+        cache = get_llm_cache()
+        if cache is not None:
+            await cache.put_all(new_responses)
+        return plan
+
+    async def _select_llm_candidates(
+        self,
+        profile: Dict[str, Any],
+        plan_request: Dict[str, Any],
+        candidate_activities: List[Dict[str, Any]],
+        activity_scorer: Optional[ActivityScorer] = None,
+    ) -> List[Dict[str, Any]]:
+        """RL re-ranking, safety/materials/variety filtering and the MMR top-N sent to the LLM."""
+        profile_id = str(profile.get("_id", ""))
+        
+        # Load this child's stored activity scores (kept up to date by POST /outcomes)
+        if activity_scorer is None:
+            activity_scorer = await load_profile_scorer(
+                get_database(),
+                profile_id,
+                activity_ids=[str(a.get("id", "")) for a in candidate_activities],
+            )
+        
+        # Apply reinforcement learning: boost/penalize activities based on outcomes
+        with stage("rl"):
+            scored_activities = self._apply_reinforcement_learning(candidate_activities, activity_scorer)
+        
+        # Safety, materials and variety in one lazy pass over pre-tokenized records, then
+        # an MMR-diverse top-N for the LLM to do the final selection from
+        available_materials = plan_request.get('available_materials', [])
+        min_activities_required = 5  # Daily plan minimum
+        llm_candidate_count = max(settings.llm_candidate_count, min_activities_required)
+        top_activities = self._filter_candidates(
+            profile, candidate_activities, scored_activities, available_materials, llm_candidate_count
+        )
+        
+        if available_materials and len(top_activities) < min_activities_required:
+            # Still use only materials-matching activities (strict mode)
+            logger.warning(f"Only {len(top_activities)} activities match materials (need {min_activities_required}). This may limit plan generation.")
+        
+        # Compact prompts: drop candidates from the tail of the MMR order until the list fits the token budget
+        if settings.llm_prompt_mode == "compact" and settings.llm_prompt_token_budget > 0:
+            with stage("prompt_build"):
+                keep = trim_to_token_budget(
+                    [self._csv_activity_to_dict(a) for a in top_activities],
+                    settings.llm_prompt_token_budget,
+                    min_activities_required,
+                )
+            if len(keep) < len(top_activities):
+                logger.info(
+                    f"Prompt token budget {settings.llm_prompt_token_budget}: "
+                    f"kept {len(keep)} of {len(top_activities)} candidates"
+                )
+                top_activities = [top_activities[i] for i in keep]
+        
+        # Log RL impact on final selection
+        rl_boosted_in_final = [a for a in top_activities if a.get('_rl_boost', 1.0) > 1.0]
+        rl_penalized_in_final = [a for a in top_activities if a.get('_rl_boost', 1.0) < 1.0]
+        logger.info(
+            f"[RL] Final candidate selection: {len(top_activities)} activities | "
+            f"RL-boosted: {len(rl_boosted_in_final)} | "
+            f"RL-penalized: {len(rl_penalized_in_final)} | "
+            f"Neutral: {len(top_activities) - len(rl_boosted_in_final) - len(rl_penalized_in_final)}",
+            extra=SAMPLED,
+        )
+        return top_activities
+
+    def _llm_plan_inputs(
+        self,
+        profile: Dict[str, Any],
+        plan_request: Dict[str, Any],
+        top_activities: List[Dict[str, Any]],
+        all_recent_outcomes: List[Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        """Keyword arguments for the provider's plan call."""
+        return {
+            "child_profile": self._profile_to_dict(profile),
+            "activities": [self._csv_activity_to_dict(a) for a in top_activities],
+            "plan_request": plan_request,
+            "recent_outcomes": all_recent_outcomes[:3],  # Last 3 for LLM context
+        }
+
     def _build_search_query(
         self,
         profile: Dict[str, Any],
@@ -196,29 +591,6 @@ class RecommendationEngine:
         
         return " | ".join(query_parts)
 
-    def _parse_age_range(self, age_range_str: str) -> Optional[Tuple[int, int]]:
-        """Parse age range string like '4-6' into (min_age, max_age)."""
-        if not age_range_str or not isinstance(age_range_str, str):
-            return None
-        try:
-            if '-' in age_range_str:
-                parts = age_range_str.split('-')
-                if len(parts) == 2:
-                    min_age = int(parts[0].strip())
-                    max_age = int(parts[1].strip())
-                    return (min_age, max_age)
-        except (ValueError, AttributeError):
-            pass
-        return None
-
-    def _matches_age_range(self, child_age: int, activity_age_range: str) -> bool:
-        """Check if child age overlaps with activity age range."""
-        parsed = self._parse_age_range(activity_age_range)
-        if parsed is None:
-            return True  # If we can't parse, allow it (lenient)
-        min_age, max_age = parsed
-        return min_age <= child_age <= max_age
-
     def _build_filters(self, profile: Dict[str, Any]) -> Dict[str, Any]:
         """Build filters for vector search."""
         return {
@@ -227,249 +599,232 @@ class RecommendationEngine:
             "autism_level": profile.get("autism_level"),
         }
 
-    def _apply_safety_filters(
-        self, profile: Dict[str, Any], activities: List[Dict[str, Any]]
+    def _filter_candidates(
+        self,
+        profile: Dict[str, Any],
+        candidate_activities: List[Dict[str, Any]],
+        scored_activities: List[Dict[str, Any]],
+        available_materials: List[str],
+        top_n: int,
     ) -> List[Dict[str, Any]]:
-        """Filter activities based on triggers, age range, and sensory safety."""
-        filtered = []
-        triggers = profile.get("triggers", [])
+        """Run the RL-ranked candidates through the safety, materials, variety and MMR stages."""
+        feature_index = self._vector_store.feature_index if self._vector_store is not None else None
+        features_of = feature_index.get if feature_index is not None else CandidateFeatures
+        
+        pipeline = CandidatePipeline()
+        kept = {id(activity) for activity in scored_activities}
+        for activity in candidate_activities:
+            if id(activity) not in kept:
+                pipeline.reject(features_of(activity), "rl", "poor_outcomes")
+        
+        materials_predicate = self._strict_filter_by_materials(available_materials)
+        goals = [str(goal).lower() for goal in profile.get("goals", [])]
+        pipeline.filter("safety_filter", self._safety_predicates(profile))
+        pipeline.filter("materials_filter", [materials_predicate] if materials_predicate else [])
+        pipeline.then("variety", lambda candidates, p: self._ensure_activity_variety(candidates, p, goals))
+        pipeline.then("mmr", lambda candidates, p: self._diversify(candidates, p, top_n))
+        diverse = pipeline.run((activity, features_of(activity)) for activity in scored_activities)
+        
+        if trace_enabled():
+            for activity_id, stage_name, reason in pipeline.rejections:
+                logger.info(f"[Filter] Dropped {activity_id} at {stage_name}: {reason}")
+        logger.info(
+            f"[Filter] {len(candidate_activities)} candidates -> {len(diverse)} kept | "
+            f"Dropped: {pipeline.rejection_counts() or 'none'}",
+            extra=SAMPLED,
+        )
+        return diverse
+
+    def _safety_predicates(self, profile: Dict[str, Any]) -> List[Predicate]:
+        """Trigger, age range and sensory safety checks for this child, in the order applied."""
+        predicates: List[Predicate] = []
+        
+        # 1. Age range filter - enforce strict overlap (unparseable ranges are allowed)
         child_age = profile.get("age")
-        sensory_sensitivity = profile.get("sensory_sensitivity", {})
+        if child_age is not None:
+            def age(features: CandidateFeatures) -> Optional[str]:
+                if features.age_range is None:
+                    return None
+                min_age, max_age = features.age_range
+                return None if min_age <= child_age <= max_age else "age_range"
+            predicates.append(age)
         
-        for activity in activities:
-            skip = False
-            
-            # 1. Age range filter - enforce strict overlap
-            if child_age is not None:
-                age_range = activity.get("age_range", "")
-                if not self._matches_age_range(child_age, age_range):
-                    skip = True
-                    continue
-            
-            # 2. Autism level filter - match with CSV autism_level_suitability
-            autism_level = profile.get("autism_level", "")
-            if autism_level:
-                activity_autism_level = activity.get("autism_level_suitability", "")
-                # Direct matching: profile has "Level 1", "Level 2", or "Level 3", CSV has "Level 1 (mild support)", etc.
-                if autism_level not in activity_autism_level:
-                    continue
-            
-            # 3. Sensory safety filter
-            activity_sensory = activity.get("sensory_suitability", "").lower()
-            
-            # If child has high sensitivity to sound/light/touch, avoid sensory-seeking activities
-            if any(level in ['high', 'med'] for level in sensory_sensitivity.values()):
-                if 'sensory-seeking' in activity_sensory:
-                    continue
-            
-            filtered.append(activity)
+        # 2. Autism level filter - profile has "Level 1", CSV has "Level 1 (mild support)", etc.
+        autism_level = profile.get("autism_level", "")
+        if autism_level:
+            def level(features: CandidateFeatures) -> Optional[str]:
+                return None if autism_level in features.autism_levels else "autism_level"
+            predicates.append(level)
+        
+        # 3. Sensory safety: with high/med sensitivity to sound/light/touch, avoid sensory-seeking activities
+        sensory_sensitivity = profile.get("sensory_sensitivity", {})
+        if any(value in ['high', 'med'] for value in sensory_sensitivity.values()):
+            def sensory(features: CandidateFeatures) -> Optional[str]:
+                return "sensory_seeking" if features.sensory_seeking else None
+            predicates.append(sensory)
         
-        return filtered
+        return predicates
 
     def _apply_reinforcement_learning(
-        self, activities: List[Dict[str, Any]]
+        self, activities: List[Dict[str, Any]], activity_scorer: ActivityScorer
     ) -> List[Dict[str, Any]]:
-        """Apply reinforcement learning scores to activities and re-rank."""
-        scored = []
-        avoided_count = 0
-        boosted_count = 0
-        penalized_count = 0
-        neutral_count = 0
+        """Apply reinforcement learning scores to activities and re-rank.
+
+        Candidates are ranked by retrieval relevance x RL boost; activities with
+        poor recent outcomes are dropped. Scoring is one vectorized pass.
+        """
+        if not activities:
+            return []
         
-        logger.info(f"[RL] Evaluating {len(activities)} activities for RL scoring...")
+        activity_ids = [str(activity.get("id", "")) for activity in activities]
+        scores, boosts, avoid = activity_scorer.score_batch(activity_ids)
         
-        for idx, activity in enumerate(activities):
-            activity_id = str(activity.get("id", ""))
-            activity_name = activity.get("activity_name", "Unknown")[:50]
-            
-            # Check if activity should be avoided
-            if self._activity_scorer.should_avoid_activity(activity_id):
-                avoided_count += 1
-                logger.warning(f"[RL] [{idx+1}/{len(activities)}] AVOIDED: {activity_id} ({activity_name}) - Poor outcomes")
-                continue
-            
-            # Get RL boost multiplier
-            boost = self._activity_scorer.get_activity_boost(activity_id)
-            activity_score = self._activity_scorer.get_activity_score(activity_id)
-            
-            # Track boost/penalty status
-            if boost > 1.0:
-                boosted_count += 1
-                status = "BOOSTED"
-            elif boost < 1.0:
-                penalized_count += 1
-                status = "PENALIZED"
-            else:
-                neutral_count += 1
-                status = "NEUTRAL"
-            
-            logger.info(
-                f"[RL] [{idx+1}/{len(activities)}] {status}: {activity_id} ({activity_name}) | "
-                f"RL Score={activity_score:.3f} | Boost={boost:.2f}x"
+        # Hybrid search orders by fusion score; otherwise by similarity. Scale the retrieval
+        # score to [0.5, 1] within this candidate set so a 2x boost can lift the weakest
+        # candidate level with the strongest neutral one, as the old boost-only sort intended.
+        retrieval = np.fromiter(
+            (a.get("fusion_score", a.get("similarity_score", 0.0)) for a in activities),
+            dtype=np.float64,
+            count=len(activities),
+        )
+        spread = retrieval.max() - retrieval.min()
+        relevance = 0.5 + 0.5 * (retrieval - retrieval.min()) / spread if spread > 0 else np.ones(len(activities))
+        combined = relevance * boosts
+        
+        for idx in np.flatnonzero(avoid):
+            logger.warning(
+                f"[RL] AVOIDED: {activity_ids[idx]} ({activities[idx].get('activity_name', 'Unknown')[:50]}) - Poor outcomes"
             )
-            
-            # Add RL metadata to activity
-            activity_copy = activity.copy()
-            activity_copy['_rl_score'] = activity_score
-            activity_copy['_rl_boost'] = boost
-            
-            # Store original position for reference
-            activity_copy['_original_position'] = len(scored)
-            
-            scored.append(activity_copy)
-        
-        # Re-rank by RL boost (multiply semantic similarity by boost)
-        # Activities are already sorted by similarity, so we'll boost high-scoring ones
-        logger.info(f"[RL] Re-ranking activities by RL boost multiplier...")
-        scored.sort(key=lambda x: x.get('_rl_boost', 1.0), reverse=True)
-        
-        # Log top boosted activities
-        top_boosted = sorted(scored, key=lambda x: x.get('_rl_boost', 1.0), reverse=True)[:5]
-        if top_boosted:
-            logger.info(f"[RL] Top 5 boosted activities:")
-            for i, act in enumerate(top_boosted, 1):
+        
+        # Stable sort keeps retrieval order among equal combined scores
+        kept = np.flatnonzero(~avoid)
+        order = kept[np.argsort(-combined[kept], kind="stable")]
+        
+        scored = []
+        for idx in order:
+            # Search results are fresh copies per request, so annotate them in place
+            activity = activities[idx]
+            activity['_rl_score'] = float(scores[idx])
+            activity['_rl_boost'] = float(boosts[idx])
+            activity['_combined_score'] = float(combined[idx])
+            scored.append(activity)
+        
+        if trace_enabled():
+            # Per-candidate detail only for requests that asked for a debug trace
+            for rank, idx in enumerate(order, 1):
                 logger.info(
-                    f"[RL]   {i}. {act.get('activity_name', 'Unknown')[:50]} | "
-                    f"Boost={act.get('_rl_boost', 1.0):.2f}x | Score={act.get('_rl_score', 0.5):.3f}"
+                    f"[RL] [{rank}/{len(order)}] {activity_ids[idx]} "
+                    f"({activities[idx].get('activity_name', 'Unknown')[:50]}) | "
+                    f"RL Score={scores[idx]:.3f} | Boost={boosts[idx]:.2f}x | "
+                    f"Relevance={relevance[idx]:.3f} | Combined={combined[idx]:.3f}"
                 )
         
         logger.info(
-            f"[RL] ===== RL SUMMARY =====\n"
             f"[RL] Total processed: {len(activities)} | "
             f"Kept: {len(scored)} | "
-            f"Avoided: {avoided_count} | "
-            f"Boosted (>1.0x): {boosted_count} | "
-            f"Penalized (<1.0x): {penalized_count} | "
-            f"Neutral (1.0x): {neutral_count}"
+            f"Avoided: {int(avoid.sum())} | "
+            f"Boosted (>1.0x): {int((boosts[~avoid] > 1.0).sum())} | "
+            f"Penalized (<1.0x): {int((boosts[~avoid] < 1.0).sum())} | "
+            f"Neutral (1.0x): {int((boosts[~avoid] == 1.0).sum())}",
+            extra=SAMPLED,
         )
         
         return scored
 
     def _ensure_activity_variety(
-        self, activities: List[Dict[str, Any]], profile: Dict[str, Any]
-    ) -> List[Dict[str, Any]]:
-        """Ensure variety: no duplicates, mix domains, prioritize goal-matching activities."""
-        if not activities:
-            return []
-        
-        diverse = []
+        self, candidates: Iterator[Candidate], pipeline: CandidatePipeline, goals: List[str]
+    ) -> Iterator[Candidate]:
+        """Ensure variety: no duplicates, mix domains, prioritize goal-matching activities.
+
+        One pass. Goal-matching candidates stream straight through; the others
+        are held back and follow them, keeping their relative order. Only the
+        first activity of each near-duplicate cluster (precomputed when the
+        index is built, e.g. "... #4" and "... #5") is kept.
+        """
+        duplicate_index = self._vector_store.duplicate_index if self._vector_store is not None else None
+        others: List[Candidate] = []
+
+        def prioritized() -> Iterator[Candidate]:
+            for candidate in candidates:
+                if goals and candidate[1].matches_any_goal(goals):
+                    yield candidate
+                else:
+                    others.append(candidate)
+            yield from others
+
         seen_domains = set()
         seen_names = set()
         seen_ids = set()
-        
-        # Get profile goals for prioritization
-        goals = set(profile.get("goals", []))
-        
-        # Separate activities into goal-matching and others
-        goal_matching = []
-        others = []
-        
-        for activity in activities:
-            activity_name = activity.get("activity_name", "").lower()
-            activity_id = str(activity.get("id", ""))
-            domain = activity.get("domain", "").lower()
-            goal = activity.get("goal", "").lower()
-            skills = activity.get("skills_targeted", [])
-            if isinstance(skills, str):
-                skills = [s.lower() for s in skills.split(',') if s.strip()]
-            
-            # Check if activity matches any profile goal
-            matches_goal = False
-            if goals:
-                # Check if activity goal matches profile goal
-                for profile_goal in goals:
-                    profile_goal_lower = profile_goal.lower()
-                    if (profile_goal_lower in goal or 
-                        profile_goal_lower in activity_name or
-                        any(profile_goal_lower in skill for skill in skills)):
-                        matches_goal = True
-                        break
-            
-            if matches_goal:
-                goal_matching.append(activity)
-            else:
-                others.append(activity)
-        
-        # Prioritize goal-matching activities first
-        prioritized = goal_matching + others
-        
-        for activity in prioritized:
-            activity_name = activity.get("activity_name", "").lower()
-            activity_id = str(activity.get("id", ""))
-            domain = activity.get("domain", "").lower()
-            goal = activity.get("goal", "").lower()
-            
+        seen_clusters = set()
+        kept = 0
+        for activity, features in prioritized():
             # Skip exact duplicates by name or ID
-            if activity_name in seen_names or activity_id in seen_ids:
+            if features.name in seen_names or features.activity_id in seen_ids:
+                pipeline.reject(features, "variety", "duplicate")
                 continue
-            
-            seen_names.add(activity_name)
-            seen_ids.add(activity_id)
-            
-            # Prefer activities from different domains
-            domain_key = f"{domain}_{goal}"
-            if domain_key not in seen_domains or len(diverse) < 10:
-                diverse.append(activity)
-                seen_domains.add(domain_key)
-            elif len(diverse) < 30:  # Still add more if we have space
-                # Check if it's sufficiently different
-                is_different = True
-                for existing in diverse[:10]:  # Compare with first 10
-                    existing_name = existing.get("activity_name", "").lower()
-                    # Skip if names are too similar
-                    if activity_name in existing_name or existing_name in activity_name:
-                        is_different = False
-                        break
-                
-                if is_different:
-                    diverse.append(activity)
-        
-        return diverse
+            seen_names.add(features.name)
+            seen_ids.add(features.activity_id)
 
-    def _strict_filter_by_materials(
-        self, activities: List[Dict[str, Any]], available_materials: List[str]
-    ) -> List[Dict[str, Any]]:
-        """STRICTLY filter activities to only those that use available materials."""
+            cluster = duplicate_index.cluster(features.row) if duplicate_index is not None else -1
+            if cluster >= 0:
+                if cluster in seen_clusters:
+                    pipeline.reject(features, "variety", "near_duplicate")
+                    continue
+                seen_clusters.add(cluster)
+
+            # Prefer activities from different domains; repeats only while there is room
+            domain_key = (features.domain, features.goal)
+            if domain_key in seen_domains and kept >= 30:
+                pipeline.reject(features, "variety", "limit")
+                continue
+            seen_domains.add(domain_key)
+
+            kept += 1
+            yield activity, features
+
+    def _diversify(
+        self, candidates: Iterator[Candidate], pipeline: CandidatePipeline, top_n: int
+    ) -> Iterator[Candidate]:
+        """Yield the MMR top ``top_n`` of the kept candidates, using their stored embeddings."""
+        selected = list(candidates)
+        rows = [features.row for _, features in selected]
+        if self._vector_store is None or any(row is None for row in rows):
+            order = list(range(min(top_n, len(selected))))
+        else:
+            # Relevance from the incoming order (goal match first, then relevance x RL boost)
+            relevance = 1.0 - np.arange(len(selected)) / max(len(selected), 1)
+            order = self._vector_store.mmr_rerank(rows, relevance, settings.mmr_lambda, top_n=top_n)
+        chosen = set(order)
+        for position, (_, features) in enumerate(selected):
+            if position not in chosen:
+                pipeline.reject(features, "mmr", "below_top_n")
+        for position in order:
+            yield selected[position]
+
+    def _strict_filter_by_materials(self, available_materials: List[str]) -> Optional[Predicate]:
+        """STRICT materials check: keep only activities that use an available material.
+
+        The available materials are matched against the store's material
+        vocabulary once; each candidate is then a lookup in the postings mask.
+        Returns ``None`` when no materials were given (no filtering).
+        """
         if not available_materials:
-            return activities
-        
-        # Normalize available materials to lowercase
-        available_materials_lower = [mat.lower().strip() for mat in available_materials]
+            return None
         
-        matching_activities = []
+        material_index = self.vector_store.material_index
+        usable_rows = material_index.mask(available_materials)
+        usable_materials = material_index.matching_materials(available_materials)
         
-        for activity in activities:
-            activity_materials = activity.get('materials', '')
-            if isinstance(activity_materials, str):
-                activity_materials_list = [m.strip().lower() for m in activity_materials.split(',') if m.strip()]
-            elif isinstance(activity_materials, list):
-                activity_materials_list = [str(m).strip().lower() for m in activity_materials if m]
-            else:
-                activity_materials_list = []
-            
+        def materials(features: CandidateFeatures) -> Optional[str]:
             # Skip activities with no materials specified (strict mode)
-            if not activity_materials_list:
-                continue
-            
-            # Check if any material matches (case-insensitive, with partial matching)
-            matches = False
-            for mat in activity_materials_list:
-                # Exact match
-                if mat in available_materials_lower:
-                    matches = True
-                    break
-                # Partial match (e.g., "colored paper" contains "paper")
-                for avail_mat in available_materials_lower:
-                    if avail_mat in mat or mat in avail_mat:
-                        matches = True
-                        break
-                if matches:
-                    break
-            
-            if matches:
-                matching_activities.append(activity)
+            if not features.materials:
+                return "no_materials"
+            if features.row is not None:
+                return None if usable_rows[features.row] else "materials_unavailable"
+            # Record parsed outside the index: compare its terms with the matched vocabulary
+            return None if features.materials & usable_materials else "materials_unavailable"
         
-        return matching_activities
+        return materials
 
     def _prioritize_materials_match(
         self, activities: List[Dict[str, Any]], available_materials: List[str]
@@ -589,8 +944,8 @@ class RecommendationEngine:
     # Removed two-stage timetable planning methods - reverting to single-stage phase-based planning
     def _parse_llm_plan_response(
         self, llm_response: str, activities: List[Dict[str, Any]], plan_request: Dict[str, Any]
-    ) -> StructuredActivityPlan:
-        """Parse LLM JSON response and create a structured activity plan."""
+    ) -> Optional[StructuredActivityPlan]:
+        """Parse LLM JSON response into a structured activity plan (None when the fallback plan is needed)."""
         try:
             # Try to parse JSON and validate structure
             response_text = llm_response.strip()
@@ -610,37 +965,89 @@ class RecommendationEngine:
             if "plan_type" in data or ("schedule" in data and isinstance(data.get("schedule"), list)):
                 # New format detected - parse it
                 parsed_plan = self._parse_structured_plan(data, activities, plan_request)
+                if parsed_plan is None:
+                    return None
                 # Double-check activity count - if still only 3, use fallback
                 total_acts = sum(len(phase.activities) for phase in parsed_plan.schedule)
                 if total_acts < 5:
                     logger.warning(f"Parsed plan has only {total_acts} activities (expected 5-7), using fallback")
-                    return self._create_fallback_plan(activities, plan_request)
+                    PARSE_FALLBACKS.inc("too_few_activities")
+                    return None
                 return parsed_plan
             else:
                 # Old format or invalid - use fallback
                 logger.warning("LLM response not in expected structured format, using fallback")
-                return self._create_fallback_plan(activities, plan_request)
+                PARSE_FALLBACKS.inc("unstructured")
+                return None
                 
         except json.JSONDecodeError as e:
             logger.warning(f"Failed to parse LLM response as JSON: {e}")
-            return self._create_fallback_plan(activities, plan_request)
+            PARSE_FALLBACKS.inc("invalid_json")
+            return None
         except Exception as e:
             logger.error(f"Error parsing LLM response: {type(e).__name__}: {str(e)}")
-            return self._create_fallback_plan(activities, plan_request)
+            PARSE_FALLBACKS.inc("error")
+            return None
     
-    def _parse_structured_plan(
-        self, data: Dict[str, Any], activities: List[Dict[str, Any]], plan_request: Dict[str, Any]
-    ):
-        """Parse structured phase-based plan from LLM JSON response."""
-        from app.schemas import StructuredActivityPlan, PlanPhase, ScheduledActivity
-        
-        # Create activity lookup by ID and name
+    def _activity_lookup(self, activities: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Candidate activities keyed by ID and by lowercased name (and by prompt alias in compact mode)."""
+        compact = settings.llm_prompt_mode == "compact"
         activity_lookup = {}
-        for act in activities:
+        for position, act in enumerate(activities, 1):
             act_id = str(act.get('id', ''))
             act_name = act.get('activity_name', '')
             activity_lookup[act_id] = act
             activity_lookup[act_name.lower()] = act
+            if compact:
+                activity_lookup[activity_alias(position)] = act
+        return activity_lookup
+
+    def _scheduled_activity(self, act_data: Dict[str, Any], dataset_activity: Dict[str, Any]) -> ScheduledActivity:
+        """Build a plan activity from the LLM's entry and the matching dataset activity."""
+        act_id = str(act_data.get('activity_id', ''))
+        act_name = act_data.get('activity_name', '').strip()
+
+        # Prioritize step_instructions from dataset, only use LLM steps if they're different/adapted
+        dataset_steps = dataset_activity.get('step_instructions', [])
+        if isinstance(dataset_steps, str):
+            dataset_steps = [s.strip() for s in dataset_steps.split('.') if s.strip()]
+        elif not isinstance(dataset_steps, list):
+            dataset_steps = []
+
+        llm_steps = act_data.get('step_by_step', [])
+
+        # Use dataset steps as primary source, only use LLM steps if they exist and are different
+        # This prevents duplication and ensures we use the original activity instructions
+        if dataset_steps:
+            steps = dataset_steps[:10]  # Use dataset steps (up to 10)
+            # If LLM provided adapted steps and they're significantly different, we could merge them
+            # But for now, prioritize dataset steps to avoid duplication
+        elif llm_steps:
+            steps = llm_steps[:10]  # Fallback to LLM steps if no dataset steps
+        else:
+            steps = ["Follow the activity instructions"]  # Last resort
+
+        return ScheduledActivity(
+            # The dataset's ID, also when the LLM answered with a compact-prompt alias
+            activity_id=str(dataset_activity.get('id') or act_id),
+            activity_name=act_name,
+            domain=dataset_activity.get('domain') or act_data.get('domain', 'Mixed'),
+            description=act_data.get('description', f"This activity involves {act_name.lower()} and supports {dataset_activity.get('goal', 'development goals')}."),
+            recommended_duration_minutes=act_data.get('recommended_duration_minutes', dataset_activity.get('time_required_minutes', 20)),
+            difficulty_adaptation=act_data.get('difficulty_adaptation', 'Adapt based on child needs'),
+            why_this_activity_here=act_data.get('why_this_activity_here', 'Activity fits this phase'),
+            step_by_step=steps[:10],  # Max 10 steps
+            sensory_considerations=act_data.get('sensory_considerations', 'Consider child sensory sensitivities'),
+            expected_outcome=act_data.get('expected_outcome', 'Positive engagement and skill development')
+        )
+
+    def _parse_structured_plan(
+        self, data: Dict[str, Any], activities: List[Dict[str, Any]], plan_request: Dict[str, Any]
+    ) -> Optional[StructuredActivityPlan]:
+        """Parse structured phase-based plan from LLM JSON response (None when it is unusable)."""
+        from app.schemas import StructuredActivityPlan, PlanPhase, ScheduledActivity
+        
+        activity_lookup = self._activity_lookup(activities)
         
         # Extract plan metadata
         plan_type = data.get('plan_type', plan_request.get('plan_type', 'daily').capitalize())
@@ -684,40 +1091,7 @@ class RecommendationEngine:
                     logger.warning(f"Activity not found in dataset: {act_name} (ID: {act_id}), skipping")
                     continue
                 
-                # Prioritize step_instructions from dataset, only use LLM steps if they're different/adapted
-                dataset_steps = dataset_activity.get('step_instructions', [])
-                if isinstance(dataset_steps, str):
-                    dataset_steps = [s.strip() for s in dataset_steps.split('.') if s.strip()]
-                elif not isinstance(dataset_steps, list):
-                    dataset_steps = []
-                
-                llm_steps = act_data.get('step_by_step', [])
-                
-                # Use dataset steps as primary source, only use LLM steps if they exist and are different
-                # This prevents duplication and ensures we use the original activity instructions
-                if dataset_steps:
-                    steps = dataset_steps[:10]  # Use dataset steps (up to 10)
-                    # If LLM provided adapted steps and they're significantly different, we could merge them
-                    # But for now, prioritize dataset steps to avoid duplication
-                elif llm_steps:
-                    steps = llm_steps[:10]  # Fallback to LLM steps if no dataset steps
-                else:
-                    steps = ["Follow the activity instructions"]  # Last resort
-                
-                phase_activities.append(
-                    ScheduledActivity(
-                        activity_id=act_id,
-                        activity_name=act_name,
-                        domain=act_data.get('domain', dataset_activity.get('domain', 'Mixed')),
-                        description=act_data.get('description', f"This activity involves {act_name.lower()} and supports {dataset_activity.get('goal', 'development goals')}."),
-                        recommended_duration_minutes=act_data.get('recommended_duration_minutes', dataset_activity.get('time_required_minutes', 20)),
-                        difficulty_adaptation=act_data.get('difficulty_adaptation', 'Adapt based on child needs'),
-                        why_this_activity_here=act_data.get('why_this_activity_here', 'Activity fits this phase'),
-                        step_by_step=steps[:10],  # Max 10 steps
-                        sensory_considerations=act_data.get('sensory_considerations', 'Consider child sensory sensitivities'),
-                        expected_outcome=act_data.get('expected_outcome', 'Positive engagement and skill development')
-                    )
-                )
+                phase_activities.append(self._scheduled_activity(act_data, dataset_activity))
             
             if phase_activities:
                 phases.append(
@@ -732,7 +1106,8 @@ class RecommendationEngine:
         phase_names = {p.phase for p in phases}
         if 'Warm-up' not in phase_names or 'Core' not in phase_names or 'Calming' not in phase_names:
             logger.warning("Missing required phases, using fallback")
-            return self._create_fallback_plan(activities, plan_request)
+            PARSE_FALLBACKS.inc("missing_phases")
+            return None
         
         # Sort phases by order
         phases.sort(key=lambda p: p.order)
@@ -744,7 +1119,8 @@ class RecommendationEngine:
         
         if total_activities < min_count or total_activities > max_count:
             logger.warning(f"Plan has {total_activities} activities, expected {min_count}-{max_count}. Using fallback.")
-            return self._create_fallback_plan(activities, plan_request)
+            PARSE_FALLBACKS.inc("activity_count")
+            return None
         
         # Collect all materials from all activities
         all_materials = set()
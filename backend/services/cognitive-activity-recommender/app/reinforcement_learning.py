@@ -1,16 +1,87 @@
 """Reinforcement learning module for activity recommendations based on outcomes."""
 import logging
-from typing import List, Dict, Any, Optional
+import math
+from typing import List, Dict, Any, Optional, Sequence, Tuple
 from collections import defaultdict
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from app.config import settings
+from app.logging_config import SAMPLED, trace_enabled
 
 logger = logging.getLogger(__name__)
 
+# One document per (profile_id, activity_id) holding that child's running outcome totals
+SCORES_COLLECTION = "activity_scores"
+RECENT_OUTCOMES_KEPT = 10
+
+# Score thresholds and the boost multiplier each one earns (see get_activity_boost)
+BOOST_THRESHOLDS = (0.8, 0.6, 0.4, 0.2)
+BOOST_MULTIPLIERS = (2.0, 1.5, 1.0, 0.75)
+MIN_BOOST = 0.5
+
+# Bandit scorers keep exponentially decayed outcome evidence. An outcome at time t weighs
+# exp((t - epoch) / tau), anchored at a fixed epoch instead of "now" so stored sums never need
+# re-decaying. Those weights grow without bound, so only logs are kept: ``decay_log_weight`` is
+# the logsumexp of (t - epoch) / tau over outcomes and ``decay_mean_reward`` the weighted mean
+# reward. Decaying to the present is one subtraction in log space at scoring time.
+DECAY_EPOCH = datetime(2024, 1, 1)
+
+
+def outcome_reward(engagement: float, success: float, stress: float) -> float:
+    """Reward in [0, 1] for one outcome, using the heuristic's 40/40/20 weighting."""
+    return 0.4 * (engagement - 1) / 4.0 + 0.4 * (success - 1) / 4.0 + 0.2 * (1 - (stress - 1) / 4.0)
+
+
+def _decay_tau_seconds() -> float:
+    return settings.rl_half_life_days * 86400.0 / math.log(2)
+
+
+def _seconds_since_epoch(moment: datetime) -> float:
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return (moment - DECAY_EPOCH).total_seconds()
+
+
+def decay_log_weight(completed_at: datetime) -> float:
+    """Log of the epoch-anchored weight of an outcome completed at ``completed_at``."""
+    return _seconds_since_epoch(completed_at) / _decay_tau_seconds()
+
+
+def fold_decay(
+    log_weight: Optional[float], mean_reward: float, outcome_log_weight: float, reward: float
+) -> Tuple[float, float]:
+    """Add one outcome to (log of the decayed weight sum, weighted mean reward), via logsumexp."""
+    if log_weight is None:
+        return outcome_log_weight, reward
+    high = max(log_weight, outcome_log_weight)
+    combined = high + math.log(math.exp(log_weight - high) + math.exp(outcome_log_weight - high))
+    mean = mean_reward * math.exp(log_weight - combined) + reward * math.exp(outcome_log_weight - combined)
+    return combined, mean
+
+
+def _document_decay(document: Dict[str, Any]) -> Tuple[Optional[float], float]:
+    """Decayed evidence of a stored score document (from its totals when it has none)."""
+    if document.get('decay_log_weight') is not None:
+        return document['decay_log_weight'], document.get('decay_mean_reward', 0.0)
+    outcomes = document.get('total_outcomes', 0)
+    if outcomes and document.get('last_used') is not None:
+        # Written without decayed evidence (e.g. while RL_SCORER was heuristic): all outcomes as of last_used
+        return math.log(outcomes) + decay_log_weight(document['last_used']), outcome_reward(
+            document.get('total_engagement', 0) / outcomes,
+            document.get('total_success', 0) / outcomes,
+            document.get('total_stress', 0) / outcomes,
+        )
+    return None, 0.0
+
 
 class ActivityScorer:
     """Scores activities based on historical outcomes for reinforcement learning."""
     
-    def __init__(self):
+    def __init__(self, strategy: Optional[str] = None):
+        # "heuristic" (fixed weights), "thompson" or "ucb"; see score_batch
+        self.strategy = strategy or settings.rl_scorer
         self.activity_scores = defaultdict(lambda: {
             'total_outcomes': 0,
             'total_engagement': 0,
@@ -18,16 +89,55 @@ class ActivityScorer:
             'total_stress': 0,
             'recent_outcomes': [],  # Last 10 outcomes for this activity
             'last_used': None,
+            'decay_log_weight': None,  # logsumexp of decay_log_weight() over outcomes (bandits only)
+            'decay_mean_reward': 0.0,  # outcome_reward() averaged with those weights
         })
+        self._arrays = None
     
+    @classmethod
+    def from_documents(cls, documents: List[Dict[str, Any]], strategy: Optional[str] = None) -> "ActivityScorer":
+        """Build a scorer from stored per-activity score documents."""
+        scorer = cls(strategy)
+        for document in documents:
+            score_data = scorer.activity_scores[str(document['activity_id'])]
+            for key in ('total_outcomes', 'total_engagement', 'total_success', 'total_stress'):
+                score_data[key] = document.get(key, 0)
+            score_data['recent_outcomes'] = list(document.get('recent_outcomes', []))
+            score_data['last_used'] = document.get('last_used')
+            if scorer.strategy != "heuristic":
+                score_data['decay_log_weight'], score_data['decay_mean_reward'] = _document_decay(document)
+        scorer._arrays = None
+        return scorer
+
+    def to_documents(self, profile_id: str) -> List[Dict[str, Any]]:
+        """Per-activity score documents for ``profile_id`` (see SCORES_COLLECTION)."""
+        documents = []
+        for activity_id, score_data in self.activity_scores.items():
+            document = {
+                'profile_id': profile_id,
+                'activity_id': activity_id,
+                'total_outcomes': score_data['total_outcomes'],
+                'total_engagement': score_data['total_engagement'],
+                'total_success': score_data['total_success'],
+                'total_stress': score_data['total_stress'],
+                'recent_outcomes': score_data['recent_outcomes'],
+                'last_used': score_data['last_used'],
+            }
+            if score_data['decay_log_weight'] is not None:
+                document['decay_log_weight'] = score_data['decay_log_weight']
+                document['decay_mean_reward'] = score_data['decay_mean_reward']
+            documents.append(document)
+        return documents
+
     def update_from_outcomes(self, outcomes: List[Dict[str, Any]]) -> None:
         """Update activity scores based on outcomes."""
-        logger.info(f"[RL] Processing {len(outcomes)} outcomes for reinforcement learning")
+        logger.info(f"[RL] Processing {len(outcomes)} outcomes for reinforcement learning", extra=SAMPLED)
         
         if not outcomes:
-            logger.info("[RL] No outcomes available - using neutral scores for all activities")
             return
         
+        self._arrays = None
+        track_decay = self.strategy != "heuristic"
         for outcome in outcomes:
             activity_id = str(outcome.get('activity_id', ''))
             if not activity_id:
@@ -45,25 +155,24 @@ class ActivityScorer:
             score_data['total_engagement'] += engagement
             score_data['total_success'] += success
             score_data['total_stress'] += stress
+            if track_decay:
+                score_data['decay_log_weight'], score_data['decay_mean_reward'] = fold_decay(
+                    score_data['decay_log_weight'],
+                    score_data['decay_mean_reward'],
+                    decay_log_weight(_parse_completed_at(completed_at) if completed_at else datetime.utcnow()),
+                    outcome_reward(engagement, success, stress),
+                )
             
-            logger.info(
-                f"[RL] Updated activity {activity_id} ({activity_name[:50]}...): "
-                f"Engagement={engagement}/5, Success={success}/5, Stress={stress}/5 "
-                f"(Total outcomes: {old_outcomes} -> {score_data['total_outcomes']})"
-            )
+            if trace_enabled():
+                logger.info(
+                    f"[RL] Updated activity {activity_id} ({activity_name[:50]}...): "
+                    f"Engagement={engagement}/5, Success={success}/5, Stress={stress}/5 "
+                    f"(Total outcomes: {old_outcomes} -> {score_data['total_outcomes']})"
+                )
             
             # Keep recent outcomes (last 10)
             if completed_at:
-                try:
-                    if isinstance(completed_at, str):
-                        completed_at = datetime.fromisoformat(completed_at.replace('Z', '+00:00'))
-                    elif isinstance(completed_at, datetime):
-                        pass
-                    else:
-                        completed_at = datetime.utcnow()
-                except:
-                    completed_at = datetime.utcnow()
-                
+                completed_at = _parse_completed_at(completed_at)
                 score_data['recent_outcomes'].append({
                     'engagement': engagement,
                     'success': success,
@@ -75,7 +184,9 @@ class ActivityScorer:
                     score_data['recent_outcomes'],
                     key=lambda x: x['completed_at'],
                     reverse=True
-                )[:10]
+                )[:RECENT_OUTCOMES_KEPT]
+                if score_data['last_used'] is None or completed_at > score_data['last_used']:
+                    score_data['last_used'] = completed_at
     
     def get_activity_score(self, activity_id: str) -> float:
         """Get reinforcement learning score for an activity (0.0 to 1.0).
@@ -136,6 +247,113 @@ class ActivityScorer:
         
         return boost
     
+    def score_batch(
+        self,
+        activity_ids: Sequence[str],
+        now: Optional[datetime] = None,
+        rng: Optional[np.random.Generator] = None,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Scores, boost multipliers and avoid flags for many activities in one pass.
+
+        With the "heuristic" strategy this is the vectorized equivalent of
+        get_activity_score, get_activity_boost and should_avoid_activity. The
+        "thompson" and "ucb" strategies score from time-decayed outcome rewards
+        instead (see _bandit_scores); the avoid rule is the same for all.
+        """
+        arrays = self._aggregate_arrays()
+        slot_by_id = arrays['slot_by_id']
+        slots = np.fromiter(
+            (slot_by_id.get(str(activity_id), -1) for activity_id in activity_ids),
+            dtype=np.int64,
+            count=len(activity_ids),
+        )
+        known = slots >= 0
+        # Unknown activities read the trailing all-zero slot
+        slots = np.where(known, slots, len(slot_by_id))
+
+        total = arrays['total_outcomes'][slots]
+        has_history = total > 0
+        outcomes = np.where(has_history, total, 1)
+        engagement_score = (arrays['total_engagement'][slots] / outcomes - 1) / 4.0
+        success_score = (arrays['total_success'][slots] / outcomes - 1) / 4.0
+        stress_penalty = (arrays['total_stress'][slots] / outcomes - 1) / 4.0
+        base_score = 0.4 * engagement_score + 0.4 * success_score + 0.2 * (1 - stress_penalty)
+        reliability_boost = np.minimum(0.1, total * 0.01)
+
+        has_recent = arrays['recent_count'][slots] > 0
+        recent_success = arrays['recent_success'][slots]
+        recent_stress = arrays['recent_stress'][slots]
+        recency_boost = np.where(has_recent, (recent_success - 1) / 4.0 * 0.1, 0.0)
+
+        if self.strategy == "heuristic":
+            scores = np.clip(base_score + reliability_boost + recency_boost, 0.0, 1.0)
+            scores = np.where(has_history, scores, 0.5)
+        else:
+            scores = self._bandit_scores(arrays, slots, now, rng)
+        boosts = np.select([scores >= t for t in BOOST_THRESHOLDS], BOOST_MULTIPLIERS, MIN_BOOST)
+        avoid = (total >= 2) & has_recent & (recent_stress >= 4) & (recent_success <= 2)
+        return scores, boosts, avoid
+
+    def _bandit_scores(
+        self,
+        arrays: Dict[str, Any],
+        slots: np.ndarray,
+        now: Optional[datetime],
+        rng: Optional[np.random.Generator],
+    ) -> np.ndarray:
+        """Thompson sample or UCB of each activity's decayed Beta reward posterior."""
+        # Bring the epoch-anchored evidence to the present: weight of an outcome = 2^(-age / half-life)
+        log_now = decay_log_weight(now or datetime.utcnow())
+        weights = np.exp(arrays['decay_log_weight'] - log_now)  # -inf (no evidence) -> 0
+        weight = weights[slots]
+        reward = weight * arrays['decay_mean_reward'][slots]
+        prior = settings.rl_prior_strength / 2.0
+        alpha = prior + reward
+        beta = prior + np.maximum(weight - reward, 0.0)
+
+        if self.strategy == "thompson":
+            rng = rng or np.random.default_rng()
+            return rng.beta(alpha, beta)
+
+        # UCB1-style bonus over the decayed evidence collected for this child
+        total_weight = float(weights.sum())
+        mean = alpha / (alpha + beta)
+        bonus = settings.rl_ucb_exploration * np.sqrt(np.log1p(total_weight) / (alpha + beta))
+        return np.clip(mean + bonus, 0.0, 1.0)
+
+    def _aggregate_arrays(self) -> Dict[str, Any]:
+        """Per-activity aggregates as NumPy arrays, one row per scored activity (cached)."""
+        if self._arrays is not None:
+            return self._arrays
+        activity_ids = list(self.activity_scores)
+        size = len(activity_ids) + 1  # extra zero row for activities without history
+        arrays: Dict[str, Any] = {
+            'slot_by_id': {activity_id: slot for slot, activity_id in enumerate(activity_ids)},
+            'total_outcomes': np.zeros(size),
+            'total_engagement': np.zeros(size),
+            'total_success': np.zeros(size),
+            'total_stress': np.zeros(size),
+            'recent_count': np.zeros(size),
+            'recent_success': np.zeros(size),
+            'recent_stress': np.zeros(size),
+            'decay_log_weight': np.full(size, -np.inf),
+            'decay_mean_reward': np.zeros(size),
+        }
+        for slot, activity_id in enumerate(activity_ids):
+            score_data = self.activity_scores[activity_id]
+            for key in ('total_outcomes', 'total_engagement', 'total_success', 'total_stress', 'decay_mean_reward'):
+                arrays[key][slot] = score_data[key]
+            if score_data['decay_log_weight'] is not None:
+                arrays['decay_log_weight'][slot] = score_data['decay_log_weight']
+            # Recency and avoidance only look at the last 3 outcomes
+            recent = score_data['recent_outcomes'][:3]
+            if recent:
+                arrays['recent_count'][slot] = len(recent)
+                arrays['recent_success'][slot] = sum(o['success'] for o in recent) / len(recent)
+                arrays['recent_stress'][slot] = sum(o['stress'] for o in recent) / len(recent)
+        self._arrays = arrays
+        return arrays
+
     def should_avoid_activity(self, activity_id: str) -> bool:
         """Check if activity should be avoided based on poor outcomes."""
         score_data = self.activity_scores.get(str(activity_id))
@@ -160,6 +378,142 @@ class ActivityScorer:
         return False
 
 
+def _parse_completed_at(completed_at: Any) -> datetime:
+    try:
+        if isinstance(completed_at, str):
+            return datetime.fromisoformat(completed_at.replace('Z', '+00:00'))
+        if isinstance(completed_at, datetime):
+            return completed_at
+    except ValueError:
+        pass
+    return datetime.utcnow()
+
+
+async def backfill_profile_scores(db, profile_id: str) -> int:
+    """Rebuild a profile's stored scores from all of its logged outcomes.
+
+    Used once for profiles whose outcomes predate the score collection. Documents
+    are replaced, not incremented, so running it twice gives the same state.
+    """
+    outcomes = await db.outcomes.find({"profile_id": profile_id}).to_list(None)
+    if not outcomes:
+        return 0
+    logger.info(f"[RL] Backfilling activity scores for profile {profile_id} from {len(outcomes)} outcomes")
+    scorer = ActivityScorer()
+    scorer.update_from_outcomes(outcomes)
+    for document in scorer.to_documents(profile_id):
+        await db[SCORES_COLLECTION].replace_one(
+            {"profile_id": profile_id, "activity_id": document["activity_id"]},
+            document,
+            upsert=True,
+        )
+    return len(outcomes)
+
+
+async def _record_decayed_outcome(
+    db, key: Dict[str, Any], outcome_log_weight: float, reward: float
+) -> None:
+    """Fold one outcome into the decayed evidence of its (already upserted) score document.
+
+    A logsumexp is not a ``$inc``, so the fields are updated by compare-and-set
+    on ``decay_log_weight``. A failed set means another outcome was folded in
+    first, so the fold is retried on the new value until it applies.
+    """
+    while True:
+        document = await db[SCORES_COLLECTION].find_one(key)
+        if document is None:
+            return  # Deleted with its profile in the meantime
+        if 'decay_log_weight' in document:
+            # None on a new document: this is its first folded outcome
+            log_weight, mean_reward = fold_decay(
+                document['decay_log_weight'], document.get('decay_mean_reward', 0.0), outcome_log_weight, reward
+            )
+        else:
+            # Written while RL_SCORER was heuristic: the totals, which already count this outcome
+            log_weight, mean_reward = _document_decay(document)
+            if log_weight is None:
+                log_weight, mean_reward = fold_decay(None, 0.0, outcome_log_weight, reward)
+        result = await db[SCORES_COLLECTION].update_one(
+            {**key, "decay_log_weight": document.get('decay_log_weight')},
+            {"$set": {"decay_log_weight": log_weight, "decay_mean_reward": mean_reward}},
+        )
+        if result.matched_count:
+            return
+
+
+async def record_outcome(db, outcome: Dict[str, Any]) -> None:
+    """Fold one newly inserted outcome into the profile's stored activity scores."""
+    profile_id = str(outcome.get('profile_id', ''))
+    activity_id = str(outcome.get('activity_id', ''))
+    if not profile_id or not activity_id:
+        return
+
+    if await db[SCORES_COLLECTION].find_one({"profile_id": profile_id}) is None:
+        # First score for this profile: older outcomes (including this one) are replayed once
+        await backfill_profile_scores(db, profile_id)
+        return
+
+    engagement = outcome.get('engagement', 3)
+    success = outcome.get('success', 3)
+    stress = outcome.get('stress', 3)
+    completed_at = outcome.get('completed_at')
+    key = {"profile_id": profile_id, "activity_id": activity_id}
+    update: Dict[str, Any] = {
+        "$inc": {
+            "total_outcomes": 1,
+            "total_engagement": engagement,
+            "total_success": success,
+            "total_stress": stress,
+        },
+    }
+    track_decay = settings.rl_scorer != "heuristic"
+    if track_decay:
+        # A new document starts without decayed evidence; the outcome is folded in below
+        update["$setOnInsert"] = {"decay_log_weight": None, "decay_mean_reward": 0.0}
+    if completed_at:
+        completed_at = _parse_completed_at(completed_at)
+        update["$push"] = {
+            "recent_outcomes": {
+                "$each": [{
+                    'engagement': engagement,
+                    'success': success,
+                    'stress': stress,
+                    'completed_at': completed_at,
+                }],
+                "$sort": {"completed_at": -1},
+                "$slice": RECENT_OUTCOMES_KEPT,
+            }
+        }
+        update["$max"] = {"last_used": completed_at}
+
+    await db[SCORES_COLLECTION].update_one(key, update, upsert=True)
+    if track_decay:
+        await _record_decayed_outcome(
+            db,
+            key,
+            decay_log_weight(completed_at or datetime.utcnow()),
+            outcome_reward(engagement, success, stress),
+        )
+    logger.info(f"[RL] Recorded outcome for profile {profile_id}, activity {activity_id}", extra=SAMPLED)
+
+
+async def load_profile_scorer(
+    db, profile_id: str, activity_ids: Optional[List[str]] = None
+) -> ActivityScorer:
+    """Load the stored scores of one profile, optionally only for ``activity_ids``."""
+    query: Dict[str, Any] = {"profile_id": profile_id}
+    if activity_ids is not None:
+        query["activity_id"] = {"$in": [str(activity_id) for activity_id in activity_ids]}
+    documents = await db[SCORES_COLLECTION].find(query).to_list(None)
+
+    if not documents and await db[SCORES_COLLECTION].find_one({"profile_id": profile_id}) is None:
+        if await backfill_profile_scores(db, profile_id):
+            documents = await db[SCORES_COLLECTION].find(query).to_list(None)
+
+    logger.info(f"[RL] Loaded {len(documents)} stored activity scores for profile {profile_id}", extra=SAMPLED)
+    return ActivityScorer.from_documents(documents)
+
+
 def build_learning_enhanced_query(
     base_query: str,
     outcomes: List[Dict[str, Any]],
@@ -167,10 +521,9 @@ def build_learning_enhanced_query(
 ) -> str:
     """Enhance search query with learning from outcomes."""
     if not outcomes:
-        logger.info("[RL] No outcomes available - using base query without RL enhancement")
         return base_query
     
-    logger.info(f"[RL] Enhancing search query with learning from {len(outcomes)} outcomes")
+    tracing = trace_enabled()
     
     # Analyze outcomes to extract patterns
     successful_activities = []
@@ -186,36 +539,41 @@ def build_learning_enhanced_query(
         # Consider successful if engagement >= 4, success >= 4, stress <= 2
         if engagement >= 4 and success >= 4 and stress <= 2:
             successful_activities.append(activity_id)
-            logger.info(
-                f"[RL] Successful activity identified: {activity_id} ({activity_name[:40]}...) - "
-                f"Engagement={engagement}, Success={success}, Stress={stress}"
-            )
+            if tracing:
+                logger.info(
+                    f"[RL] Successful activity identified: {activity_id} ({activity_name[:40]}...) - "
+                    f"Engagement={engagement}, Success={success}, Stress={stress}"
+                )
         # Consider unsuccessful if engagement <= 2, success <= 2, or stress >= 4
         elif engagement <= 2 or success <= 2 or stress >= 4:
             unsuccessful_activities.append(activity_id)
-            logger.info(
-                f"[RL] Unsuccessful activity identified: {activity_id} ({activity_name[:40]}...) - "
-                f"Engagement={engagement}, Success={success}, Stress={stress}"
-            )
+            if tracing:
+                logger.info(
+                    f"[RL] Unsuccessful activity identified: {activity_id} ({activity_name[:40]}...) - "
+                    f"Engagement={engagement}, Success={success}, Stress={stress}"
+                )
     
     query_parts = [base_query]
     
     # Add learning signals
     if successful_activities:
         query_parts.append("Similar to activities that were highly engaging and successful")
-        logger.info(f"[RL] Query enhancement: Added signal for {len(successful_activities)} successful activities")
     
     if unsuccessful_activities:
         query_parts.append("Avoid activities similar to those with low engagement or high stress")
-        logger.info(f"[RL] Query enhancement: Added signal to avoid {len(unsuccessful_activities)} unsuccessful activities")
     
     # Analyze patterns in successful outcomes
     high_engagement_count = sum(1 for o in outcomes if o.get('engagement', 3) >= 4)
     if high_engagement_count >= len(outcomes) * 0.7:
         query_parts.append("Focus on highly engaging activities")
-        logger.info(f"[RL] Query enhancement: {high_engagement_count}/{len(outcomes)} outcomes had high engagement - focusing on engaging activities")
     
     enhanced_query = " | ".join(query_parts)
-    logger.info(f"[RL] Enhanced query: {enhanced_query}")
+    logger.info(
+        f"[RL] Enhanced query from {len(outcomes)} outcomes: {len(successful_activities)} successful, "
+        f"{len(unsuccessful_activities)} unsuccessful, {high_engagement_count} highly engaging",
+        extra=SAMPLED,
+    )
+    if tracing:
+        logger.info(f"[RL] Enhanced query: {enhanced_query}")
     return enhanced_query
 
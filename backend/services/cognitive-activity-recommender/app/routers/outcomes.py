@@ -4,6 +4,7 @@ from bson import ObjectId
 from app.schemas import ActivityOutcomeCreate, ActivityOutcomeResponse
 from app.database import get_database
 from app.auth import get_current_user_id
+from app.reinforcement_learning import record_outcome
 
 router = APIRouter(prefix="/outcomes", tags=["outcomes"])
 
@@ -26,6 +27,8 @@ async def create_outcome(
     
     outcome_dict = outcome.model_dump()
     result = await db.outcomes.insert_one(outcome_dict)
+    # Keep the per-profile RL scores current so recommendations never replay outcomes
+    await record_outcome(db, outcome_dict)
     created = await db.outcomes.find_one({"_id": result.inserted_id})
     return ActivityOutcomeResponse(**created)
 
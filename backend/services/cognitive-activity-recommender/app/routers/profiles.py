@@ -5,6 +5,7 @@ from bson import ObjectId
 from app.schemas import ChildProfile, ChildProfileCreate, ChildProfileUpdate
 from app.database import get_database
 from app.auth import get_current_user_id
+from app.reinforcement_learning import SCORES_COLLECTION
 
 router = APIRouter(prefix="/profiles", tags=["profiles"])
 
@@ -97,5 +98,6 @@ async def delete_profile(
     
     # Also delete associated outcomes
     await db.outcomes.delete_many({"profile_id": profile_id})
+    await db[SCORES_COLLECTION].delete_many({"profile_id": profile_id})
     return None
 
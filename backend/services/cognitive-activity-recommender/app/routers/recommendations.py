@@ -1,53 +1,102 @@
+import asyncio
+import json
 import logging
+import math
+import time
 import traceback
-from fastapi import APIRouter, HTTPException, Depends
-from typing import List
-from app.schemas import RecommendationRequest, RecommendationResponse
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from typing import Any, AsyncIterator, Dict, List, Optional
+from app.config import settings
+from app.schemas import (
+    RecommendationRequest,
+    RecommendationResponse,
+    BulkRecommendationRequest,
+    BulkRecommendationResponse,
+    BulkRecommendationResult,
+)
 from app.recommendation_engine import RecommendationEngine
-from app.auth import get_current_user_id
+from app.auth import get_admin_user, get_current_user_id
+from app.llm_cache import bypass_llm_cache
+from app.llm_providers import LLMOverloadedError, get_admission_controller, llm_user
+from app.logging_config import debug_trace
+from app.metrics import observe_stage_timings
+from app.timing import collect_timings
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/recommend", tags=["recommendations"])
 engine = RecommendationEngine()
+STREAM_PATH = "/stream"
+_last_index_reload = 0.0  # Monotonic time of the last admin-requested index reload
 
 
 @router.get("/materials", response_model=List[str])
-async def get_available_materials():
-    """Get all unique materials from the activity dataset."""
+async def get_available_materials(request: Request):
+    """Get all unique materials from the activity dataset.
+
+    The list is built once per index load; clients can revalidate with If-None-Match.
+    """
     try:
         # Load vector store to get all activities
-        vector_store = engine.vector_store
-        if not vector_store:
+        vector_store = await engine.get_vector_store()
+        material_index = getattr(vector_store, "material_index", None) if vector_store else None
+        if material_index is None:
             logger.warning("Vector store not loaded, returning empty list")
-            return []
-        
-        if not vector_store.metadata:
-            logger.warning("Vector store metadata not available, returning empty list")
-            return []
-        
-        # Extract all unique materials from activities
-        all_materials = set()
-        for activity in vector_store.metadata:
-            materials = activity.get('materials', '')
-            if isinstance(materials, str):
-                # Split by comma and clean up
-                material_list = [m.strip().lower() for m in materials.split(',') if m.strip()]
-                all_materials.update(material_list)
-            elif isinstance(materials, list):
-                all_materials.update([str(m).strip().lower() for m in materials if m])
+            return Response(content="[]", media_type="application/json", headers={"Cache-Control": "no-cache"})
         
-        # Sort and return as list (capitalize first letter for better display)
-        sorted_materials = sorted([m.capitalize() for m in all_materials])
-        return sorted_materials
+        headers = {"ETag": material_index.etag, "Cache-Control": "no-cache"}
+        if_none_match = request.headers.get("if-none-match", "")
+        client_etags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if material_index.etag in client_etags or "*" in client_etags:
+            return Response(status_code=304, headers=headers)
+        return Response(content=material_index.display_json, media_type="application/json", headers=headers)
     except Exception as e:
         logger.error(f"Error fetching materials: {type(e).__name__}: {str(e)}")
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Error fetching materials: {str(e)}")
 
 
+@router.get("/stats")
+async def get_recommender_stats():
+    """Runtime counters for the recommendation search path (cache hit rates etc.)."""
+    return engine.runtime_stats()
+
+
+@router.get("/queue")
+async def get_llm_queue(user_id: str = Depends(get_current_user_id)):
+    """LLM queue state and the caller's waiting plan requests (position, estimated wait)."""
+    admission = get_admission_controller()
+    if admission is None:
+        return {"max_concurrent": None, "active": 0, "queued": 0, "your_queued_requests": []}
+    return admission.queue_status(user_id)
+
+
+@router.post("/admin/reload-index")
+async def reload_index(
+    force: bool = Query(False, description="Reload even if the index files have not changed"),
+    current_user: dict = Depends(get_admin_user),
+):
+    """Swap in the activity index currently on disk without restarting the service (admins only)."""
+    global _last_index_reload
+    wait_seconds = settings.index_reload_min_interval_seconds - (time.monotonic() - _last_index_reload)
+    if _last_index_reload and wait_seconds > 0:
+        raise HTTPException(
+            status_code=429,
+            detail="Index was reloaded recently, please retry later",
+            headers={"Retry-After": str(math.ceil(wait_seconds))},
+        )
+    # Claimed before the reload runs, so concurrent calls are refused rather than queued
+    _last_index_reload = time.monotonic()
+    try:
+        logger.info(f"Index reload requested by {current_user.get('email') or current_user.get('id')}")
+        return await engine.reload_vector_store(force=force)
+    except Exception as e:
+        logger.error(f"Error reloading index: {type(e).__name__}: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"Error reloading index: {str(e)}")
+
+
 @router.post("", response_model=RecommendationResponse)
 async def get_recommendations(
     request: RecommendationRequest,
@@ -58,13 +107,22 @@ async def get_recommendations(
         plan_request_dict = request.plan_request.model_dump()
         plan_request_dict['plan_type'] = 'daily'
         
-        response = await engine.generate_recommendations(
-            profile_id=request.profile_id,
-            plan_request=plan_request_dict,
-            user_id=user_id,
-        )
+        with debug_trace(request.debug_trace), bypass_llm_cache(request.bypass_cache), llm_user(user_id):
+            response = await engine.generate_recommendations(
+                profile_id=request.profile_id,
+                plan_request=plan_request_dict,
+                user_id=user_id,
+                retrieval=request.retrieval.model_dump() if request.retrieval else None,
+            )
         
         return response
+    except LLMOverloadedError as e:
+        # Only raised with LLM_OVERLOAD_ACTION=reject; otherwise the fallback plan is returned
+        raise HTTPException(
+            status_code=503,
+            detail=f"Plan generation is busy, please retry: {str(e)}",
+            headers={"Retry-After": str(math.ceil(e.retry_after_seconds))},
+        )
     except ValueError as e:
         logger.error(f"ValueError in recommendations: {str(e)}")
         logger.error(traceback.format_exc())
@@ -81,3 +139,149 @@ async def get_recommendations(
             detail=f"Error generating recommendations: {type(e).__name__}: {str(e)}"
         )
 
+
+
+@router.post(STREAM_PATH)
+async def stream_recommendations(
+    request: RecommendationRequest,
+    tokens: bool = Query(True, description="Include the LLM's text fragments as token events"),
+    user_id: str = Depends(get_current_user_id)
+):
+    """Stream plan generation as NDJSON (one event object per line).
+
+    Activities arrive validated as soon as the LLM has written them; the last
+    event carries the final plan. See ``RecommendationEngine.stream_for_profile``.
+    """
+    try:
+        # Always use daily plan
+        plan_request_dict = request.plan_request.model_dump()
+        plan_request_dict['plan_type'] = 'daily'
+        
+        events = await engine.stream_recommendations(
+            profile_id=request.profile_id,
+            plan_request=plan_request_dict,
+            user_id=user_id,
+            retrieval=request.retrieval.model_dump() if request.retrieval else None,
+            include_tokens=tokens,
+        )
+    except ValueError as e:
+        logger.error(f"ValueError in streamed recommendations: {str(e)}")
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"Unexpected error in streamed recommendations: {type(e).__name__}: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error generating recommendations: {type(e).__name__}: {str(e)}"
+        )
+
+    return StreamingResponse(
+        _ndjson(events, request.debug_trace, request.bypass_cache, user_id),
+        media_type="application/x-ndjson",
+        # Proxies must pass events through as they are written
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _ndjson(
+    events: AsyncIterator[Dict[str, Any]], trace: bool, bypass_cache: bool, user_id: str
+) -> AsyncIterator[str]:
+    """Serialize plan events, ending with an ``overloaded`` or ``error`` event if generation fails.
+
+    Generation runs in its own task (with its own trace, cache and timing context),
+    so a client disconnect just cancels it. Headers are sent before the LLM
+    runs, so stage timings go to the metrics and a final ``timing`` event
+    instead of the Server-Timing header.
+    """
+    queue: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue()
+
+    async def produce() -> None:
+        started = time.perf_counter()
+        with debug_trace(trace), bypass_llm_cache(bypass_cache), llm_user(user_id), collect_timings() as timings:
+            try:
+                async for event in events:
+                    await queue.put(event)
+            except LLMOverloadedError as e:
+                # Only raised with LLM_OVERLOAD_ACTION=reject: the streamed form of the 503 + Retry-After
+                await queue.put({
+                    "event": "overloaded",
+                    "detail": f"Plan generation is busy, please retry: {str(e)}",
+                    "retry_after_seconds": math.ceil(e.retry_after_seconds),
+                })
+            except Exception as e:
+                logger.error(f"Error in streamed recommendations: {type(e).__name__}: {str(e)}")
+                logger.error(traceback.format_exc())
+                await queue.put({
+                    "event": "error",
+                    "detail": f"Error generating recommendations: {type(e).__name__}: {str(e)}",
+                })
+        elapsed = time.perf_counter() - started
+        if settings.metrics_enabled:
+            observe_stage_timings(timings, f"{router.prefix}{STREAM_PATH}", elapsed)
+        if settings.server_timing_header:
+            durations_ms = {name: round(ms, 1) for name, ms in timings.durations_ms.items()}
+            await queue.put({
+                "event": "timing",
+                "stages_ms": durations_ms,
+                "total_ms": round(elapsed * 1000, 1),
+                "prompt_tokens": timings.prompt_tokens,
+            })
+        await queue.put(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            event = await queue.get()
+            if event is None:
+                break
+            yield json.dumps(event) + "\n"
+    finally:
+        producer.cancel()
+
+
+@router.post("/bulk", response_model=BulkRecommendationResponse)
+async def get_bulk_recommendations(
+    request: BulkRecommendationRequest,
+    user_id: str = Depends(get_current_user_id)
+):
+    """Generate plans for a whole caseload; candidate search runs as one batch."""
+    try:
+        batch = []
+        for item in request.requests:
+            # Always use daily plan
+            plan_request_dict = item.plan_request.model_dump()
+            plan_request_dict['plan_type'] = 'daily'
+            retrieval = item.retrieval.model_dump() if item.retrieval else None
+            batch.append((item.profile_id, plan_request_dict, retrieval))
+        
+        # The trace and cache bypass are per call; any item asking for them enables them for the batch
+        trace = any(item.debug_trace for item in request.requests)
+        bypass_cache = any(item.bypass_cache for item in request.requests)
+        with debug_trace(trace), bypass_llm_cache(bypass_cache), llm_user(user_id):
+            outcomes = await engine.generate_recommendations_bulk(batch, user_id=user_id)
+        
+        results = []
+        for item, outcome in zip(request.requests, outcomes):
+            if isinstance(outcome, RecommendationResponse):
+                results.append(BulkRecommendationResult(
+                    profile_id=item.profile_id,
+                    plan=outcome.plan,
+                    generated_at=outcome.generated_at,
+                ))
+            else:
+                results.append(BulkRecommendationResult(
+                    profile_id=item.profile_id,
+                    error=f"{type(outcome).__name__}: {str(outcome)}",
+                ))
+        return BulkRecommendationResponse(results=results)
+    except RuntimeError as e:
+        logger.error(f"RuntimeError in bulk recommendations: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+    except Exception as e:
+        logger.error(f"Unexpected error in bulk recommendations: {type(e).__name__}: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error generating recommendations: {type(e).__name__}: {str(e)}"
+        )
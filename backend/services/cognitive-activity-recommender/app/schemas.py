@@ -185,9 +185,19 @@ class PlanRequest(BaseModel):
     time_available_minutes: Optional[int] = Field(None, ge=30, le=480, description="Total time available in minutes")
 
 
+class RetrievalOptions(BaseModel):
+    """Per-request override of how candidate activities are retrieved."""
+    mode: Optional[Literal["dense", "lexical", "hybrid"]] = Field(None, description="dense (FAISS), lexical (BM25) or hybrid (rank fusion); defaults to RETRIEVAL_MODE")
+    dense_weight: Optional[float] = Field(None, ge=0, le=10, description="Weight of the semantic ranking in hybrid mode")
+    lexical_weight: Optional[float] = Field(None, ge=0, le=10, description="Weight of the keyword ranking in hybrid mode")
+
+
 class RecommendationRequest(BaseModel):
     profile_id: str
     plan_request: PlanRequest
+    retrieval: Optional[RetrievalOptions] = None
+    debug_trace: bool = Field(False, description="Log the per-candidate RL trace for this request")
+    bypass_cache: bool = Field(False, description="Generate a new plan even if an identical LLM request is cached")
 
 
 class ScheduledActivity(BaseModel):
@@ -324,6 +334,23 @@ class RecommendationResponse(BaseModel):
     generated_at: datetime = Field(default_factory=datetime.utcnow)
 
 
+class BulkRecommendationRequest(BaseModel):
+    """Several plan requests answered with one batched candidate search."""
+    requests: List[RecommendationRequest] = Field(..., min_items=1, max_items=200)
+
+
+class BulkRecommendationResult(BaseModel):
+    """Outcome of one entry of a bulk request: either a plan or an error message."""
+    profile_id: str
+    plan: Optional[StructuredActivityPlan] = None
+    error: Optional[str] = None
+    generated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class BulkRecommendationResponse(BaseModel):
+    results: List[BulkRecommendationResult]
+
+
 class ActivityOutcome(BaseModel):
     profile_id: str
     activity_id: str
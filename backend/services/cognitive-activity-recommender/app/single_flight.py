@@ -0,0 +1,54 @@
+"""Coalescing of concurrent identical async calls (single-flight)."""
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+def request_key(*parts: Any) -> str:
+    """Stable hash of JSON-serializable parts (dict key order does not matter)."""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """Runs one computation per key at a time; concurrent callers with that key await it.
+
+    The computation runs as its own task (in the first caller's context), so
+    a caller that goes away does not cancel it for the others. Its result or
+    exception is shared, and the key is released as soon as it finishes:
+    later calls start a new computation.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[str, "asyncio.Task[Any]"] = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    async def run(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._tasks.get(key)
+        if task is not None:
+            self.coalesced += 1
+            logger.info(f"Joining in-flight computation {key[:12]} ({self.coalesced} coalesced so far)")
+        else:
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            self.executions += 1
+            task.add_done_callback(lambda done: self._release(key, done))
+        return await asyncio.shield(task)
+
+    def _release(self, key: str, task: "asyncio.Task[Any]") -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved even when every caller has gone away
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._tasks),
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+        }
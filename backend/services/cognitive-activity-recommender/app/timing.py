@@ -0,0 +1,74 @@
+"""Lightweight per-request stage timing for the recommendation pipeline.
+
+Code wraps a pipeline stage in ``with stage("search"):``. While a
+``collect_timings()`` block is active (per request, via a context variable),
+the elapsed time of every stage is accumulated on its ``StageTimings``;
+otherwise ``stage`` costs one context variable lookup.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+# Pipeline stages in execution order (used for reporting)
+STAGES = (
+    "query_build",
+    "encode",
+    "faiss",
+    "search",
+    "rl",
+    "safety_filter",
+    "materials_filter",
+    "variety",
+    "mmr",
+    "prompt_build",
+    "llm_queue",
+    "llm",
+    "parse",
+)
+
+_current: ContextVar[Optional["StageTimings"]] = ContextVar("stage_timings", default=None)
+
+
+class StageTimings:
+    """Milliseconds spent per stage during one request, and the prompt tokens it sent."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.durations_ms: Dict[str, float] = {}
+        self.prompt_tokens: Optional[int] = None  # None when no LLM call was made (e.g. cache hit)
+
+    def add(self, name: str, duration_ms: float) -> None:
+        # Stages may run on the blocking pool thread, so guard the dict
+        with self._lock:
+            self.durations_ms[name] = self.durations_ms.get(name, 0.0) + duration_ms
+
+
+def current_timings() -> Optional[StageTimings]:
+    return _current.get()
+
+
+@contextmanager
+def collect_timings() -> Iterator[StageTimings]:
+    """Collect stage timings for the code run inside the block."""
+    timings = StageTimings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time one pipeline stage (no-op when nobody is collecting)."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, (time.perf_counter() - start) * 1000)
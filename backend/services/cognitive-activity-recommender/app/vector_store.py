@@ -1,39 +1,142 @@
 """Vector store for activity recommendations using FAISS."""
+import hashlib
 import os
 import pickle
 import logging
-import re
+import threading
+import time
+from collections import OrderedDict
 import faiss
 import numpy as np
 from sentence_transformers import SentenceTransformer
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional, Tuple
 import pandas as pd
+from app.activity_store import ActivityTable, current_generation, generation_directory, publish_generation
+from app.candidate_pipeline import ActivityFeatureIndex
+from app.config import settings
+from app.filter_index import ActivityFilterIndex
+from app.lexical_index import BM25Index
+from app.material_index import MaterialIndex
+from app.near_duplicates import NearDuplicateIndex
+from app.timing import stage
 
 logger = logging.getLogger(__name__)
 
+RETRIEVAL_MODES = ("dense", "lexical", "hybrid")
+
+# Files saved next to the metadata columns in each generation directory
+INDEX_FILE = "index.faiss"
+LEXICAL_INDEX_FILE = "bm25.npz"
+DUPLICATE_INDEX_FILE = "dupes.npz"
+
+
+class QueryEmbeddingCache:
+    """Bounded LRU cache of normalized query embeddings with a TTL."""
+
+    def __init__(self, max_size: int = 512, ttl_seconds: float = 3600.0):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        # all-MiniLM-L6-v2 lowercases its input, so case and spacing do not change the embedding
+        return " ".join(str(query).split()).lower()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, embedding: np.ndarray) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
 
 class ActivityVectorStore:
-    def __init__(self, model_name: str = "all-MiniLM-L6-v2", index_path: str = "activity_index.faiss", metadata_path: str = "activity_metadata.pkl"):
+    def __init__(
+        self,
+        model_name: str = "all-MiniLM-L6-v2",
+        index_path: str = "activity_index.faiss",
+        metadata_path: str = "activity_metadata",
+        legacy_metadata_path: str = "activity_metadata.pkl",
+        reuse_model_from: Optional["ActivityVectorStore"] = None,
+    ):
         self.model = None
         self.lexical_only = False
-        try:
-            self.model = SentenceTransformer(model_name)
-        except Exception as e:
-            # On low-memory Windows machines, SentenceTransformer can fail with
-            # "paging file is too small". Fall back to lexical ranking so the
-            # recommender still works instead of returning HTTP 500.
-            logger.error(f"Error loading SentenceTransformer model: {str(e)}")
-            logger.warning("Falling back to lexical search mode (lower quality but low-memory).")
-            self.lexical_only = True
+        if reuse_model_from is not None:
+            # Reloading the index must not pay for (or double the memory of) a second model
+            self.model = reuse_model_from.model
+            self.lexical_only = reuse_model_from.lexical_only
+        else:
+            try:
+                self.model = SentenceTransformer(model_name)
+            except Exception as e:
+                # On low-memory Windows machines, SentenceTransformer can fail with
+                # "paging file is too small". Fall back to lexical ranking so the
+                # recommender still works instead of returning HTTP 500.
+                logger.error(f"Error loading SentenceTransformer model: {str(e)}")
+                logger.warning("Falling back to lexical search mode (lower quality but low-memory).")
+                self.lexical_only = True
         
         # Use absolute paths relative to backend directory
         backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         self.index_path = os.path.join(backend_dir, index_path) if not os.path.isabs(index_path) else index_path
         self.metadata_path = os.path.join(backend_dir, metadata_path) if not os.path.isabs(metadata_path) else metadata_path
+        # Pickled list of dicts written by older versions; read once and converted
+        self.legacy_metadata_path = (
+            os.path.join(backend_dir, legacy_metadata_path) if not os.path.isabs(legacy_metadata_path) else legacy_metadata_path
+        )
+        # BM25 postings for the lexical path and near-duplicate activity clusters; both are
+        # saved in the generation directory with the FAISS index
+        self.lexical_index = None
+        self.duplicate_index = None
+        self.loaded_signature = None
         
         self.index = None
-        self.metadata = []
+        self.metadata: ActivityTable = ActivityTable.from_records([])
+        self.filter_index = None
+        self.feature_index = None
+        self.material_index = None
         self.dimension = 384  # Dimension for all-MiniLM-L6-v2
+        self.query_cache = QueryEmbeddingCache(
+            max_size=settings.query_embedding_cache_size,
+            ttl_seconds=settings.query_embedding_cache_ttl_seconds,
+        )
         
     def _create_text_representation(self, activity: Dict[str, Any]) -> str:
         """Create a text representation of an activity for embedding."""
@@ -75,32 +178,127 @@ class ActivityVectorStore:
         self.index.add(embeddings.astype('float32'))
         
         # Store metadata
-        self.metadata = activities
+        self.metadata = ActivityTable.from_records(activities)
+        self._build_runtime_indexes()
         
         print(f"Created index with {self.index.ntotal} vectors")
     
+    def ingest_csv(self, csv_path: str) -> Dict[str, int]:
+        """Bring the loaded index in line with ``csv_path``, re-embedding only what changed.
+
+        Rows are matched on ``id`` and compared by a hash of their text representation.
+        Vectors of unchanged rows are copied out of the current index, so only added or
+        edited activities go through the encoder; rows missing from the CSV are dropped.
+        Call ``save()`` afterwards to persist the result.
+        """
+        if self.index is None:
+            raise RuntimeError("Vector store must be loaded before an incremental ingest")
+        if self.model is None:
+            raise RuntimeError("Embedding model is not available; cannot ingest activities")
+
+        print(f"Loading activities from {csv_path}...")
+        new_table = ActivityTable.from_records(pd.read_csv(csv_path).to_dict('records'))
+
+        # Hash both sides through the same table encoding so unchanged rows compare equal
+        old_rows = {}
+        for row, activity in enumerate(self.metadata):
+            old_rows[str(activity.get('id', ''))] = (row, self._text_hash(activity))
+
+        vectors = np.zeros((len(new_table), self.index.d), dtype='float32')
+        to_embed: List[int] = []
+        stats = {"added": 0, "changed": 0, "unchanged": 0, "removed": 0}
+        seen_ids = set()
+        for row, activity in enumerate(new_table):
+            activity_id = str(activity.get('id', ''))
+            seen_ids.add(activity_id)
+            previous = old_rows.get(activity_id)
+            if previous is None:
+                stats["added"] += 1
+                to_embed.append(row)
+            elif previous[1] != self._text_hash(activity):
+                stats["changed"] += 1
+                to_embed.append(row)
+            else:
+                stats["unchanged"] += 1
+                vectors[row] = self.index.reconstruct(previous[0])
+        stats["removed"] = sum(1 for activity_id in old_rows if activity_id not in seen_ids)
+
+        if to_embed:
+            texts = [self._create_text_representation(new_table[row]) for row in to_embed]
+            print(f"Creating embeddings for {len(texts)} new or changed activities...")
+            embeddings = np.ascontiguousarray(self.model.encode(texts, show_progress_bar=True), dtype='float32')
+            faiss.normalize_L2(embeddings)
+            vectors[to_embed] = embeddings
+
+        # A flat index over 1200 stored vectors rebuilds in milliseconds; keeping row == FAISS id
+        # means the metadata, filter masks and selectors need no id translation
+        index = faiss.IndexFlatL2(self.index.d)
+        index.add(vectors)
+        self.index = index
+        self.metadata = new_table
+        self._build_runtime_indexes()
+
+        stats["embedded"] = len(to_embed)
+        print(
+            f"Incremental ingest: {stats['added']} added, {stats['changed']} changed, "
+            f"{stats['removed']} removed, {stats['unchanged']} unchanged"
+        )
+        return stats
+
+    def _text_hash(self, activity: Dict[str, Any]) -> str:
+        return hashlib.sha1(self._create_text_representation(activity).encode('utf-8')).hexdigest()
+
     def save(self):
-        """Save the index and metadata to disk."""
+        """Save the index, metadata and derived indexes to disk as one generation.
+
+        Everything goes into a new ``activity_metadata.<generation>/`` directory, which
+        readers only see once ``activity_metadata.current`` is switched to it with a single
+        ``os.replace``; a load never mixes the files of two saves.
+        """
         if self.index is not None:
-            faiss.write_index(self.index, self.index_path)
-            with open(self.metadata_path, 'wb') as f:
-                pickle.dump(self.metadata, f)
-            print(f"Saved index to {self.index_path} and metadata to {self.metadata_path}")
-    
+            def write(directory: str, generation: str) -> None:
+                signature = str(("generation", generation))
+                self.metadata.write(directory)
+                faiss.write_index(self.index, os.path.join(directory, INDEX_FILE))
+                self.lexical_index.signature = signature
+                self.lexical_index.save(os.path.join(directory, LEXICAL_INDEX_FILE))
+                self.duplicate_index.signature = signature
+                self.duplicate_index.save(os.path.join(directory, DUPLICATE_INDEX_FILE))
+
+            generation = publish_generation(self.metadata_path, write)
+            self.loaded_signature = ("generation", generation)
+            print(f"Saved index and metadata to {generation_directory(self.metadata_path, generation)}")
+
+    def disk_signature(self) -> Optional[Tuple]:
+        """Identify the index generation currently on disk (cheap enough to poll)."""
+        generation = current_generation(self.metadata_path)
+        if generation is not None:
+            return ("generation", generation)
+        # Index files from before generations: fall back to the index file's stat
+        try:
+            stat = os.stat(self.index_path)
+            return ("index", stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
     def load(self):
         """Load the index and metadata from disk."""
-        if not os.path.exists(self.index_path):
-            logger.warning(f"Index file not found: {self.index_path}")
-            return False
-        
-        if not os.path.exists(self.metadata_path):
-            logger.warning(f"Metadata file not found: {self.metadata_path}")
-            return False
-        
+        generation = current_generation(self.metadata_path)
+        if generation is None:
+            # Nothing saved in the generation layout yet; never fall back to the pickle once it is
+            return self._load_legacy()
+
         try:
-            self.index = faiss.read_index(self.index_path)
-            with open(self.metadata_path, 'rb') as f:
-                self.metadata = pickle.load(f)
+            signature = ("generation", generation)
+            directory = generation_directory(self.metadata_path, generation)
+            self.index = faiss.read_index(os.path.join(directory, INDEX_FILE))
+            self.metadata = ActivityTable.open_directory(directory)
+            if self.index.ntotal != len(self.metadata):
+                raise RuntimeError(
+                    f"Index has {self.index.ntotal} vectors but metadata has {len(self.metadata)} activities"
+                )
+            self._build_runtime_indexes(signature, directory)
+            self.loaded_signature = signature
             logger.info(f"Successfully loaded vector store: {len(self.metadata)} activities, {self.index.ntotal} vectors")
             return True
         except Exception as e:
@@ -108,42 +306,130 @@ class ActivityVectorStore:
             import traceback
             logger.error(traceback.format_exc())
             raise
+
+    def _load_legacy(self) -> bool:
+        """Load the shipped ``activity_index.faiss`` + pickled metadata and save them as a generation."""
+        if not os.path.exists(self.index_path):
+            logger.warning(f"Index file not found: {self.index_path}")
+            return False
+        if not os.path.exists(self.legacy_metadata_path):
+            logger.warning(f"Metadata not found: {self.legacy_metadata_path}")
+            return False
+
+        logger.info(f"Converting {self.index_path} and {self.legacy_metadata_path} to {self.metadata_path}.<generation>")
+        signature = self.disk_signature()
+        self.index = faiss.read_index(self.index_path)
+        with open(self.legacy_metadata_path, 'rb') as f:
+            self.metadata = ActivityTable.from_records(pickle.load(f))
+        if self.index.ntotal != len(self.metadata):
+            raise RuntimeError(
+                f"Index has {self.index.ntotal} vectors but metadata has {len(self.metadata)} activities"
+            )
+        self._build_runtime_indexes()
+        self.loaded_signature = signature
+        try:
+            self.save()
+        except OSError as e:
+            logger.warning(f"Could not save the converted index ({e}); using in-memory copy")
+            return True
+        # Serve from the saved generation: memory-mapped columns are shared between workers
+        return self.load()
     
-    def search(self, query: str, k: int = 10, filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+    def search(
+        self,
+        query: str,
+        k: int = 10,
+        filters: Dict[str, Any] = None,
+        retrieval: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
         """Search for similar activities using semantic search."""
+        return self.search_many([query], [filters], k=k, retrieval_list=[retrieval])[0]
+
+    def search_many(
+        self,
+        queries: List[str],
+        filters_list: Optional[List[Optional[Dict[str, Any]]]] = None,
+        k: int = 10,
+        retrieval_list: Optional[List[Optional[Dict[str, Any]]]] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """Search for several queries at once.
+
+        All queries are encoded in one batch; queries that share the same filter
+        mask are answered by a single FAISS matrix search. ``retrieval_list`` holds
+        per-query overrides of the retrieval mode and fusion weights.
+        """
+        if filters_list is None:
+            filters_list = [None] * len(queries)
+        if retrieval_list is None:
+            retrieval_list = [None] * len(queries)
+        if len(filters_list) != len(queries) or len(retrieval_list) != len(queries):
+            raise ValueError(
+                f"Got {len(queries)} queries but {len(filters_list)} filter sets "
+                f"and {len(retrieval_list)} retrieval options"
+            )
+        if not queries:
+            return []
+
         if len(self.metadata) == 0:
             logger.warning("Vector store is empty or not loaded")
-            return []
+            return [[] for _ in queries]
         
         try:
-            if self.lexical_only or self.model is None or self.index is None:
-                return self._lexical_search(query, k=k, filters=filters)
+            options = [self._retrieval_options(retrieval) for retrieval in retrieval_list]
+            masks = [self.filter_index.mask(filters) if filters else None for filters in filters_list]
+            dense_available = not (self.lexical_only or self.model is None or self.index is None)
+            dense_positions = [
+                position for position, option in enumerate(options)
+                if dense_available and option["mode"] != "lexical"
+            ]
 
-            # Create query embedding
-            query_embedding = self.model.encode([query])
-            faiss.normalize_L2(query_embedding)
-            query_embedding = query_embedding.astype('float32')
-            
-            # Search
-            search_k = min(k * 2, self.index.ntotal)
-            distances, indices = self.index.search(query_embedding, search_k)
-            
-            # Get results and apply filters
-            results = []
-            for i, idx in enumerate(indices[0]):
-                if idx < len(self.metadata):
-                    activity = self.metadata[idx].copy()
-                    activity['similarity_score'] = float(1 - distances[0][i])  # Convert distance to similarity
-                    
-                    # Apply filters if provided
-                    if filters:
-                        if self._matches_filters(activity, filters):
-                            results.append(activity)
+            dense_hits: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+            query_embeddings = None
+            if dense_positions:
+                with stage("encode"):
+                    query_embeddings = self._encode_queries([queries[p] for p in dense_positions])
+
+                # Group queries by filter mask so each distinct mask needs one search
+                groups: Dict[bytes, Tuple[Optional[np.ndarray], List[int]]] = {}
+                for row, position in enumerate(dense_positions):
+                    mask = masks[position]
+                    key = b"" if mask is None else np.packbits(mask).tobytes()
+                    groups.setdefault(key, (mask, []))[1].append(row)
+
+                with stage("faiss"):
+                    for mask, rows in groups.values():
+                        depth = max(self._retrieval_depth(options[dense_positions[row]], k) for row in rows)
+                        params, search_k = self._search_params(mask, depth)
+                        if search_k == 0:
+                            continue
+                        # Search only among rows that pass the filters, so we always get k valid candidates
+                        distances, indices = self.index.search(query_embeddings[rows], search_k, params=params)
+                        for i, row in enumerate(rows):
+                            dense_hits[dense_positions[row]] = (indices[i], distances[i])
+
+            embedding_rows = {position: row for row, position in enumerate(dense_positions)}
+            no_hits = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+            results: List[List[Dict[str, Any]]] = []
+            # BM25 / fusion ranking and building the result rows (FAISS itself is timed above)
+            with stage("search"):
+                for position, query in enumerate(queries):
+                    mode = options[position]["mode"] if dense_available else "lexical"
+                    if mode == "lexical":
+                        results.append(self._lexical_search(query, k=k, mask=masks[position]))
+                        continue
+                    indices, distances = dense_hits.get(position, no_hits)
+                    if mode == "dense":
+                        results.append(self._collect_results(distances[:k], indices[:k]))
                     else:
-                        results.append(activity)
-                    
-                    if len(results) >= k:
-                        break
+                        results.append(self._hybrid_results(
+                            query,
+                            query_embeddings[embedding_rows[position]],
+                            indices,
+                            distances,
+                            masks[position],
+                            k,
+                            options[position],
+                        ))
             
             return results
         except Exception as e:
@@ -152,72 +438,228 @@ class ActivityVectorStore:
             logger.error(traceback.format_exc())
             raise
 
-    def _lexical_search(self, query: str, k: int = 10, filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
-        """Low-memory fallback when the embedding model cannot be loaded."""
-        query_tokens = self._tokenize(query)
-        if not query_tokens:
-            query_tokens = set()
+    def warm_up(self) -> None:
+        """Run one dummy encode and search so lazy model/FAISS initialisation happens now."""
+        if self.lexical_only or self.model is None or self.index is None:
+            return
+        embedding = np.ascontiguousarray(self.model.encode(["warm-up query"]), dtype='float32')
+        faiss.normalize_L2(embedding)
+        self.index.search(embedding, min(1, self.index.ntotal))
 
-        scored = []
-        for activity in self.metadata:
-            if filters and not self._matches_filters(activity, filters):
+    def _encode_queries(self, queries: List[str]) -> np.ndarray:
+        """Return normalized query embeddings, encoding only queries missing from the cache."""
+        keys = [self.query_cache.normalize(q) for q in queries]
+        embeddings: Dict[str, np.ndarray] = {}
+        missing: List[str] = []
+        for key in keys:
+            if key in embeddings or key in missing:
                 continue
-
-            text = self._create_text_representation(activity)
-            text_tokens = self._tokenize(text)
-            overlap = len(query_tokens & text_tokens)
-            if not query_tokens:
-                score = 0.0
+            cached = self.query_cache.get(key)
+            if cached is not None:
+                embeddings[key] = cached
             else:
-                score = overlap / max(len(query_tokens), 1)
+                missing.append(key)
+
+        if missing:
+            # Encode all cache misses in one encoder pass
+            encoded = np.ascontiguousarray(self.model.encode(missing), dtype='float32')
+            faiss.normalize_L2(encoded)
+            for key, embedding in zip(missing, encoded):
+                embeddings[key] = embedding
+                self.query_cache.put(key, embedding)
 
-            scored_activity = activity.copy()
-            scored_activity["similarity_score"] = float(score)
-            scored.append(scored_activity)
+        return np.ascontiguousarray(np.stack([embeddings[key] for key in keys]), dtype='float32')
 
-        scored.sort(key=lambda item: item.get("similarity_score", 0.0), reverse=True)
-        return scored[:k]
+    def _collect_results(self, distances: np.ndarray, indices: np.ndarray) -> List[Dict[str, Any]]:
+        """Materialize FAISS hits as activity dicts with a similarity score."""
+        results = []
+        for i, idx in enumerate(indices):
+            if 0 <= idx < len(self.metadata):
+                activity = self.metadata[idx].copy()
+                activity['similarity_score'] = float(1 - distances[i])  # Convert distance to similarity
+                results.append(activity)
+        return results
 
-    def _tokenize(self, text: str) -> set[str]:
-        return {
-            token
-            for token in re.findall(r"[a-z0-9_]+", str(text).lower())
-            if len(token) > 1
+    def _lexical_search(self, query: str, k: int = 10, mask: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+        """BM25 ranking; also the low-memory fallback when the embedding model cannot be loaded."""
+        hits = self.lexical_index.search(query, k, mask)
+
+        # Scale BM25 scores to (0, 1] relative to the best hit so they read like similarities
+        top_score = hits[0][1] if hits else 0.0
+        results = []
+        for row, score in hits:
+            activity = self.metadata[row].copy()
+            activity["similarity_score"] = float(score / top_score) if top_score > 0 else 0.0
+            results.append(activity)
+        return results
+
+    def _retrieval_options(self, retrieval: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Fill per-request retrieval overrides with the configured defaults."""
+        retrieval = retrieval or {}
+        options = {
+            "mode": retrieval.get("mode") or settings.retrieval_mode,
+            "dense_weight": retrieval.get("dense_weight"),
+            "lexical_weight": retrieval.get("lexical_weight"),
         }
-    
-    def _matches_filters(self, activity: Dict[str, Any], filters: Dict[str, Any]) -> bool:
-        """Check if activity matches the provided filters."""
-        # Age filter
-        if 'age' in filters:
-            age = filters['age']
-            age_range = activity.get('age_range', '')
-            if age_range and '-' in age_range:
-                try:
-                    min_age, max_age = map(int, age_range.split('-'))
-                    if not (min_age <= age <= max_age):
-                        return False
-                except:
-                    pass
-        
-        # Sensory filter
-        if 'sensory_sensitivity' in filters:
-            child_sensory = filters['sensory_sensitivity']
-            activity_sensory = activity.get('sensory_suitability', '').lower()
-            
-            # If child has high sensitivity, avoid sensory-seeking activities
-            if any(level == 'high' for level in child_sensory.values()):
-                if 'sensory-seeking' in activity_sensory:
-                    return False
-        
-        # Autism level filter - match with CSV autism_level_suitability
-        if 'autism_level' in filters:
-            autism_level = filters['autism_level']
-            activity_level = activity.get('autism_level_suitability', '')
-            
-            if autism_level:
-                # Direct matching: profile has "Level 1", "Level 2", or "Level 3", CSV has "Level 1 (mild support)", etc.
-                if autism_level not in activity_level:
-                    return False
-        
-        return True
+        if options["mode"] not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {options['mode']}")
+        if options["dense_weight"] is None:
+            options["dense_weight"] = settings.hybrid_dense_weight
+        if options["lexical_weight"] is None:
+            options["lexical_weight"] = settings.hybrid_lexical_weight
+        return options
+
+    def _retrieval_depth(self, options: Dict[str, Any], k: int) -> int:
+        """Number of dense hits a query needs: k, or the fusion depth in hybrid mode."""
+        if options["mode"] == "hybrid":
+            return max(k, settings.hybrid_candidate_depth)
+        return k
+
+    def _hybrid_results(
+        self,
+        query: str,
+        query_embedding: np.ndarray,
+        dense_indices: np.ndarray,
+        dense_distances: np.ndarray,
+        mask: Optional[np.ndarray],
+        k: int,
+        options: Dict[str, Any],
+    ) -> List[Dict[str, Any]]:
+        """Fuse the FAISS and BM25 rankings with weighted reciprocal-rank fusion."""
+        rrf_k = settings.hybrid_rrf_k
+        fused: Dict[int, float] = {}
+        distances: Dict[int, float] = {}
+        for rank, (row, distance) in enumerate(zip(dense_indices, dense_distances)):
+            if row < 0:
+                continue
+            row = int(row)
+            fused[row] = fused.get(row, 0.0) + options["dense_weight"] / (rrf_k + rank + 1)
+            distances[row] = float(distance)
+
+        depth = max(k, settings.hybrid_candidate_depth)
+        for rank, (row, score) in enumerate(self.lexical_index.search(query, depth, mask)):
+            if score <= 0:
+                break  # The rest of the ranking shares no term with the query
+            fused[row] = fused.get(row, 0.0) + options["lexical_weight"] / (rrf_k + rank + 1)
+
+        # Stable sort: ties keep dense order, then lexical order
+        ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+        results = []
+        for row, fusion_score in ranked:
+            distance = distances.get(row)
+            if distance is None:
+                # Keyword-only hit: score it against the query vector like a FAISS hit would be
+                distance = float(np.sum((self.index.reconstruct(row) - query_embedding) ** 2))
+            activity = self.metadata[row].copy()
+            activity["similarity_score"] = float(1 - distance)
+            activity["fusion_score"] = float(fusion_score)
+            results.append(activity)
+        return results
+
+    def mmr_rerank(
+        self, rows: List[int], relevance: np.ndarray, lambda_: float, top_n: Optional[int] = None
+    ) -> List[int]:
+        """Maximal marginal relevance order over stored activity vectors.
+
+        Greedily picks the candidate maximizing
+        ``lambda_ * relevance - (1 - lambda_) * max cosine similarity to those already picked``.
+        ``rows`` are store rows, ``relevance`` is in [0, 1]; returns positions into ``rows``
+        (the first ``top_n``, or all). Without stored vectors the input order is kept.
+        """
+        count = len(rows) if top_n is None else min(top_n, len(rows))
+        if self.index is None or len(rows) < 2 or lambda_ >= 1.0:
+            return list(range(count))
+
+        # The flat index holds L2-normalized vectors, so dot products are cosine similarities
+        vectors = self.index.reconstruct_batch(np.asarray(rows, dtype=np.int64))
+        similarity = vectors @ vectors.T
+        relevance = np.asarray(relevance, dtype=np.float64)
+
+        order: List[int] = []
+        max_similarity = np.zeros(len(rows))
+        available = np.ones(len(rows), dtype=bool)
+        for _ in range(count):
+            mmr = lambda_ * relevance - (1.0 - lambda_) * max_similarity
+            mmr[~available] = -np.inf
+            pick = int(np.argmax(mmr))
+            order.append(pick)
+            available[pick] = False
+            np.maximum(max_similarity, similarity[pick], out=max_similarity)
+        return order
+
+    def _build_runtime_indexes(self, signature: Optional[Tuple] = None, directory: Optional[str] = None):
+        """Build the in-memory lookup structures derived from the loaded metadata.
+
+        ``directory`` is the generation the metadata was loaded from; derived indexes
+        saved there are reused.
+        """
+        self.filter_index = ActivityFilterIndex(self.metadata)
+        self.feature_index = ActivityFeatureIndex(self.metadata)
+        self.material_index = MaterialIndex(self.metadata)
+        self.lexical_index = self._load_or_build_lexical_index(signature, directory)
+        self.duplicate_index = self._load_or_build_duplicate_index(signature, directory)
+
+    def _load_or_build_lexical_index(self, signature: Optional[Tuple], directory: Optional[str]) -> BM25Index:
+        """Reuse the persisted BM25 index when it matches the loaded files, else rebuild it."""
+        return self._load_or_build_persisted(
+            "BM25 index",
+            os.path.join(directory, LEXICAL_INDEX_FILE) if directory else None,
+            BM25Index.load,
+            lambda signature_text: BM25Index.build(
+                [self._create_text_representation(activity) for activity in self.metadata],
+                signature=signature_text,
+            ),
+            signature,
+        )
+
+    def _load_or_build_duplicate_index(self, signature: Optional[Tuple], directory: Optional[str]) -> NearDuplicateIndex:
+        """Reuse the persisted near-duplicate clusters when they match the loaded files, else rebuild them."""
+        return self._load_or_build_persisted(
+            "near-duplicate index",
+            os.path.join(directory, DUPLICATE_INDEX_FILE) if directory else None,
+            NearDuplicateIndex.load,
+            lambda signature_text: NearDuplicateIndex.build(
+                self.metadata, threshold=settings.near_duplicate_threshold, signature=signature_text
+            ),
+            signature,
+            # Clusters saved with another threshold are rebuilt
+            accept=lambda index: index.threshold == settings.near_duplicate_threshold,
+        )
+
+    def _load_or_build_persisted(
+        self, label: str, path: Optional[str], load, build, signature: Optional[Tuple], accept=None
+    ):
+        """Load a derived index saved in the generation directory if it belongs to ``signature``, else build it."""
+        if path is not None and signature is not None and os.path.exists(path):
+            try:
+                derived = load(path)
+                if derived.signature == str(signature) and derived.num_docs == len(self.metadata) \
+                        and (accept is None or accept(derived)):
+                    return derived
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable {label} {path}: {e}")
+
+        derived = build(str(signature) if signature is not None else "")
+        if path is not None and signature is not None:
+            # Built for files already on disk: persist so the next start skips the work
+            try:
+                derived.save(path)
+            except OSError as e:
+                logger.warning(f"Could not save {label} to {path}: {e}")
+        return derived
+
+    def _search_params(self, mask: Optional[np.ndarray], k: int) -> Tuple[Optional[Any], int]:
+        """Turn a filter mask into FAISS search parameters and the number of hits to request."""
+        if mask is None:
+            return None, min(k, self.index.ntotal)
+
+        search_k = min(k, int(mask.sum()))
+        if search_k == 0:
+            return None, 0
 
+        # IDSelectorBitmap reads bit (id & 7) of byte (id >> 3); the selector keeps a pointer
+        # into the packed array, so it is attached to the params object to keep it alive
+        bitmap = np.packbits(mask, bitorder='little')
+        params = faiss.SearchParameters(sel=faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap)))
+        params._bitmap = bitmap
+        return params, search_k
@@ -0,0 +1,118 @@
+import math
+import os
+
+import pytest
+
+from app.activity_store import ActivityRow, ActivityTable, current_generation, publish_generation, resolve_directory
+
+RECORDS = [
+    {"id": 1, "activity_name": "Rice bin", "duration": 15.0, "materials": "rice, cups", "notes": ""},
+    {"id": 2, "activity_name": "Café cards ✓", "duration": float("nan"), "materials": float("nan"), "notes": ""},
+    {"id": 3, "activity_name": None, "duration": 10.5, "materials": "", "notes": ""},
+]
+
+
+def _saved(tmp_path, records=RECORDS):
+    path = str(tmp_path / "activity_metadata")
+    ActivityTable.from_records(records).save(path)
+    return path
+
+
+def test_round_trip_keeps_values_and_column_kinds(tmp_path):
+    table = ActivityTable.open(_saved(tmp_path))
+
+    assert len(table) == 3
+    assert table.column_names == ["id", "activity_name", "duration", "materials", "notes"]
+    assert table._columns["id"].kind == "int"
+    assert table._columns["duration"].kind == "float"
+    assert table[0].to_dict() == RECORDS[0]
+    assert table[1]["activity_name"] == "Café cards ✓"
+    # Missing numbers stay NaN; missing text reads back as ""
+    assert math.isnan(table[1]["duration"])
+    assert table[1]["materials"] == ""
+    assert table[2]["activity_name"] == ""
+    assert table.column("id") == [1, 2, 3]
+    assert table.column("missing") == [None, None, None]
+
+
+def test_all_empty_text_column_and_empty_table(tmp_path):
+    table = ActivityTable.open(_saved(tmp_path))
+    assert table.column("notes") == ["", "", ""]
+
+    empty_path = str(tmp_path / "empty")
+    ActivityTable.from_records([]).save(empty_path)
+    empty = ActivityTable.open(empty_path)
+    assert len(empty) == 0 and list(empty) == []
+
+
+def test_rows_are_views_with_an_overlay(tmp_path):
+    table = ActivityTable.open(_saved(tmp_path))
+    row = table[-1]
+    assert isinstance(row, ActivityRow) and row.row == 2
+    copy = row.copy()
+    copy["similarity_score"] = 0.9
+    assert "similarity_score" in copy and "similarity_score" not in row
+    with pytest.raises(TypeError):
+        del copy["id"]
+    with pytest.raises(IndexError):
+        table[3]
+    assert [r.row for r in table[1:]] == [1, 2]
+
+
+def test_save_switches_generations_and_keeps_open_readers_working(tmp_path):
+    path = _saved(tmp_path)
+    reader = ActivityTable.open(path)
+    first_directory = resolve_directory(path)
+
+    ActivityTable.from_records(RECORDS[:1]).save(path)
+    ActivityTable.from_records(RECORDS[:2]).save(path)
+
+    assert len(ActivityTable.open(path)) == 2
+    assert reader[0]["activity_name"] == "Rice bin"
+    # The generation before the current one stays; older ones are removed
+    generations = sorted(name for name in os.listdir(tmp_path) if name.startswith("activity_metadata.") and
+                         os.path.isdir(tmp_path / name))
+    assert len(generations) == 2
+    assert os.path.basename(first_directory) not in generations
+
+
+def test_files_written_with_the_table_switch_in_the_same_generation(tmp_path):
+    path = str(tmp_path / "activity_metadata")
+
+    def writer(records, marker):
+        def write(directory, generation):
+            ActivityTable.from_records(records).write(directory)
+            with open(os.path.join(directory, "index.txt"), "w") as f:
+                f.write(marker)
+        return write
+
+    publish_generation(path, writer(RECORDS, "old vectors"))
+    generation = publish_generation(path, writer(RECORDS[:1], "new vectors"))
+
+    directory = resolve_directory(path)
+    assert current_generation(path) == generation
+    assert len(ActivityTable.open_directory(directory)) == 1
+    assert open(os.path.join(directory, "index.txt")).read() == "new vectors"
+
+
+def test_failed_write_leaves_the_current_generation(tmp_path):
+    path = _saved(tmp_path)
+    before = current_generation(path)
+
+    def failing(directory, generation):
+        raise OSError("disk full")
+
+    with pytest.raises(OSError):
+        publish_generation(path, failing)
+    assert current_generation(path) == before
+    assert sorted(name for name in os.listdir(tmp_path) if name.startswith("activity_metadata.1")) == [
+        os.path.basename(resolve_directory(path))
+    ]
+
+
+def test_missing_table(tmp_path):
+    path = str(tmp_path / "missing")
+    assert not ActivityTable.exists(path)
+    assert resolve_directory(path) is None
+    with pytest.raises(FileNotFoundError):
+        ActivityTable.open(path)
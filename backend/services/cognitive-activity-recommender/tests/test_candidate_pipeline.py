@@ -0,0 +1,36 @@
+import time
+
+from app.candidate_pipeline import CandidateFeatures, CandidatePipeline
+from app.timing import collect_timings
+
+
+def _candidates(count):
+    activities = [{"id": index, "activity_name": f"Activity {index}"} for index in range(count)]
+    return [(activity, CandidateFeatures(activity)) for activity in activities]
+
+
+def _slow_stage(candidates, pipeline):
+    for candidate in candidates:
+        time.sleep(0.002)
+        yield candidate
+
+
+def test_each_stage_is_timed_without_its_upstream():
+    pipeline = CandidatePipeline()
+    pipeline.filter("odd", [lambda features: None if int(features.activity_id) % 2 else "even"])
+    pipeline.then("slow", _slow_stage)
+    pipeline.then("pass", lambda candidates, p: candidates)
+    with collect_timings() as timings:
+        kept = pipeline.run(_candidates(10))
+
+    assert [activity["id"] for activity in kept] == [1, 3, 5, 7, 9]
+    assert pipeline.rejection_counts() == {"odd:even": 5}
+    durations = timings.durations_ms
+    assert set(durations) == {"odd", "slow", "pass"}
+    assert durations["slow"] >= 10
+    assert durations["odd"] < durations["slow"] and durations["pass"] < durations["slow"]
+
+
+def test_stages_are_not_timed_outside_a_collection():
+    pipeline = CandidatePipeline().then("pass", lambda candidates, p: candidates)
+    assert len(pipeline.run(_candidates(3))) == 3
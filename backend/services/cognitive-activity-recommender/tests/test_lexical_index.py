@@ -0,0 +1,70 @@
+import math
+
+import numpy as np
+
+from app.lexical_index import BM25Index, tokenize
+
+DOCS = [
+    "Sensory bin with rice and cups",
+    "Matching colour cards",
+    "Rice painting: sensory art with rice",
+    "",
+]
+
+
+def _bm25(query, docs, k1=1.5, b=0.75):
+    """Textbook Okapi BM25 (idf with +1 inside the log), for comparison."""
+    tokenized = [tokenize(d) for d in docs]
+    avg_length = sum(len(t) for t in tokenized) / len(tokenized)
+    scores = []
+    for tokens in tokenized:
+        score = 0.0
+        for term in set(tokenize(query)):
+            df = sum(1 for t in tokenized if term in t)
+            tf = tokens.count(term)
+            if not tf:
+                continue
+            idf = math.log(1.0 + (len(docs) - df + 0.5) / (df + 0.5))
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(tokens) / avg_length))
+        scores.append(score)
+    return scores
+
+
+def test_tokenize_lowercases_and_drops_single_characters():
+    assert tokenize("A Rice-Bin, 2 cups!") == ["rice", "bin", "cups"]
+
+
+def test_scores_match_reference_bm25():
+    index = BM25Index.build(DOCS)
+    for query in ("rice", "sensory rice", "colour cards", "rice rice"):
+        np.testing.assert_allclose(index.scores(query), _bm25(query, DOCS), rtol=1e-5)
+
+
+def test_unknown_terms_score_zero():
+    index = BM25Index.build(DOCS)
+    assert not index.scores("trampoline").any()
+
+
+def test_search_orders_by_score_and_respects_mask():
+    index = BM25Index.build(DOCS)
+    assert [row for row, _ in index.search("rice", k=2)] == [2, 0]
+    mask = np.array([True, True, False, True])
+    assert [row for row, _ in index.search("rice", k=2, mask=mask)] == [0, 1]
+    assert index.search("rice", k=0) == []
+    assert index.search("rice", k=3, mask=np.zeros(4, dtype=bool)) == []
+
+
+def test_save_load_round_trip(tmp_path):
+    index = BM25Index.build(DOCS, signature="gen-1")
+    path = str(tmp_path / "index.bm25.npz")
+    index.save(path)
+    loaded = BM25Index.load(path)
+
+    assert loaded.vocabulary == index.vocabulary
+    assert loaded.num_docs == index.num_docs
+    assert loaded.signature == "gen-1"
+    np.testing.assert_array_equal(loaded.indptr, index.indptr)
+    np.testing.assert_array_equal(loaded.doc_ids, index.doc_ids)
+    np.testing.assert_array_equal(loaded.weights, index.weights)
+    np.testing.assert_array_equal(loaded.scores("sensory rice"), index.scores("sensory rice"))
+    assert list(tmp_path.iterdir()) == [tmp_path / "index.bm25.npz"]
@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+
+from app.llm_providers import LLMAdmissionController, LLMOverloadedError
+
+
+def _controller(**overrides):
+    options = {"max_concurrent": 1, "max_queue": 10, "max_per_user": 5, "deadline_seconds": 5.0}
+    options.update(overrides)
+    return LLMAdmissionController(**options)
+
+
+async def _hold(controller, user, release, served):
+    async with controller.slot(user):
+        served.append(user)
+        await release.wait()
+
+
+def test_waiting_users_are_served_round_robin():
+    async def scenario():
+        controller = _controller()
+        served = []
+        gates = {}
+
+        async def call(name, user):
+            gates[name] = asyncio.Event()
+            async with controller.slot(user):
+                served.append(name)
+                await gates[name].wait()
+
+        tasks = [asyncio.create_task(call("first", "busy"))]
+        await asyncio.sleep(0)
+        # One user queues three calls before two others queue one each
+        for name, user in [("a1", "a"), ("a2", "a"), ("a3", "a"), ("b1", "b"), ("c1", "c")]:
+            tasks.append(asyncio.create_task(call(name, user)))
+            await asyncio.sleep(0)
+        assert controller.queued == 5
+        assert [p["position"] for p in controller.queue_status("a")["your_queued_requests"]] == [1, 4, 5]
+
+        for _ in range(6):
+            gates[served[-1]].set()
+            await asyncio.sleep(0.01)
+        await asyncio.gather(*tasks)
+        return served, controller.stats()
+
+    served, stats = asyncio.run(scenario())
+    assert served == ["first", "a1", "b1", "c1", "a2", "a3"]
+    assert stats["active"] == 0 and stats["queued"] == 0
+
+
+def test_full_queue_raises_overloaded():
+    async def scenario():
+        controller = _controller(max_queue=1)
+        release = asyncio.Event()
+        served = []
+        running = asyncio.create_task(_hold(controller, "a", release, served))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(_hold(controller, "b", release, served))
+        await asyncio.sleep(0)
+        with pytest.raises(LLMOverloadedError) as error:
+            await controller._acquire("c")
+        release.set()
+        await asyncio.gather(running, waiting)
+        return error.value, served
+
+    error, served = asyncio.run(scenario())
+    assert "queue is full" in str(error)
+    assert error.retry_after_seconds >= 1.0
+    assert served == ["a", "b"]
+
+
+def test_per_user_limit_raises_overloaded():
+    async def scenario():
+        controller = _controller(max_concurrent=2, max_per_user=1)
+        release = asyncio.Event()
+        running = asyncio.create_task(_hold(controller, "a", release, []))
+        await asyncio.sleep(0)
+        with pytest.raises(LLMOverloadedError):
+            async with controller.slot("a"):
+                pass
+        # Other users are not affected
+        async with controller.slot("b"):
+            pass
+        release.set()
+        await running
+
+    asyncio.run(scenario())
+
+
+def test_estimated_wait_past_deadline_is_refused_up_front():
+    async def scenario():
+        controller = _controller(deadline_seconds=5.0)
+        controller._avg_generation_seconds = 4.0
+        release = asyncio.Event()
+        running = asyncio.create_task(_hold(controller, "a", release, []))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(_hold(controller, "b", release, []))  # estimated 4s: queued
+        await asyncio.sleep(0)
+        with pytest.raises(LLMOverloadedError) as error:
+            await controller._acquire("c")  # estimated 8s: refused
+        release.set()
+        await asyncio.gather(running, waiting)
+        return error.value
+
+    error = asyncio.run(scenario())
+    assert "exceeds" in str(error)
+    assert error.retry_after_seconds == pytest.approx(8.0)
+
+
+def test_waiting_past_deadline_times_out_and_frees_the_place():
+    async def scenario():
+        controller = _controller(deadline_seconds=0.05)
+        release = asyncio.Event()
+        running = asyncio.create_task(_hold(controller, "a", release, []))
+        await asyncio.sleep(0)
+        with pytest.raises(LLMOverloadedError) as error:
+            async with controller.slot("b"):
+                pass
+        queued_after_timeout = controller.queued
+        release.set()
+        await running
+        return error.value, queued_after_timeout, controller.stats()
+
+    error, queued_after_timeout, stats = asyncio.run(scenario())
+    assert "waited" in str(error)
+    assert queued_after_timeout == 0
+    assert stats["active"] == 0
@@ -0,0 +1,116 @@
+import asyncio
+import os
+
+import pytest
+
+from app import llm_cache, llm_providers
+from app.llm_cache import LLMResponseCache, bypass_llm_cache, cache_bypassed, cache_key, hold_llm_responses
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now[0])
+    return now
+
+
+def _get(cache, key):
+    return asyncio.run(cache.get(key))
+
+
+def _put(cache, key, response):
+    asyncio.run(cache.put(key, response))
+
+
+def test_cache_key_depends_on_model_and_both_prompts():
+    key = cache_key("llama3", "system", "user")
+    assert key == cache_key("llama3", "system", "user")
+    assert len({key, cache_key("mistral", "system", "user"), cache_key("llama3", "other", "user"),
+                cache_key("llama3", "system", "other")}) == 4
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = LLMResponseCache(max_size=4, ttl_seconds=60)
+    _put(cache, "k", "plan")
+    clock[0] += 60
+    assert _get(cache, "k") == "plan"
+    clock[0] += 1
+    assert _get(cache, "k") is None
+    assert cache.stats()["size"] == 0
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = LLMResponseCache(max_size=2, ttl_seconds=60)
+    _put(cache, "a", "A")
+    _put(cache, "b", "B")
+    assert _get(cache, "a") == "A"  # "b" is now the least recently used
+    _put(cache, "c", "C")
+    assert _get(cache, "b") is None
+    assert _get(cache, "a") == "A" and _get(cache, "c") == "C"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_empty_responses_are_not_cached():
+    cache = LLMResponseCache()
+    _put(cache, "k", "")
+    assert _get(cache, "k") is None
+
+
+def test_bypass_skips_lookup_but_still_refreshes_the_entry():
+    cache = LLMResponseCache()
+    _put(cache, "k", "old")
+    with bypass_llm_cache():
+        assert cache_bypassed()
+        assert _get(cache, "k") is None
+        _put(cache, "k", "new")
+    assert not cache_bypassed()
+    assert _get(cache, "k") == "new"
+    stats = cache.stats()
+    assert stats["bypassed"] == 1 and stats["hits"] == 1 and stats["misses"] == 0
+
+
+class _EchoProvider(llm_providers.LLMProvider):
+    model = "echo"
+
+    async def _complete(self, system_prompt, user_prompt):
+        return f"{system_prompt}:{user_prompt}"
+
+
+def test_held_responses_are_cached_only_when_the_caller_stores_them(monkeypatch):
+    cache = LLMResponseCache()
+    monkeypatch.setattr(llm_providers, "get_llm_cache", lambda: cache)
+    provider = _EchoProvider()
+    key = cache_key("echo", "system", "user")
+
+    with hold_llm_responses() as held:
+        assert asyncio.run(provider.generate_text("system", "user")) == "system:user"
+    assert held == {key: "system:user"}
+    assert _get(cache, key) is None
+
+    asyncio.run(cache.put_all(held))
+    assert _get(cache, key) == "system:user"
+
+
+def test_disk_entries_survive_a_new_cache_and_expire(tmp_path, clock):
+    directory = str(tmp_path / "llm_cache")
+    _put(LLMResponseCache(ttl_seconds=60, directory=directory), "k", "plan")
+
+    fresh = LLMResponseCache(ttl_seconds=60, directory=directory)
+    assert _get(fresh, "k") == "plan"
+    assert fresh.stats()["disk_hits"] == 1
+
+    clock[0] += 61
+    assert _get(LLMResponseCache(ttl_seconds=60, directory=directory), "k") is None
+    assert os.listdir(directory) == []
+
+
+def test_disk_is_pruned_to_the_newest_entries(tmp_path):
+    directory = str(tmp_path / "llm_cache")
+    cache = LLMResponseCache(directory=directory, max_disk_entries=2)
+    for index, key in enumerate(["a", "b", "c"]):
+        _put(cache, key, key.upper())
+        path = os.path.join(directory, f"{key}.json")
+        if os.path.exists(path):
+            os.utime(path, (index, index))
+    assert sorted(os.listdir(directory)) == ["b.json", "c.json"]
@@ -0,0 +1,100 @@
+import json
+import random
+
+import pytest
+
+from app.plan_stream_parser import PlanStreamParser
+
+PLAN = {
+    "plan_type": "Daily",
+    "plan_name": "Quiet \"morning\" {plan}",
+    "schedule": [
+        {
+            "phase": "Warm-up",
+            "order": 1,
+            "activities": [{"activity_id": "12", "activity_name": "Rice bin [sensory]", "domain": "Sensory"}],
+        },
+        {
+            "phase": "Core",
+            "order": 2,
+            "activities": [
+                {"activity_id": "7", "activity_name": "Path\\with\\backslashes", "domain": "Fine Motor"},
+                {"activity_id": "8", "activity_name": "Cards, \"matching\"", "domain": "Cognitive"},
+            ],
+        },
+    ],
+}
+TEXT = "```json\n" + json.dumps(PLAN, indent=2) + "\n```\ntrailing {not: json}"
+EXPECTED = [
+    ("activity", 0, "Warm-up", "12"),
+    ("phase", 0, "Warm-up", None),
+    ("activity", 1, "Core", "7"),
+    ("activity", 1, "Core", "8"),
+    ("phase", 1, "Core", None),
+]
+
+
+def _summary(items):
+    return [
+        (item.kind, item.phase_index, item.phase_name, item.value.get("activity_id") if item.kind == "activity" else None)
+        for item in items
+    ]
+
+
+def _feed_all(chunks):
+    parser = PlanStreamParser()
+    items = [item for chunk in chunks for item in parser.feed(chunk)]
+    return parser, items
+
+
+def test_whole_response_in_one_chunk():
+    parser, items = _feed_all([TEXT])
+    assert _summary(items) == EXPECTED
+    assert parser.done
+    assert items[1].value == PLAN["schedule"][0]
+    assert items[3].value == PLAN["schedule"][1]["activities"][1]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64])
+def test_fixed_size_chunks(size):
+    _, items = _feed_all([TEXT[i:i + size] for i in range(0, len(TEXT), size)])
+    assert _summary(items) == EXPECTED
+
+
+def test_random_chunk_boundaries():
+    rng = random.Random(7)
+    for _ in range(50):
+        cuts = sorted(rng.sample(range(1, len(TEXT)), rng.randint(1, 40)))
+        chunks = [TEXT[start:end] for start, end in zip([0] + cuts, cuts + [len(TEXT)])]
+        _, items = _feed_all(chunks)
+        assert _summary(items) == EXPECTED
+
+
+def test_escapes_split_across_chunks():
+    # Cut right after each backslash so the escaped character starts the next chunk
+    chunks, start = [], 0
+    for i, char in enumerate(TEXT):
+        if char == "\\":
+            chunks.append(TEXT[start:i + 1])
+            start = i + 1
+    chunks.append(TEXT[start:])
+    _, items = _feed_all(chunks)
+    assert items[2].value["activity_name"] == "Path\\with\\backslashes"
+    assert items[3].value["activity_name"] == 'Cards, "matching"'
+
+
+def test_only_the_open_phase_stays_buffered():
+    parser = PlanStreamParser()
+    closing_brace = TEXT.index('"phase": "Core"')
+    for i in range(0, closing_brace, 5):
+        parser.feed(TEXT[i:min(i + 5, closing_brace)])
+    assert len(parser._buffer) < 40
+    assert parser._buffer.lstrip().startswith("{")
+
+
+def test_invalid_item_is_skipped_and_feeding_after_done_is_ignored():
+    text = '{"schedule": [{"phase": "Core", "activities": [{"activity_id": 1, bad}, {"activity_id": "2"}]}]}'
+    parser, items = _feed_all([text[i:i + 4] for i in range(0, len(text), 4)])
+    assert [(item.kind, item.value.get("activity_id")) for item in items if item.kind == "activity"] == [("activity", "2")]
+    assert parser.done
+    assert parser.feed('{"schedule": []}') == []
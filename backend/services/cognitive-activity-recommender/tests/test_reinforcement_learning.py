@@ -0,0 +1,55 @@
+import math
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.config import settings
+from app.reinforcement_learning import DECAY_EPOCH, decay_log_weight, fold_decay
+
+
+@pytest.fixture
+def half_life(monkeypatch):
+    monkeypatch.setattr(settings, "rl_half_life_days", 10.0)
+    return timedelta(days=10)
+
+
+def test_decay_log_weight_grows_by_log_2_per_half_life(half_life):
+    assert decay_log_weight(DECAY_EPOCH) == 0.0
+    assert decay_log_weight(DECAY_EPOCH + half_life) == pytest.approx(math.log(2))
+    assert decay_log_weight(DECAY_EPOCH - 3 * half_life) == pytest.approx(-3 * math.log(2))
+
+
+def test_decay_log_weight_reads_aware_times_as_utc(half_life):
+    moment = datetime(2026, 5, 1, 12, 0)
+    aware = moment.replace(tzinfo=timezone.utc).astimezone(timezone(timedelta(hours=5, minutes=30)))
+    assert decay_log_weight(aware) == pytest.approx(decay_log_weight(moment))
+
+
+def test_first_fold_is_the_outcome_itself():
+    assert fold_decay(None, 0.0, 1.5, 0.8) == (1.5, 0.8)
+
+
+def test_fold_weights_the_newer_outcome_by_its_decay(half_life):
+    old = decay_log_weight(DECAY_EPOCH)
+    new = decay_log_weight(DECAY_EPOCH + half_life)
+    log_weight, mean = fold_decay(*fold_decay(None, 0.0, old, 0.0), new, 1.0)
+    # Weights 1 and 2: the outcome one half-life newer counts twice as much
+    assert log_weight == pytest.approx(math.log(3))
+    assert mean == pytest.approx(2 / 3)
+
+
+def test_fold_is_order_independent():
+    outcomes = [(3.0, 0.2), (7.5, 0.9), (5.25, 0.6)]
+    forward = (None, 0.0)
+    for outcome in outcomes:
+        forward = fold_decay(*forward, *outcome)
+    backward = (None, 0.0)
+    for outcome in reversed(outcomes):
+        backward = fold_decay(*backward, *outcome)
+    assert forward == pytest.approx(backward)
+
+
+def test_fold_does_not_overflow_with_large_log_weights():
+    log_weight, mean = fold_decay(*fold_decay(None, 0.0, 5000.0, 0.5), 5000.0, 1.0)
+    assert log_weight == pytest.approx(5000.0 + math.log(2))
+    assert mean == pytest.approx(0.75)
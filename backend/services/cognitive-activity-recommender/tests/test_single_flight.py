@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from app.single_flight import SingleFlight, request_key
+
+
+def test_request_key_ignores_dict_order():
+    assert request_key("p1", {"a": 1, "b": [1, 2]}) == request_key("p1", {"b": [1, 2], "a": 1})
+    assert request_key("p1", {"a": 1}) != request_key("p1", {"a": 2})
+    assert request_key("p1", {"a": 1}, False) != request_key("p1", {"a": 1}, True)
+
+
+def test_concurrent_calls_share_one_execution():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"plan": "shared"}
+
+        results = await asyncio.gather(*[flight.run("k", compute) for _ in range(4)])
+        later = await flight.run("k", compute)
+        return results, later, calls, flight.stats()
+
+    results, later, calls, stats = asyncio.run(scenario())
+    assert all(result is results[0] for result in results)
+    assert later == {"plan": "shared"} and later is not results[0]
+    assert len(calls) == 2
+    assert stats == {"in_flight": 0, "executions": 2, "coalesced": 3}
+
+
+def test_cancelling_the_first_caller_does_not_cancel_the_others():
+    async def scenario():
+        flight = SingleFlight()
+        started = asyncio.Event()
+        finish = asyncio.Event()
+
+        async def compute():
+            started.set()
+            await finish.wait()
+            return "plan"
+
+        first = asyncio.create_task(flight.run("k", compute))
+        await started.wait()
+        second = asyncio.create_task(flight.run("k", compute))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        finish.set()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second, flight.stats()
+
+    result, stats = asyncio.run(scenario())
+    assert result == "plan"
+    assert stats["executions"] == 1 and stats["in_flight"] == 0
+
+
+def test_errors_are_shared_and_release_the_key():
+    async def scenario():
+        flight = SingleFlight()
+        attempts = []
+
+        async def failing():
+            attempts.append(1)
+            await asyncio.sleep(0.01)
+            raise ValueError("Profile not found")
+
+        results = await asyncio.gather(flight.run("k", failing), flight.run("k", failing), return_exceptions=True)
+        with pytest.raises(ValueError):
+            await flight.run("k", failing)
+        return results, attempts
+
+    results, attempts = asyncio.run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert len(attempts) == 2